@@ -0,0 +1,196 @@
+import matplotlib
+matplotlib.use('Agg')
+
+import os
+import io
+import json
+import time
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+
+from field_matching_utils import *
+from io_utils import *
+from score_utils import *
+
+
+def run_completeness_task(data_path, reference_path, cc_levels=(None,), chunksize=None):
+
+    """
+    Run the dataset-level and record-level completeness checks for one metadata file and several levels of the
+    reference dictionary without any user interaction or plotting. The header is matched and the records are read
+    once for all levels (see score_utils.multi_level_completeness_check). Field matching uses the alias index
+    of the reference dictionary, including mappings learned in previous user-assisted runs.
+
+    :param data_path: Path to dataset metadata file or directory of DICOM files
+    :type data_path: str
+    :param reference_path: Path to metadata reference dictionary
+    :type reference_path: str
+    :param cc_levels: Levels at which completeness should be assessed. None uses all fields.
+    :type cc_levels: List[str]
+    :param chunksize: Number of records read per chunk in the record-level check, defaults to None which loads the full file
+    :type chunksize: int
+    :return: List with a dictionary with the completeness results for each level
+    :rtype: List[Dictionary]
+
+    """
+
+    results = [{'data_path': data_path, 'cc_level': cc_level, 'status': 'ok'} for cc_level in cc_levels]
+    log = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(log):
+            flat_dictionary = load_flat_dictionary(reference_path)
+            alias_index = load_alias_index(reference_path)
+
+            field_matching_methods = {
+                'dictionary':(True,{'alias_index':alias_index}),
+                'UA':(False,None),
+            }
+            multi_level_report = multi_level_completeness_check(data_path, flat_dictionary, list(cc_levels),
+                                                                field_matching_methods, chunksize=chunksize)
+
+        for result in results:
+            level_report = multi_level_report['levels'][result['cc_level']]
+            record_report = level_report['record_completeness']
+            missing_rows_df = record_report['missing_rows_stats_df']
+            n_complete = missing_rows_df.loc[missing_rows_df['Missing Values per Record']==0, 'Number of Records'].sum()
+
+            result.update({
+                'required_fields': level_report['required_fields'],
+                'available_header_map': level_report['available_header_map'],
+                'missing_headers': level_report['missing_headers'],
+                'unexpected_headers': level_report['unexpected_headers'],
+                'completeness_score': level_report['completeness_score'],
+                'total_records': int(record_report['total_records']),
+                'complete_records': int(n_complete),
+                'missing_values_per_record': {int(k): int(v) for k, v in zip(missing_rows_df['Missing Values per Record'], missing_rows_df['Number of Records'])},
+                'required_field_availability': {k: float(v) for k, v in record_report['required_column_completeness']['Available (%)'].items()},
+            })
+    except Exception as e:
+        for result in results:
+            result['status'] = 'error'
+            result['error'] = f"{type(e).__name__}: {e}"
+            result['log'] = log.getvalue()
+    return results
+
+
+def summarize_batch_results(results):
+
+    """
+    Summarize batch completeness results as a table with one row per metadata file and level.
+
+    :param results: List of results returned by run_completeness_task
+    :type results: List[Dictionary]
+    :return: Pandas dataframe with the summary of each result
+    :rtype: pd.DataFrame
+
+    """
+
+    rows = []
+    for result in results:
+        row = {
+            'data_path': result['data_path'],
+            'cc_level': result['cc_level'],
+            'status': result['status'],
+        }
+        if result['status'] == 'ok':
+            total_records = result['total_records']
+            availability = list(result['required_field_availability'].values())
+            row.update({
+                'completeness_score': result['completeness_score'],
+                'required_fields': len(result['required_fields']),
+                'matched_fields': len(result['available_header_map']),
+                'total_records': total_records,
+                'complete_records': result['complete_records'],
+                'complete_records_percentage': 100*result['complete_records']/total_records if total_records else 0.0,
+                'mean_required_field_availability': sum(availability)/len(availability) if availability else 0.0,
+            })
+        else:
+            row['error'] = result['error']
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def run_batch(data_paths, reference_path, cc_levels, output_dir='output', n_workers=None, chunksize=None):
+
+    """
+    Run completeness checks for every combination of metadata file and reference dictionary level
+    across a pool of worker processes, and write one consolidated JSON report and one CSV summary for the run.
+    Each metadata file is processed by one worker which evaluates all levels in a single pass.
+
+    :param data_paths: Paths to dataset metadata files or directories of DICOM files
+    :type data_paths: List[str]
+    :param reference_path: Path to metadata reference dictionary
+    :type reference_path: str
+    :param cc_levels: Levels at which completeness should be assessed. None uses all fields.
+    :type cc_levels: List[str]
+    :param output_dir: Directory in which the reports are saved
+    :type output_dir: str
+    :param n_workers: Number of worker processes, defaults to None which uses the number of CPUs
+    :type n_workers: int
+    :param chunksize: Number of records read per chunk in the record-level check, defaults to None which loads the full files
+    :type chunksize: int
+    :return: Paths to the JSON report and the CSV summary
+    :rtype: Tuple[str]
+
+    """
+
+    os.makedirs(output_dir, exist_ok=True)
+    # Build the alias index cache once before the workers read it
+    load_alias_index(reference_path)
+
+    file_results = [None]*len(data_paths)
+    start_time = time.time()
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = {executor.submit(run_completeness_task, data_path, reference_path, cc_levels, chunksize): i
+                   for i, data_path in enumerate(data_paths)}
+        for n_done, future in enumerate(as_completed(futures), start=1):
+            i = futures[future]
+            file_results[i] = future.result()
+            print(f"[{n_done}/{len(data_paths)}] {os.path.basename(data_paths[i])}: {file_results[i][0]['status']}")
+    results = [result for level_results in file_results for result in level_results]
+
+    timestr = time.strftime("%Y%m%d_%H%M%S")
+    report_path = os.path.join(output_dir, f'completeness_report_{timestr}.json')
+    summary_path = os.path.join(output_dir, f'completeness_summary_{timestr}.csv')
+    report = {
+        'reference_path': reference_path,
+        'cc_levels': cc_levels,
+        'run_time_seconds': time.time() - start_time,
+        'results': results,
+    }
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    summarize_batch_results(results).to_csv(summary_path, index=False)
+
+    print(f"Saved completeness report: {report_path}")
+    print(f"Saved completeness summary: {summary_path}")
+    return report_path, summary_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run headless completeness checks for many metadata files and dictionary levels.')
+    parser.add_argument('--data_paths', type=str, nargs='*', default=[], help='Paths to dataset metadata files')
+    parser.add_argument('--data_list', type=str, default=None, help='Text file with one dataset metadata file path per line')
+    parser.add_argument('--reference_path', type=str, default='data/dm_metadata_dictionary2.json', help='Path to metadata reference dictionary')
+    parser.add_argument('--cc_levels', type=str, nargs='*', default=['Core Fields'], help='Levels at which completeness should be assessed. Use "all" for all fields.')
+    parser.add_argument('--output_dir', type=str, default='output', help='Directory in which the reports are saved')
+    parser.add_argument('--n_workers', type=int, default=None, help='Number of worker processes')
+    parser.add_argument('--chunksize', type=int, default=None, help='Number of records read per chunk for large metadata files')
+    args = parser.parse_args()
+
+    data_paths = list(args.data_paths)
+    if args.data_list is not None:
+        with open(args.data_list, 'r') as f:
+            data_paths += [line.strip() for line in f if line.strip()]
+    assert data_paths, 'No metadata file paths specified.'
+
+    cc_levels = [None if level.lower() == 'all' else level for level in args.cc_levels]
+
+    run_batch(data_paths, args.reference_path, cc_levels, output_dir=args.output_dir,
+              n_workers=args.n_workers, chunksize=args.chunksize)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,16 +12,13 @@ def main():
     parser.add_argument('--cc_level', type=str, default=None, help='The level at which completeness should be assessed.')
     args = parser.parse_args()
 
-    # metadata_reference_path = args.reference_path
-    # metadata_file_path = args.data_path
-    # completeness_check_level = args.cc_level
-    # assert metadata_reference_path is not None, 'Reference dictionary path not specified.'
-    # assert metadata_file_path is not None, 'Metadata file path not specified.'
-
-    # Hardcoded argument values
-    metadata_reference_path = 'data/dm_metadata_dictionary2.json'
-    completeness_check_level = 'Core Fields'
-    metadata_file_path ='/projects01/didsr-aiml/common_data/VinDr-Mammo/raw-images/vindr-mammo/1.0.0/metadata.csv'
+    # Hardcoded default argument values, used for arguments which are not specified
+    metadata_reference_path = args.reference_path or 'data/dm_metadata_dictionary2.json'
+    completeness_check_level = args.cc_level or 'Core Fields'
+    metadata_file_path = args.data_path or '/projects01/didsr-aiml/common_data/VinDr-Mammo/raw-images/vindr-mammo/1.0.0/metadata.csv'
+    # Only read the metadata columns matched to required fields for the record-level check.
+    # Set to False to also report completeness of the unmatched dataset columns.
+    load_matched_columns_only = True
 
     # Create output directory to store visualizations
     os.makedirs('output', exist_ok=True)
@@ -31,12 +28,17 @@ def main():
     field_aliases = get_field_item(metadata_reference_dictionary)
     required_fields = list(field_aliases.keys())
 
-    # Load the dataset metadata
-    # This step loads the dataset metadata (a multi-column CSV/XLS file) into a pandas DataFrame.
+    # Load the compiled alias index of the reference dictionary, including mappings accepted in previous user-assisted runs.
+    # The index is cached beside the reference dictionary and rebuilt when the dictionary changes.
+    alias_index = load_alias_index(metadata_reference_path)
+
+    # Load the dataset metadata header
+    # Field matching only needs the column names of the metadata file (CSV/XLS/Parquet/Feather),
+    # so the records are not parsed until the matched columns are known.
     # Each column represents a metadata attribute (e.g., 'PatientID', 'Modality'), and each row represents a data point.
-    metadata_df = load_metadata_file(metadata_file_path)
+    metadata_header = load_metadata_header(metadata_file_path)
 
-    if metadata_df is not None:
+    if metadata_header is not None:
         print(f"Assessing completeness for metadata file '{os.path.basename(metadata_file_path)}'")
 
     """
@@ -51,19 +53,21 @@ def main():
     `UA` refers to User-Assisted. Enabling this method will use either fuzzy matching or token matching using a language model
     to return likely matches for header fields that could not be automatically matched.
     For each such field, the user will receive a prompt to select a field from one of the top N most likely options (specified by 'limit').
+    The selected matches are stored with the alias index of the reference dictionary (specified by 'reference_path')
+    so that they are found by dictionary matching in later runs.
     The token matching option is disabled in this version of the code.
     """
 
     field_matching_methods = {
         'strict':(False,None),
-        'dictionary':(True,{'field_dictionary':field_aliases}),
+        'dictionary':(True,{'alias_index':alias_index}),
         'soft': (False,None),
-        'fuzzy': (False,{'threshold':80}),
-        'UA':(False,{'ranking_method':'fuzzy','limit':4})  # 'fuzzy' or 'LM'
+        'fuzzy': (False,{'similarity_threshold':80}),
+        'UA':(False,{'ranking_method':'fuzzy','limit':4,'reference_path':metadata_reference_path})  # 'fuzzy' or 'LM'
     }
 
-    if metadata_df is not None and required_fields:
-        completeness_report = dataset_level_completeness_check(metadata_df, required_fields, field_matching_methods)
+    if metadata_header is not None and required_fields:
+        completeness_report = dataset_level_completeness_check(metadata_header, required_fields, field_matching_methods)
 
         # Extract missing and unexpected headers for clarity
         available_header_map = completeness_report["available_header_map"]
@@ -99,7 +103,10 @@ def main():
         print(f"Completeness Score: {completeness_score:.2f}")
 
         # Step 7: Perform record-level completeness check
-        # This checks individual columns and rows in the metadata file and reports completion information
+        # This loads the dataset metadata into a pandas DataFrame, checks individual columns and rows
+        # and reports completion information
+        usecols = list(available_header_map.values()) or None if load_matched_columns_only else None
+        metadata_df = load_metadata_file(metadata_file_path, usecols=usecols)
         record_level_results = record_level_completeness_check(metadata_df, required_fields, available_header_map,visualize=True,savefig=False)
     else:
         # Handle cases where either the dataset or required fields failed to load.
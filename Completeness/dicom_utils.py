@@ -0,0 +1,268 @@
+import os
+import json
+import hashlib
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import pandas as pd
+import pydicom
+from pydicom.errors import InvalidDicomError
+from pydicom.multival import MultiValue
+# Functions for building a metadata table from the headers of DICOM files
+
+# Mapping from metadata reference dictionary fields (dm_metadata_dictionary2.json) to DICOM keywords.
+# For each field, the first keyword with a non-empty value in the DICOM header is used.
+# A tuple of keywords combines the values of all the keywords, e.g. Rows x Columns.
+DICOM_FIELD_MAP = {
+    'Patient ID': ['PatientID'],
+    'Patient Birth Date/Age': ['PatientAge', 'PatientBirthDate'],
+    'Patient Sex': ['PatientSex'],
+    'History/Prior': ['AdditionalPatientHistory'],
+    'Ethnicity': ['EthnicGroup'],
+    'Study ID': ['StudyID', 'AccessionNumber', 'StudyInstanceUID'],
+    'Study Date': ['StudyDate', 'AcquisitionDate'],
+    'Study Time': ['StudyTime', 'AcquisitionTime'],
+    'Modality': ['Modality'],
+    'Breast Orientation': ['ViewPosition'],
+    'Laterality': ['ImageLaterality', 'Laterality'],
+    'Image Type': ['ImageType'],
+    'Image ID': ['SOPInstanceUID'],
+    'Image Dimension': [('Rows', 'Columns')],
+    'Compression Type': ['LossyImageCompressionMethod', 'TransferSyntaxUID'],
+    'Bits Stored': ['BitsStored'],
+    'Pixel Spacing': ['PixelSpacing', 'ImagerPixelSpacing'],
+    'Manufacturer': ['Manufacturer'],
+    'Manufacturer/Model': ['ManufacturerModelName'],
+    'Manufacturer/Year': ['DateOfManufacture'],
+    'Photometric Interpretation': ['PhotometricInterpretation'],
+    'Pixel Padding Value': ['PixelPaddingValue'],
+    'Pixel Padding Range Limit': ['PixelPaddingRangeLimit'],
+    'Window Center': ['WindowCenter'],
+    'Window Width': ['WindowWidth'],
+    'Rescale Intercept': ['RescaleIntercept'],
+    'Rescale Slope': ['RescaleSlope'],
+    'Window Center & Width Explanation': ['WindowCenterWidthExplanation'],
+    'Slice Thickness': ['SliceThickness'],
+}
+
+DICOM_EXTS = ('.dcm', '.dicom')
+DICOM_INDEX_NAME = '.dcard_dicom_index.json'
+
+
+def dicom_value_to_python(value):
+    """
+    Convert a DICOM element value to a JSON serializable python value.
+    Multi-valued elements are joined with a backslash as in the DICOM standard.
+    Empty values are returned as None.
+
+    :param value: DICOM element value
+    :type value: Any
+    :return: Converted value
+    :rtype: str, int, float or None
+
+    """
+
+    if value is None or isinstance(value, bytes):
+        return None
+    if isinstance(value, (list, tuple, MultiValue)):
+        value = '\\'.join(str(v) for v in value)
+    elif isinstance(value, int):
+        return int(value)
+    elif isinstance(value, float):
+        return float(value)
+    value = str(value).strip()
+    return value if value else None
+
+
+def read_dicom_header(file_path, tag_map=None):
+    """
+    Read the header of a DICOM file, without the pixel data, and map the DICOM elements onto
+    metadata reference dictionary fields.
+
+    :param file_path: Path to DICOM file
+    :type file_path: str
+    :param tag_map: Dictionary with field names as keys and lists of DICOM keywords as values, defaults to DICOM_FIELD_MAP
+    :type tag_map: Dictionary
+    :return: Dictionary with field names as keys and header values as values, or None if the file is not a valid DICOM file
+    :rtype: Dictionary
+
+    """
+
+    if tag_map is None:
+        tag_map = DICOM_FIELD_MAP
+
+    keywords = sorted({kw for alternatives in tag_map.values() for alt in alternatives
+                       for kw in (alt if isinstance(alt, tuple) else (alt,))})
+    try:
+        ds = pydicom.dcmread(file_path, stop_before_pixels=True, specific_tags=keywords)
+    except (InvalidDicomError, OSError):
+        return None
+
+    def get_value(keyword):
+        value = ds.get(keyword, None)
+        if value is None and hasattr(ds, 'file_meta'):
+            value = ds.file_meta.get(keyword, None)
+        return dicom_value_to_python(value)
+
+    fields = {}
+    for field, alternatives in tag_map.items():
+        fields[field] = None
+        for alt in alternatives:
+            if isinstance(alt, tuple):
+                values = [get_value(kw) for kw in alt]
+                value = 'x'.join(str(v) for v in values) if all(v is not None for v in values) else None
+            else:
+                value = get_value(alt)
+            if value is not None:
+                fields[field] = value
+                break
+    return fields
+
+
+def find_dicom_files(directory, extensions=None):
+    """
+    Recursively find files in a directory and retrieve their modification times and sizes.
+
+    :param directory: Path to the root directory
+    :type directory: str
+    :param extensions: File extensions to include, e.g. DICOM_EXTS, defaults to None which includes all files
+        (DICOM files often have no extension)
+    :type extensions: Tuple[str]
+    :return: Dictionary with paths relative to the directory as keys and (mtime in ns, size) as values
+    :rtype: Dictionary
+
+    """
+
+    files = {}
+    n_skipped = 0
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        with os.scandir(current) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file() and not entry.name.startswith('.'):
+                    if extensions is None or os.path.splitext(entry.name)[1].lower() in extensions:
+                        st = entry.stat()
+                        files[os.path.relpath(entry.path, directory)] = (st.st_mtime_ns, st.st_size)
+                    else:
+                        n_skipped += 1
+    if n_skipped:
+        print(f"Skipped {n_skipped} files without one of the extensions {tuple(extensions)}.")
+    return files
+
+
+def scan_dicom_directory(directory, tag_map=None, extensions=None, n_workers=None, index_path=None, update_index=True):
+    """
+    Build a metadata table from the headers of all DICOM files in a directory tree.
+    Headers are read without pixel data across a pool of worker processes.
+    The extracted headers are persisted in a sidecar index keyed by file path, modification time and size,
+    so a re-scan only reads files which are new or have changed since the last scan.
+
+    :param directory: Path to the root directory of the DICOM files
+    :type directory: str
+    :param tag_map: Dictionary with field names as keys and lists of DICOM keywords as values, defaults to DICOM_FIELD_MAP
+    :type tag_map: Dictionary
+    :param extensions: File extensions to include, e.g. DICOM_EXTS, defaults to None which tries all files.
+        Files which are not valid DICOM files are skipped.
+    :type extensions: Tuple[str]
+    :param n_workers: Number of worker processes, defaults to None which uses the number of CPUs
+    :type n_workers: int
+    :param index_path: Path to the sidecar index file, defaults to None which uses DICOM_INDEX_NAME inside the directory
+    :type index_path: str
+    :param update_index: Flag to write the updated index to disk
+    :type update_index: bool
+    :return: Pandas dataframe with one row per DICOM file, a 'File Path' column and one column per field
+    :rtype: pd.DataFrame
+
+    """
+
+    if tag_map is None:
+        tag_map = DICOM_FIELD_MAP
+    if index_path is None:
+        index_path = os.path.join(directory, DICOM_INDEX_NAME)
+
+    # The index is only valid for the tag map it was built with
+    tag_map_hash = hashlib.sha1(json.dumps(tag_map, sort_keys=True, default=list).encode()).hexdigest()
+
+    index_entries = {}
+    if os.path.exists(index_path):
+        try:
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+            if index.get('tag_map_hash') == tag_map_hash:
+                index_entries = index.get('files', {})
+        except Exception as e:
+            print(f"Error loading DICOM index, re-scanning all files: {e}")
+
+    files = find_dicom_files(directory, extensions)
+    to_read = [path for path, (mtime, size) in files.items()
+               if path not in index_entries or index_entries[path][:2] != [mtime, size]]
+
+    print(f"Found {len(files)} files, reading {len(to_read)} new or changed headers.")
+    if to_read:
+        full_paths = [os.path.join(directory, path) for path in to_read]
+        # Send files to the workers in chunks to amortize inter-process communication
+        chunksize = max(1, min(256, len(full_paths) // (4 * (n_workers or os.cpu_count() or 1))))
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            headers = executor.map(partial(read_dicom_header, tag_map=tag_map), full_paths, chunksize=chunksize)
+            for path, header in zip(to_read, headers):
+                index_entries[path] = [*files[path], header]
+
+    # Drop files which no longer exist
+    n_removed = len(index_entries) - len(files)
+    index_entries = {path: entry for path, entry in index_entries.items() if path in files}
+
+    if update_index and (to_read or n_removed > 0):
+        try:
+            with open(index_path, 'w') as f:
+                json.dump({'tag_map_hash': tag_map_hash, 'files': index_entries}, f)
+        except OSError as e:
+            warnings.warn(f"Could not write DICOM index to {index_path}: {e}")
+
+    records = []
+    for path in sorted(index_entries):
+        header = index_entries[path][2]
+        if header is not None:
+            records.append({'File Path': path, **header})
+    if len(records) < len(index_entries):
+        print(f"Skipped {len(index_entries) - len(records)} files which are not valid DICOM files.")
+    dataset_df = pd.DataFrame(records, columns=['File Path'] + list(tag_map.keys()))
+
+    # Fields absent from every header are not part of the dataset header
+    return dataset_df.dropna(axis=1, how='all')
+
+
+def load_dataset_dicom(file_path, chunksize=None, usecols=None, dtype_backend=None, n_workers=None):
+    """
+    Load the metadata of a directory of DICOM files with the same interface as the other metadata loaders.
+    See scan_dicom_directory.
+
+    :param file_path: Path to the root directory of the DICOM files
+    :type file_path: str
+    :param chunksize: Number of rows per chunk, defaults to None which returns a dataframe
+    :type chunksize: int
+    :param usecols: Columns to keep, defaults to None which keeps all columns
+    :type usecols: List[str]
+    :param dtype_backend: Backend for the dataframe dtypes, defaults to None which uses numpy dtypes
+    :type dtype_backend: str
+    :param n_workers: Number of worker processes, defaults to None which uses the number of CPUs
+    :type n_workers: int
+    :return: Pandas dataframe with the loaded metadata, or a chunk iterator if chunksize is set
+    :rtype: pd.DataFrame
+
+    """
+
+    try:
+        data = scan_dicom_directory(file_path, n_workers=n_workers)
+        if usecols is not None:
+            data = data[[col for col in data.columns if col in usecols]]
+        if dtype_backend is not None:
+            data = data.convert_dtypes(dtype_backend=dtype_backend)
+        if chunksize is not None:
+            return (data.iloc[i:i+chunksize] for i in range(0, len(data), chunksize))
+        return data
+    except Exception as e:
+        print(f"Error loading DICOM directory: {e}")
+        return None
@@ -1,7 +1,9 @@
 import os
+import numpy as np
 from rapidfuzz import fuzz, process
-# from sentence_transformers import SentenceTransformer, util
 import re
+import json
+import hashlib
 import warnings
 
 def clean_string(s):
@@ -57,14 +59,15 @@ def soft_field_matching(dataset_fields, required_fields):
                 field_mappings[field] = dataset_field
     return field_mappings
 
-def dictionary_field_matching(dataset_fields, required_fields, field_dictionary=None):
+def dictionary_field_matching(dataset_fields, required_fields, field_dictionary=None, alias_index=None):
 
     """
     Given lists of required fields and dataset fields, returns a mapping from
     each required field to a dataset field if the required field name is found 
     in the dataset field name. If a field alias dictionary is provided, all cleaned
     aliases for each required field are checked against each dataset field to
-    find possible matches.
+    find possible matches. A precompiled alias index (see compile_alias_index and load_alias_index)
+    can be provided instead of the field alias dictionary to avoid cleaning all aliases on every call.
 
     :param dataset_fields: Header fields present in dataset metadata.
     :type dataset_fields: List[str]
@@ -72,31 +75,245 @@ def dictionary_field_matching(dataset_fields, required_fields, field_dictionary=
     :type required_fields: List[str]
     :param field_dictionary: A dictionary with the required_fields as keys and a list of common variations for each required field as values.
     :type field_dictionary: dict[str]
+    :param alias_index: A dictionary with cleaned aliases as keys and the list of fields with that alias as values.
+    :type alias_index: dict[str]
     :return: Dictionary with required_fields present in dataset_fields as keys and the corresponding dataset fields as values
     :rtype: dict[str]
 
     """
     
-    if field_dictionary is not None:
+    if alias_index is None and field_dictionary is not None:
+        alias_index = compile_alias_index({field: aliases for field, aliases in field_dictionary.items() if field in required_fields})
+
+    if alias_index is not None:
         field_mappings = {}
+        required_fields_set = set(required_fields)
 
-        dataset_fields_cleaned = [(clean_string(item), item) for item in dataset_fields]     
+        # Each required field is matched to the first dataset field with a cleaned name among its aliases
+        for header in dataset_fields:
+            for field in alias_index.get(clean_string(header), []):
+                if field in required_fields_set and field not in field_mappings:
+                    field_mappings[field] = header
 
-        for field in required_fields:
-            if field in field_dictionary:
-                possible_matches = field_dictionary[field]
-                possible_matches.append(field)
-                possible_matches_cleaned = [clean_string(item) for item in possible_matches]
-                match = next((header for clean_header,header in dataset_fields_cleaned if clean_header in possible_matches_cleaned), None)
-                if match:
-                    field_mappings[field] = match
+        # Keep the order of the required fields
+        field_mappings = {field: field_mappings[field] for field in required_fields if field in field_mappings}
     else:
         warnings.warn("Metadata field mapping dictionary path not provided.\nReturning strict matching results")
         field_mappings = strict_field_matching(dataset_fields, required_fields)
         
     return field_mappings
 
-def fuzzy_field_matching(dataset_fields, required_fields, similarity_threshold=70):
+def compile_alias_index(field_dictionary):
+
+    """
+    Compile a field alias dictionary into a hash map from cleaned aliases to field names.
+    Each field is also included as an alias of itself.
+
+    :param field_dictionary: A dictionary with field names as keys and a list of common variations for each field as values.
+    :type field_dictionary: dict[str]
+    :return: Dictionary with cleaned aliases as keys and the list of fields with that alias as values
+    :rtype: dict[str]
+
+    """
+
+    alias_index = {}
+    for field, aliases in field_dictionary.items():
+        for alias in list(aliases) + [field]:
+            fields = alias_index.setdefault(clean_string(alias), [])
+            if field not in fields:
+                fields.append(field)
+    return alias_index
+
+def get_alias_index_path(reference_path):
+
+    """
+    Path of the alias index cache file stored beside a metadata reference dictionary.
+
+    :param reference_path: Path to metadata reference dictionary
+    :type reference_path: str
+    :return: Path to alias index cache file
+    :rtype: str
+
+    """
+
+    return os.path.splitext(reference_path)[0] + '_alias_index.json'
+
+def load_alias_index(reference_path, include_learned=True):
+
+    """
+    Load the compiled alias index for all fields of a metadata reference dictionary.
+    The index is cached on disk beside the reference dictionary and rebuilt when the content
+    hash of the reference dictionary changes. Field mappings accepted in user-assisted matching
+    (see record_learned_mappings) are stored in the same cache and included in the index.
+
+    :param reference_path: Path to metadata reference dictionary
+    :type reference_path: str
+    :param include_learned: Flag to include learned field mappings in the index
+    :type include_learned: bool
+    :return: Dictionary with cleaned aliases as keys and the list of fields with that alias as values
+    :rtype: dict[str]
+
+    """
+
+    cache = load_alias_index_cache(reference_path)
+    alias_index = {alias: list(fields) for alias, fields in cache['aliases'].items()}
+    if include_learned:
+        for alias, field in cache['learned'].items():
+            fields = alias_index.setdefault(alias, [])
+            if field not in fields:
+                fields.append(field)
+    return alias_index
+
+def load_alias_index_cache(reference_path):
+
+    """
+    Load the alias index cache of a metadata reference dictionary, rebuilding the compiled aliases
+    if the cache is missing or was built from a different version of the reference dictionary.
+
+    :param reference_path: Path to metadata reference dictionary
+    :type reference_path: str
+    :return: Dictionary with the reference dictionary hash, compiled aliases and learned mappings
+    :rtype: Dictionary
+
+    """
+
+    with open(reference_path, 'rb') as f:
+        reference_bytes = f.read()
+    dictionary_hash = hashlib.sha256(reference_bytes).hexdigest()
+
+    cache_path = get_alias_index_path(reference_path)
+    cache = None
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r') as f:
+                cache = json.load(f)
+        except Exception as e:
+            print(f"Error loading alias index, rebuilding: {e}")
+
+    if cache is None or cache.get('dictionary_hash') != dictionary_hash:
+        field_dictionary = {}
+        collect_field_aliases(json.loads(reference_bytes), field_dictionary)
+        learned = cache.get('learned', {}) if cache is not None else {}
+        cache = {
+            'dictionary_hash': dictionary_hash,
+            'aliases': compile_alias_index(field_dictionary),
+            # Learned mappings to fields removed from the reference dictionary are dropped
+            'learned': {alias: field for alias, field in learned.items() if field in field_dictionary},
+        }
+        save_alias_index_cache(reference_path, cache)
+    return cache
+
+def save_alias_index_cache(reference_path, cache):
+
+    """
+    Write the alias index cache of a metadata reference dictionary to disk.
+
+    :param reference_path: Path to metadata reference dictionary
+    :type reference_path: str
+    :param cache: Dictionary with the reference dictionary hash, compiled aliases and learned mappings
+    :type cache: Dictionary
+    :return: 0
+    :rtype: int
+
+    """
+
+    cache_path = get_alias_index_path(reference_path)
+    try:
+        with open(cache_path + '.tmp', 'w') as f:
+            json.dump(cache, f, indent=1)
+        os.replace(cache_path + '.tmp', cache_path)
+    except OSError as e:
+        warnings.warn(f"Could not write alias index to {cache_path}: {e}")
+    return 0
+
+def collect_field_aliases(d, field_dictionary):
+
+    """
+    Recursively collect the aliases of all fields in a nested metadata reference dictionary.
+    Fields are the nested dictionaries which contain an 'aliases' item.
+
+    :param d: Nested metadata reference dictionary
+    :type d: Dictionary
+    :param field_dictionary: Dictionary which is filled with field names as keys and lists of aliases as values
+    :type field_dictionary: Dictionary
+    :return: 0
+    :rtype: int
+
+    """
+
+    for key, value in d.items():
+        if isinstance(value, dict):
+            if 'aliases' in value:
+                field_dictionary.setdefault(key, value['aliases'])
+            else:
+                collect_field_aliases(value, field_dictionary)
+    return 0
+
+def record_learned_mappings(reference_path, field_mappings):
+
+    """
+    Store accepted field mappings in the alias index cache of a metadata reference dictionary,
+    so that the same dataset fields are matched by dictionary matching in later runs.
+
+    :param reference_path: Path to metadata reference dictionary
+    :type reference_path: str
+    :param field_mappings: Dictionary with required fields as keys and the matched dataset fields as values
+    :type field_mappings: Dictionary
+    :return: 0
+    :rtype: int
+
+    """
+
+    if not field_mappings:
+        return 0
+    cache = load_alias_index_cache(reference_path)
+    for field, header in field_mappings.items():
+        cache['learned'][clean_string(header)] = field
+    save_alias_index_cache(reference_path, cache)
+    return 0
+
+def fuzzy_score_matrix(dataset_fields, required_fields, scorer=fuzz.ratio, processor=None, workers=-1):
+
+    """Computes the fuzzy similarity scores between every required field and every dataset field
+    in a single multi-threaded rapidfuzz cdist call. The last computed matrix for each scorer and processor
+    is cached, and requests for subsets of its fields (e.g. the unmatched fields passed to user-assisted matching)
+    are answered by slicing the cached matrix.
+
+    :param dataset_fields: Header fields present in dataset metadata.
+    :type dataset_fields: List[str]
+    :param required_fields: Fields of interest.
+    :type required_fields: List[str]
+    :param scorer: rapidfuzz scorer used to compare the fields, defaults to fuzz.ratio
+    :type scorer: Callable
+    :param processor: Preprocessing function applied to the fields before scoring (e.g. clean_string), defaults to None
+    :type processor: Callable
+    :param workers: Number of threads used for scoring, defaults to -1 which uses all cores
+    :type workers: int
+    :return: Matrix of similarity scores with one row per required field and one column per dataset field
+    :rtype: np.ndarray
+
+    """
+
+    cache_key = (scorer, processor)
+    if cache_key in _score_matrix_cache:
+        cached_required, cached_dataset, cached_scores = _score_matrix_cache[cache_key]
+        row_idx = [cached_required.get(field) for field in required_fields]
+        col_idx = [cached_dataset.get(field) for field in dataset_fields]
+        if None not in row_idx and None not in col_idx:
+            return cached_scores[np.ix_(row_idx, col_idx)]
+
+    scores = process.cdist(required_fields, dataset_fields, scorer=scorer, processor=processor, workers=workers)
+    _score_matrix_cache[cache_key] = (
+        {field: i for i, field in enumerate(required_fields)},
+        {field: i for i, field in enumerate(dataset_fields)},
+        scores,
+    )
+    return scores
+
+# Last score matrix computed by fuzzy_score_matrix for each (scorer, processor)
+_score_matrix_cache = {}
+
+def fuzzy_field_matching(dataset_fields, required_fields, similarity_threshold=70, scorer=fuzz.ratio, processor=None, resolve_conflicts=False, workers=-1):
 
     """Given lists of required fields and dataset fields, returns a mapping from
     each required field to a dataset field using fuzzy scoring.
@@ -107,27 +324,48 @@ def fuzzy_field_matching(dataset_fields, required_fields, similarity_threshold=7
     :type required_fields: List[str]
     :param similarity_threshold: Fuzzy score threshold which determines if the match returned through fuzzy matching is acceptable or not.
     :type similarity_threshold: int
+    :param scorer: rapidfuzz scorer used to compare the fields, defaults to fuzz.ratio
+    :type scorer: Callable
+    :param processor: Preprocessing function applied to the fields before scoring, defaults to None
+    :type processor: Callable
+    :param resolve_conflicts: Flag to match each dataset field to at most one required field.
+        Matches are then assigned in order of decreasing score.
+    :type resolve_conflicts: bool
+    :param workers: Number of threads used for scoring, defaults to -1 which uses all cores
+    :type workers: int
     :return: Dictionary with required_fields present in dataset_fields as keys and the corresponding dataset fields as values
     :rtype: Dictionary
 
     """
 
     field_mappings = {}
-
-    # Perform fuzzy matching
-    for required_field in required_fields:
-        # Find the best match for each required field in dataset headers
-        result = process.extractOne(required_field, dataset_fields, scorer=fuzz.ratio)
-        if result is not None:
-            match, score, _ = result  # Unpack the match, score, and additional data
-            if score >= similarity_threshold:
-                field_mappings[required_field] = match
+    if not dataset_fields or not required_fields:
+        return field_mappings
+
+    scores = fuzzy_score_matrix(dataset_fields, required_fields, scorer=scorer, processor=processor, workers=workers)
+
+    if resolve_conflicts:
+        # Assign the highest scoring pairs first, skipping fields which are already matched
+        rows, cols = np.nonzero(scores >= similarity_threshold)
+        order = np.argsort(-scores[rows, cols], kind='stable')
+        matched_dataset_fields = set()
+        for i, j in zip(rows[order], cols[order]):
+            if required_fields[i] not in field_mappings and j not in matched_dataset_fields:
+                field_mappings[required_fields[i]] = dataset_fields[j]
+                matched_dataset_fields.add(j)
+        field_mappings = {field: field_mappings[field] for field in required_fields if field in field_mappings}
+    else:
+        # Best match for each required field in dataset headers
+        best = scores.argmax(axis=1)
+        for i, required_field in enumerate(required_fields):
+            if scores[i, best[i]] >= similarity_threshold:
+                field_mappings[required_field] = dataset_fields[best[i]]
 
     return field_mappings
 
 
 
-def get_fuzzy_matches(dataset_fields, required_fields, limit = 5):
+def get_fuzzy_matches(dataset_fields, required_fields, limit = 5, scorer=fuzz.ratio, processor=None, workers=-1):
 
     
     """Given lists of required fields and dataset fields, returns the top N
@@ -139,23 +377,152 @@ def get_fuzzy_matches(dataset_fields, required_fields, limit = 5):
     :type required_fields: List[str]
     :param limit: Number of matches to return
     :type limit: int
+    :param scorer: rapidfuzz scorer used to compare the fields, defaults to fuzz.ratio
+    :type scorer: Callable
+    :param processor: Preprocessing function applied to the fields before scoring, defaults to None
+    :type processor: Callable
+    :param workers: Number of threads used for scoring, defaults to -1 which uses all cores
+    :type workers: int
     :return: Dictionary with required_fields as keys and the N most similar dataset_fields along with similarity scores as values
     :rtype: Dictionary
     """
 
-    matches = {}
+    matches = {field: [] for field in required_fields}
+    if not dataset_fields or not required_fields:
+        return matches
+
+    scores = fuzzy_score_matrix(dataset_fields, required_fields, scorer=scorer, processor=processor, workers=workers)
+    top_n = np.argsort(-scores, axis=1, kind='stable')[:, :limit]
 
-    for required_field in required_fields:
-        results = process.extract(required_field, dataset_fields, scorer=fuzz.ratio, limit=limit)
-        matches[required_field] = [(field_name, sim_score) for field_name, sim_score, _ in results]
+    for i, required_field in enumerate(required_fields):
+        matches[required_field] = [(dataset_fields[j], float(scores[i, j])) for j in top_n[i]]
 
     return matches
 
-def get_LM_matches(dataset_fields, required_fields, limit = 5):
+# Default SentenceTransformer model used for LM matching, a Hugging Face Hub name (downloaded on first use) or a local path.
+# Can be overridden with the DCARD_LM_MODEL_PATH environment variable or the model_path arguments.
+LM_MODEL_PATH = os.environ.get('DCARD_LM_MODEL_PATH', 'sentence-transformers/all-MiniLM-L6-v2')
+
+# SentenceTransformer models loaded in this process, keyed by model path
+_lm_model_cache = {}
+
+def load_lm_model(model_path=None):
+
+    """Loads a SentenceTransformer model from a local path or the Hugging Face Hub on the CPU. Each model is loaded
+    only once per process and reused by later calls.
+
+    :param model_path: Name or local path of the SentenceTransformer model, defaults to None which uses LM_MODEL_PATH
+    :type model_path: str
+    :return: SentenceTransformer model
+    :rtype: SentenceTransformer
+
+    """
+
+    if model_path is None:
+        model_path = LM_MODEL_PATH
+    if model_path not in _lm_model_cache:
+        from sentence_transformers import SentenceTransformer
+        _lm_model_cache[model_path] = SentenceTransformer(model_path, device='cpu')
+    return _lm_model_cache[model_path]
+
+def get_lm_encoder(model_path=None):
+
+    """Returns an encoder function which embeds a list of strings with a SentenceTransformer model
+    as L2-normalized float32 vectors.
+
+    :param model_path: Name or local path of the SentenceTransformer model, defaults to None which uses LM_MODEL_PATH
+    :type model_path: str
+    :return: Encoder function taking a list of strings and returning an array of shape (n_strings, dim)
+    :rtype: Callable
+
+    """
+
+    model = load_lm_model(model_path)
+
+    def encoder(texts):
+        return model.encode(list(texts), batch_size=256, convert_to_numpy=True, normalize_embeddings=True).astype(np.float32)
+
+    encoder.encoder_id = model_path if model_path is not None else LM_MODEL_PATH
+    return encoder
+
+def hashing_encoder(texts, dim=256):
+
+    """Deterministic stand-in for a language model encoder which does not require any model files.
+    Strings are embedded as L2-normalized hashed counts of their character trigrams,
+    so similarity reflects shared substrings rather than meaning. Useful for testing the LM matching code path.
+
+    :param texts: Strings to embed
+    :type texts: List[str]
+    :param dim: Embedding dimension
+    :type dim: int
+    :return: Array of shape (n_strings, dim)
+    :rtype: np.ndarray
+
+    """
+
+    embeddings = np.zeros((len(texts), dim), dtype=np.float32)
+    for i, text in enumerate(texts):
+        padded = f'  {clean_string(text)} '
+        for k in range(len(padded) - 2):
+            h = int.from_bytes(hashlib.md5(padded[k:k+3].encode()).digest()[:4], 'little')
+            embeddings[i, h % dim] += 1.0
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.where(norms > 0, norms, 1.0)
+
+hashing_encoder.encoder_id = 'hashing_encoder'
+
+def load_reference_embeddings(reference_path, encoder):
+
+    """Loads the embeddings of all fields and aliases of a metadata reference dictionary.
+    The embeddings are computed once and stored beside the reference dictionary as a float32 matrix
+    in a file keyed by the hash of the reference dictionary content and the encoder.
+
+    :param reference_path: Path to metadata reference dictionary
+    :type reference_path: str
+    :param encoder: Encoder function returning L2-normalized embeddings (see get_lm_encoder)
+    :type encoder: Callable
+    :return: List with the field name of each embedding row, and the float32 embedding matrix
+    :rtype: Tuple[List[str], np.ndarray]
+
+    """
+
+    with open(reference_path, 'rb') as f:
+        reference_bytes = f.read()
+    encoder_id = getattr(encoder, 'encoder_id', getattr(encoder, '__name__', repr(encoder)))
+    key = hashlib.sha256(reference_bytes + encoder_id.encode()).hexdigest()[:16]
+    embeddings_path = os.path.splitext(reference_path)[0] + f'_embeddings_{key}.npz'
+
+    if os.path.exists(embeddings_path):
+        try:
+            cached = np.load(embeddings_path, allow_pickle=False)
+            return cached['fields'].tolist(), cached['embeddings']
+        except Exception as e:
+            print(f"Error loading reference embeddings, recomputing: {e}")
+
+    field_dictionary = {}
+    collect_field_aliases(json.loads(reference_bytes), field_dictionary)
+    fields, texts = [], []
+    for field, aliases in field_dictionary.items():
+        for text in dict.fromkeys([field] + [alias for alias in aliases if alias.strip()]):
+            fields.append(field)
+            texts.append(text)
+    embeddings = np.asarray(encoder(texts), dtype=np.float32)
+
+    try:
+        np.savez(embeddings_path, fields=np.array(fields), embeddings=embeddings)
+    except OSError as e:
+        warnings.warn(f"Could not write reference embeddings to {embeddings_path}: {e}")
+    return fields, embeddings
+
+def get_LM_matches(dataset_fields, required_fields, limit = 5, model_path=None, encoder=None, reference_path=None):
 
     """Given lists of required fields and dataset fields, returns the top N
     matches from dataset fields for each required field using cosine-similarity
     score calculated on SentenceTransformer embeddings for the fields.
+    The scores for all required fields are computed in one matrix product.
+    If a reference dictionary is provided, the precomputed embeddings of each required field and its aliases
+    are used and a dataset field is scored by its most similar alias.
+    Falls back to fuzzy matching if the language model cannot be loaded.
     
     :param dataset_fields: Header fields present in dataset metadata.
     :type dataset_fields: List[str]
@@ -163,39 +530,62 @@ def get_LM_matches(dataset_fields, required_fields, limit = 5):
     :type required_fields: List[str]
     :param limit: Number of matches to return
     :type limit: int
+    :param model_path: Name or local path of the SentenceTransformer model, defaults to None which uses LM_MODEL_PATH
+    :type model_path: str
+    :param encoder: Encoder function used instead of the SentenceTransformer model (e.g. hashing_encoder), defaults to None
+    :type encoder: Callable
+    :param reference_path: Path to metadata reference dictionary, defaults to None which embeds only the required field names
+    :type reference_path: str
     :return: Dictionary with required_fields as keys and the N most similar dataset_fields along with similarity scores as values
     :rtype: Dictionary
 
     """
     try:
-        model = SentenceTransformer('/projects01/didsr-aiml/tahsin.rahman/transformer_models/sentence-transformers/all-MiniLM-L6-v2/', local_files_only=True)
-        matches = {}
-    
-        dataset_embeddings = model.encode(dataset_fields, convert_to_tensor=True)
-        required_embeddings = model.encode(required_fields, convert_to_tensor=True)
-    
-        # Calculate similarity scores and determine matches
-        for idx, required_field in enumerate(required_fields):
-            similarities = util.pytorch_cos_sim(required_embeddings[idx], dataset_embeddings).cpu().numpy()
-            top_n = np.argpartition(similarities[0], -limit)[-limit:]
-            top_n = top_n[np.argsort(similarities[0][top_n])]
-            top_n = top_n[::-1]
-            results = []
-            for i, sim_idx in enumerate(top_n):
-                sim = float(similarities[0][sim_idx])
-                results.append((dataset_fields[sim_idx],100*float(sim)))
-            matches[required_field] = results
-            
+        if encoder is None:
+            encoder = get_lm_encoder(model_path)
+        matches = {field: [] for field in required_fields}
+        if not dataset_fields or not required_fields:
+            return matches
+
+        if reference_path is not None:
+            reference_fields, reference_embeddings = load_reference_embeddings(reference_path, encoder)
+        else:
+            reference_fields, reference_embeddings = [], np.zeros((0, 0), dtype=np.float32)
+        # Required fields missing from the reference dictionary are embedded by name
+        required_set = set(required_fields)
+        rows = [i for i, field in enumerate(reference_fields) if field in required_set]
+        row_fields = [reference_fields[i] for i in rows]
+        unreferenced = [field for field in required_fields if field not in set(row_fields)]
+        required_embeddings = reference_embeddings[rows]
+        if unreferenced:
+            unreferenced_embeddings = np.asarray(encoder(unreferenced), dtype=np.float32)
+            required_embeddings = np.vstack([required_embeddings.reshape(-1, unreferenced_embeddings.shape[1]), unreferenced_embeddings])
+            row_fields = row_fields + unreferenced
+
+        dataset_embeddings = np.asarray(encoder(dataset_fields), dtype=np.float32)
+        similarities = required_embeddings @ dataset_embeddings.T
+
+        # Score of each dataset field for a required field is its best similarity over the field's aliases
+        field_index = {field: i for i, field in enumerate(required_fields)}
+        scores = np.full((len(required_fields), len(dataset_fields)), -np.inf, dtype=np.float32)
+        np.maximum.at(scores, np.array([field_index[field] for field in row_fields]), similarities)
+
+        k = min(limit, len(dataset_fields))
+        top_n = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top_n, axis=1)
+        top_n = np.take_along_axis(top_n, np.argsort(-top_scores, axis=1, kind='stable'), axis=1)
+
+        for i, required_field in enumerate(required_fields):
+            matches[required_field] = [(dataset_fields[j], 100*float(scores[i, j])) for j in top_n[i]]
+
     except Exception as e:
         print(f'Could not load LM. Using fuzzy matching. Error {e}')
 
-        matches = get_fuzzy_matches(dataset_fields, required_fields, limit = limit, score = fuzz.ratio )
-
-        return matches
+        matches = get_fuzzy_matches(dataset_fields, required_fields, limit = limit, scorer = fuzz.ratio)
 
     return matches
 
-def ranked_field_matching(dataset_fields, required_fields, ranking_method='fuzzy', limit = 5):
+def ranked_field_matching(dataset_fields, required_fields, ranking_method='fuzzy', limit = 5, reference_path=None, model_path=None, encoder=None):
 
     """Given lists of required fields and dataset fields, performs
     user-assisted field matching. For each required field, the top N
@@ -210,6 +600,14 @@ def ranked_field_matching(dataset_fields, required_fields, ranking_method='fuzzy
     :type ranking_method: str
     :param limit: Number of matches to return
     :type limit: int
+    :param reference_path: Path to metadata reference dictionary. If provided, the accepted matches are stored
+        in its alias index cache and are found by dictionary matching in later runs.
+        LM ranking also uses the precomputed embeddings of the aliases in the reference dictionary.
+    :type reference_path: str
+    :param model_path: Name or local path of the SentenceTransformer model for LM ranking, defaults to None which uses LM_MODEL_PATH
+    :type model_path: str
+    :param encoder: Encoder function used for LM ranking instead of the SentenceTransformer model (e.g. hashing_encoder), defaults to None
+    :type encoder: Callable
     :return: Dictionary with required_fields present in dataset_fields as keys and the corresponding dataset fields as values
     :rtype: Dictionary
 
@@ -225,6 +623,10 @@ def ranked_field_matching(dataset_fields, required_fields, ranking_method='fuzzy
         'required_fields': required_fields,
         'limit':limit
     }
+    if ranking_method == 'LM':
+        ranking_function_arguments['model_path'] = model_path
+        ranking_function_arguments['encoder'] = encoder
+        ranking_function_arguments['reference_path'] = reference_path
 
     print('Using user-assisted ranked matching for umatched headers.')
     if ranking_method == 'fuzzy':
@@ -266,4 +668,7 @@ def ranked_field_matching(dataset_fields, required_fields, ranking_method='fuzzy
             os.system('cls' if os.name == 'nt' else 'clear')
             print(f'Input not recognized - skipping field: {required_field}')
 
+    if reference_path is not None:
+        record_learned_mappings(reference_path, field_mappings)
+
     return field_mappings
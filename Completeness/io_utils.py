@@ -7,17 +7,32 @@ import warnings
 import numpy as np
 import os
 import pandas as pd
+try:
+    from dicom_utils import load_dataset_dicom
+except ImportError:
+    # pydicom is only needed to read metadata from directories of DICOM files
+    load_dataset_dicom = None
 # Functions for metadata file and dictionary I/O
 
-def load_metadata_file(file_path=None,sep=None):
+def load_metadata_file(file_path=None,sep=None,chunksize=None,usecols=None,dtype_backend=None):
     """Reads a metadata file into a pandas dataframe. Automatically infers filetype from extension.
-    Works with CSV, XLS, and XLSX files.
+    Works with CSV, XLS, XLSX, Parquet, and Feather files.
+    If the path is a directory, the metadata table is built from the headers of the DICOM files inside it
+    (see dicom_utils.scan_dicom_directory).
+    If a chunksize is provided, an iterator over dataframes of at most chunksize rows is returned instead,
+    so that large metadata files can be processed without loading them fully into memory.
 
     :param file_path: Path to metadata file, defaults to None which prompts user to enter file path.
     :type file_path: str
     :param sep: Field separator in metadata file, defaults to None
     :type sep: str
-    :return: Pandas dataframe with the loaded metadata
+    :param chunksize: Number of rows per chunk, defaults to None which loads the full file
+    :type chunksize: int
+    :param usecols: Columns to read from the metadata file, defaults to None which reads all columns
+    :type usecols: List[str]
+    :param dtype_backend: Backend for the dataframe dtypes ('numpy_nullable' or 'pyarrow'), defaults to None which uses numpy dtypes
+    :type dtype_backend: str
+    :return: Pandas dataframe with the loaded metadata, or an iterator of dataframes if chunksize is set
     :rtype: pd.DataFrame
 
     """
@@ -27,7 +42,7 @@ def load_metadata_file(file_path=None,sep=None):
 
     assert os.path.exists(file_path), "File not found."
     
-    meta_file_type = file_path.split('.')[-1]
+    meta_file_type = 'dicom' if os.path.isdir(file_path) else file_path.split('.')[-1].lower()
     # To include a new metadata file type, add the file extension as a key to the function map
     # and as the value add the name of the function which will open the metadata file of the new type
     # and return a pandas dataframe with the metadata
@@ -35,18 +50,107 @@ def load_metadata_file(file_path=None,sep=None):
         'csv' : load_dataset_csv,
         'xls' : load_dataset_xls,
         'xlsx' : load_dataset_xls,
+        'parquet' : load_dataset_parquet,
+        'pq' : load_dataset_parquet,
+        'feather' : load_dataset_feather,
+        'arrow' : load_dataset_feather,
+        'dicom' : load_dataset_dicom,
     }
+    if meta_file_type == 'dicom' and load_dataset_dicom is None:
+        print("pydicom is required to load metadata from DICOM files.")
+        return None
     function_args = {
         'file_path':file_path,
     }
-    if sep is not None:
+    # Only the CSV loader has a field separator
+    if sep is not None and meta_file_type == 'csv':
         function_args['sep']=sep
+    if chunksize is not None:
+        function_args['chunksize']=chunksize
+    if usecols is not None:
+        function_args['usecols']=usecols
+    if dtype_backend is not None:
+        function_args['dtype_backend']=dtype_backend
     df_metadata = function_map.get(meta_file_type, lambda: "Invalid metadata file type.")(**function_args)
 
     return df_metadata
 
 
-def load_dataset_csv(file_path,sep=','):
+def load_metadata_header(file_path=None,sep=None):
+    """Reads only the header (column names) of a metadata file without parsing any records.
+    Automatically infers filetype from extension. Works with the same file types as load_metadata_file.
+    This is sufficient for the dataset level completeness check, after which load_metadata_file
+    can be called with usecols to read only the matched columns.
+
+    :param file_path: Path to metadata file, defaults to None which prompts user to enter file path.
+    :type file_path: str
+    :param sep: Field separator in metadata file, defaults to None
+    :type sep: str
+    :return: List of column names in the metadata file
+    :rtype: List[str]
+
+    """
+
+    if file_path is None:
+        file_path = input("Enter the full path to the file (e.g., '/path/to/file.csv'): ").strip("\'\"")
+
+    assert os.path.exists(file_path), "File not found."
+
+    meta_file_type = 'dicom' if os.path.isdir(file_path) else file_path.split('.')[-1].lower()
+    # Header readers for each metadata file type. New file types added to the function map
+    # of load_metadata_file should also be added here.
+    function_map = {
+        'csv' : lambda: pd.read_csv(file_path, sep=sep or ',', nrows=0).columns.tolist(),
+        'xls' : lambda: pd.read_excel(file_path, nrows=0).columns.tolist(),
+        'xlsx' : lambda: pd.read_excel(file_path, nrows=0).columns.tolist(),
+        'parquet' : lambda: read_arrow_schema(file_path, 'parquet'),
+        'pq' : lambda: read_arrow_schema(file_path, 'parquet'),
+        'feather' : lambda: read_arrow_schema(file_path, 'feather'),
+        'arrow' : lambda: read_arrow_schema(file_path, 'feather'),
+        # DICOM headers are scanned once and cached in a sidecar index, so the full table is used here
+        'dicom' : lambda: load_dataset_dicom(file_path).columns.tolist(),
+    }
+
+    try:
+        header = function_map[meta_file_type]()
+        return header
+    except KeyError:
+        print("Invalid metadata file type.")
+        return None
+    except Exception as e:
+        print(f"Error loading metadata header: {e}")
+        return None
+
+
+def read_arrow_schema(file_path, file_format='parquet'):
+    """
+    Read the column names of a Parquet or Feather (Arrow IPC) file from the file schema, without reading any data.
+    Requires pyarrow.
+
+    :param file_path: Path to metadata file
+    :type file_path: str
+    :param file_format: 'parquet' or 'feather'
+    :type file_format: str
+    :return: List of column names
+    :rtype: List[str]
+
+    """
+
+    if file_format == 'parquet':
+        import pyarrow.parquet as pq
+        schema = pq.read_schema(file_path)
+    else:
+        import pyarrow.ipc as ipc
+        with ipc.open_file(file_path) as reader:
+            schema = reader.schema
+    # Pandas index columns stored by to_parquet/to_feather are not metadata fields
+    index_columns = []
+    if schema.pandas_metadata is not None:
+        index_columns = [col for col in schema.pandas_metadata.get('index_columns', []) if isinstance(col, str)]
+    return [name for name in schema.names if name not in index_columns]
+
+
+def load_dataset_csv(file_path,sep=',',chunksize=None,usecols=None,dtype_backend=None):
     """
     Load a CSV file containing the dataset metadata.
     
@@ -54,13 +158,22 @@ def load_dataset_csv(file_path,sep=','):
     :type file_path: str
     :param sep: Field separator in metadata file, defaults to ','
     :type sep: str
-    :return: Pandas dataframe with the loaded metadata
+    :param chunksize: Number of rows per chunk, defaults to None which loads the full file
+    :type chunksize: int
+    :param usecols: Columns to read, defaults to None which reads all columns
+    :type usecols: List[str]
+    :param dtype_backend: Backend for the dataframe dtypes, defaults to None which uses numpy dtypes
+    :type dtype_backend: str
+    :return: Pandas dataframe with the loaded metadata, or a chunk iterator if chunksize is set
     :rtype: pd.DataFrame
 
     """
 
+    read_args = {}
+    if dtype_backend is not None:
+        read_args['dtype_backend'] = dtype_backend
     try:
-        data = pd.read_csv(file_path,sep=sep)
+        data = pd.read_csv(file_path,sep=sep,chunksize=chunksize,usecols=usecols,**read_args)
         return data
     except Exception as e:
         print(f"Error loading dataset CSV: {e}")
@@ -88,26 +201,108 @@ def load_json(file_path):
         return None
         
 
-def load_dataset_xls(file_path):
+def load_dataset_xls(file_path,chunksize=None,usecols=None,dtype_backend=None):
 
     """
     Load an xls/xlsx file containing the dataset metadata.
+    Excel files cannot be read incrementally, so if a chunksize is provided
+    the loaded dataframe is returned as a single chunk.
     
     :param file_path: Path to metadata file
     :type file_path: str
-    :return: Pandas dataframe with the loaded metadata
+    :param chunksize: Number of rows per chunk, defaults to None which returns a dataframe
+    :type chunksize: int
+    :param usecols: Columns to read, defaults to None which reads all columns
+    :type usecols: List[str]
+    :param dtype_backend: Backend for the dataframe dtypes, defaults to None which uses numpy dtypes
+    :type dtype_backend: str
+    :return: Pandas dataframe with the loaded metadata, or a chunk iterator if chunksize is set
     :rtype: pd.DataFrame
 
     """
 
+    read_args = {}
+    if dtype_backend is not None:
+        read_args['dtype_backend'] = dtype_backend
     try:
-        data = pd.read_excel(file_path)
+        data = pd.read_excel(file_path,usecols=usecols,**read_args)
+        if chunksize is not None:
+            return iter([data])
         return data
     except Exception as e:
         print(f"Error loading dataset XLS: {e}")
         return None
 
 
+def load_dataset_parquet(file_path,chunksize=None,usecols=None,dtype_backend=None):
+
+    """
+    Load a Parquet file containing the dataset metadata. Requires pyarrow.
+    Only the requested columns are read from disk. If a chunksize is provided,
+    the file is read incrementally in batches of chunksize rows.
+    
+    :param file_path: Path to metadata file
+    :type file_path: str
+    :param chunksize: Number of rows per chunk, defaults to None which returns a dataframe
+    :type chunksize: int
+    :param usecols: Columns to read, defaults to None which reads all columns
+    :type usecols: List[str]
+    :param dtype_backend: Backend for the dataframe dtypes, defaults to None which uses numpy dtypes
+    :type dtype_backend: str
+    :return: Pandas dataframe with the loaded metadata, or a chunk iterator if chunksize is set
+    :rtype: pd.DataFrame
+
+    """
+
+    try:
+        if chunksize is not None:
+            import pyarrow.parquet as pq
+            parquet_file = pq.ParquetFile(file_path)
+            to_pandas_args = {'types_mapper': pd.ArrowDtype} if dtype_backend == 'pyarrow' else {}
+            return (batch.to_pandas(**to_pandas_args) for batch in parquet_file.iter_batches(batch_size=chunksize, columns=usecols))
+        read_args = {}
+        if dtype_backend is not None:
+            read_args['dtype_backend'] = dtype_backend
+        data = pd.read_parquet(file_path,columns=usecols,**read_args)
+        return data
+    except Exception as e:
+        print(f"Error loading dataset Parquet: {e}")
+        return None
+
+
+def load_dataset_feather(file_path,chunksize=None,usecols=None,dtype_backend=None):
+
+    """
+    Load a Feather (Arrow IPC) file containing the dataset metadata. Requires pyarrow.
+    Only the requested columns are read from disk. Feather files are not read incrementally,
+    so if a chunksize is provided the loaded dataframe is returned as a single chunk.
+    
+    :param file_path: Path to metadata file
+    :type file_path: str
+    :param chunksize: Number of rows per chunk, defaults to None which returns a dataframe
+    :type chunksize: int
+    :param usecols: Columns to read, defaults to None which reads all columns
+    :type usecols: List[str]
+    :param dtype_backend: Backend for the dataframe dtypes, defaults to None which uses numpy dtypes
+    :type dtype_backend: str
+    :return: Pandas dataframe with the loaded metadata, or a chunk iterator if chunksize is set
+    :rtype: pd.DataFrame
+
+    """
+
+    read_args = {}
+    if dtype_backend is not None:
+        read_args['dtype_backend'] = dtype_backend
+    try:
+        data = pd.read_feather(file_path,columns=usecols,**read_args)
+        if chunksize is not None:
+            return iter([data])
+        return data
+    except Exception as e:
+        print(f"Error loading dataset Feather: {e}")
+        return None
+
+
 def get_field_item(metadata_dictionary,item_key="aliases"):
     """
     For an input metadata dictionary where each top level key is a field name,
@@ -195,6 +390,97 @@ def find_key_path(d, target_key=None, key_path=None):
                 return result
     return None
 
+def flatten_dictionary(d, level_path=None, rows=None):
+
+    """
+    Recursively compile a nested metadata reference dictionary into a flat list of fields.
+    Fields are the nested dictionaries which contain an 'aliases' item. Each field is
+    listed once, with the path of levels leading to it, in the order in which fields appear in the dictionary.
+    
+    :param d: Nested metadata reference dictionary
+    :type d: dictionary
+    :param level_path: Path of levels to the dictionary d used for recursion, defaults to None
+    :type level_path: List[str]
+    :param rows: List of fields found so far used for recursion, defaults to None
+    :type rows: List[dictionary]
+    :return: List with one dictionary per field with the field name, level path, aliases, dtype and checkCoverage items
+    :rtype rows: List[dictionary]
+
+    """
+
+    if level_path is None:
+        level_path = []
+    if rows is None:
+        rows = []
+
+    for key, value in d.items():
+        if not isinstance(value, dict):
+            continue
+        if 'aliases' in value:
+            if key not in [row['field'] for row in rows]:
+                rows.append({
+                    'field': key,
+                    'level_path': tuple(level_path),
+                    'aliases': value['aliases'],
+                    'dtype': value.get('dtype'),
+                    'checkCoverage': value.get('checkCoverage'),
+                })
+        else:
+            flatten_dictionary(value, level_path + [key], rows)
+    return rows
+
+
+def load_flat_dictionary(path):
+
+    """
+    Load a metadata reference dictionary from a json file as a flat table of fields (see flatten_dictionary).
+    The table is compiled once per process and reused until the json file changes.
+    
+    :param path: Path to a metadata reference dictionary stored in a json file.
+    :type path: str
+    :return: Dataframe indexed by field name with level_path, aliases, dtype and checkCoverage columns
+    :rtype: pd.DataFrame
+
+    """
+
+    mtime = os.path.getmtime(path)
+    if path not in _flat_dictionary_cache or _flat_dictionary_cache[path][0] != mtime:
+        flat_dictionary = pd.DataFrame(flatten_dictionary(load_json(path)),
+                                       columns=['field', 'level_path', 'aliases', 'dtype', 'checkCoverage']).set_index('field')
+        _flat_dictionary_cache[path] = (mtime, flat_dictionary)
+    return _flat_dictionary_cache[path][1]
+
+# Flat metadata reference dictionaries loaded by load_flat_dictionary, keyed by path
+_flat_dictionary_cache = {}
+
+
+def get_level_fields(flat_dictionary, target_key=None):
+
+    """
+    Get the fields nested within a level of a flattened metadata reference dictionary.
+    As in get_dictionary, the first level in the dictionary with the target key name is used.
+    
+    :param flat_dictionary: Flat metadata reference dictionary (see load_flat_dictionary)
+    :type flat_dictionary: pd.DataFrame
+    :param target_key: Level name, defaults to None which returns all fields
+    :type target_key: str
+    :return: List of field names
+    :rtype: List[str]
+
+    """
+
+    if target_key is None:
+        return flat_dictionary.index.tolist()
+
+    for level_path in flat_dictionary['level_path']:
+        if target_key in level_path:
+            prefix = level_path[:level_path.index(target_key)+1]
+            return [field for field, path in flat_dictionary['level_path'].items() if path[:len(prefix)] == prefix]
+
+    print(f'Level {target_key} not found.')
+    return []
+
+
 def plot_completeness_barchart(df_plot, available_list = None, plot_title='Completeness', plot_colors=['#5577DD','#DD3333'], add_text=True, savefig=False):
 
     """
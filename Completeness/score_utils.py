@@ -12,8 +12,9 @@ def dataset_level_completeness_check(dataset_df, required_fields, field_matching
     """
     Perform a dataset-level completeness check to verify that the dataset header contains all required fields.
     
-    :param dataset_df: Nested dictionary containing dataset metadata
-    :type dataset_df: Dictionary
+    :param dataset_df: Dataframe containing dataset metadata, or the list of dataset header fields
+        (e.g. from io_utils.load_metadata_header) since only the header is used in this check
+    :type dataset_df: pd.DataFrame or List[str]
     :param required_fields: List of required fields
     :type required_fields: List[str]
     :param field_matching_methods: Dictionary with names of field matching methods to be used and parameters for each method
@@ -31,7 +32,10 @@ def dataset_level_completeness_check(dataset_df, required_fields, field_matching
         'UA': ranked_field_matching
     }
  
-    dataset_headers = dataset_df.columns.tolist()  # Extract the headers from the dataset
+    if isinstance(dataset_df, pd.DataFrame):
+        dataset_headers = dataset_df.columns.tolist()  # Extract the headers from the dataset
+    else:
+        dataset_headers = list(dataset_df)
 
     available_header_map = {}
 
@@ -127,6 +131,133 @@ def record_level_completeness_check(dataset_df, required_fields, available_heade
 
     total_records = len(dataset_df)
     missing_per_column = dataset_df.isnull().sum()
+
+    req_missing_per_column = None
+    if available_headers is not None and len(available_headers)>0:
+
+        drop_columns = [col for col in dataset_df.columns if col not in available_headers.values()]
+        complete_dataset_df = dataset_df.drop(columns=drop_columns)
+        
+        for col in required_fields:
+            if col not in available_headers.keys():
+                complete_dataset_df[col] = np.nan
+        new_names_dict = {v:k for k,v in available_headers.items()}
+        complete_dataset_df = complete_dataset_df.rename(columns=new_names_dict)
+        req_missing_per_column = complete_dataset_df.isnull().sum()
+        missing_per_row = complete_dataset_df.isnull().sum(axis=1)
+    else:
+        missing_per_row = dataset_df.isnull().sum(axis=1)
+
+    row_missing_dist = missing_per_row.value_counts().sort_index()
+
+    return summarize_record_completeness(total_records, missing_per_column, row_missing_dist, req_missing_per_column,
+                                         available_headers=available_headers, visualize=visualize, savefig=savefig)
+
+
+def record_level_completeness_check_chunked(file_path, required_fields, available_headers=None, chunksize=100000, sep=None, usecols=None, visualize=False, savefig=False):
+
+    """
+    Streaming variant of the record level completeness check for metadata files too large to be loaded into memory.
+    The metadata file is read in chunks and only running per-column missing counts and a histogram
+    of the number of missing values per record are kept, so peak memory is bounded by the chunk size.
+    Returns the same report as record_level_completeness_check.
+    
+    :param file_path: Path to metadata file
+    :type file_path: str
+    :param required_fields: List of all required metadata fields.
+    :type required_fields: List[str]
+    :param available_headers: Required fields available in metadata. 
+        Dictionary with the required field names as keys and the matched dataset field names as values
+    :type available_headers: Dictionary
+    :param chunksize: Number of records read per chunk
+    :type chunksize: int
+    :param sep: Field separator in metadata file, defaults to None
+    :type sep: str
+    :param usecols: Columns to read from the metadata file, defaults to None which reads all columns
+    :type usecols: List[str]
+    :param visualize: Flag to plot the record level completeness information in barcharts
+    :type visualize: bool
+    :param savefig: Flag to save the figures as pngs
+    :type savefig: bool
+
+    :return: Dictionary with row and column completeness information
+    :rtype: Dictionary
+
+    """
+
+    use_required = available_headers is not None and len(available_headers)>0
+
+    total_records = 0
+    missing_per_column = None
+    row_missing_counts = {}
+    matched_columns = []
+    # Required fields without a matching header are missing in every record
+    n_unmatched = len([col for col in required_fields if col not in available_headers.keys()]) if use_required else 0
+
+    # An empty or unreadable file yields no chunks and gives a zero-record report
+    chunks = load_metadata_file(file_path, sep=sep, chunksize=chunksize, usecols=usecols)
+    for chunk in (chunks if chunks is not None else []):
+        chunk_missing = chunk.isnull()
+        if missing_per_column is None:
+            missing_per_column = chunk_missing.sum()
+            if use_required:
+                matched_columns = [col for col in chunk.columns if col in available_headers.values()]
+        else:
+            missing_per_column += chunk_missing.sum()
+        total_records += len(chunk)
+
+        if use_required:
+            missing_per_row = chunk_missing[matched_columns].sum(axis=1) + n_unmatched
+        else:
+            missing_per_row = chunk_missing.sum(axis=1)
+        for n_missing, n_records in missing_per_row.value_counts().items():
+            row_missing_counts[n_missing] = row_missing_counts.get(n_missing, 0) + n_records
+
+    if missing_per_column is None:
+        missing_per_column = pd.Series(dtype='int64')
+
+    req_missing_per_column = None
+    if use_required:
+        # Same column order as the renamed dataframe built in record_level_completeness_check
+        new_names_dict = {v:k for k,v in available_headers.items()}
+        req_missing_per_column = pd.concat([
+            missing_per_column[matched_columns].rename(index=new_names_dict),
+            pd.Series(total_records, index=[col for col in required_fields if col not in available_headers.keys()], dtype='int64')
+        ])
+
+    row_missing_dist = pd.Series(row_missing_counts, dtype='int64').sort_index()
+
+    return summarize_record_completeness(total_records, missing_per_column, row_missing_dist, req_missing_per_column,
+                                         available_headers=available_headers, visualize=visualize, savefig=savefig)
+
+
+def summarize_record_completeness(total_records, missing_per_column, row_missing_dist, req_missing_per_column=None,
+                                  available_headers=None, visualize=False, savefig=False):
+
+    """
+    Build the record level completeness report from missing value counts.
+    
+    :param total_records: Number of records in the dataset
+    :type total_records: int
+    :param missing_per_column: Number of missing values for each dataset column
+    :type missing_per_column: pd.Series
+    :param row_missing_dist: Number of records (values) for each count of missing values per record (index)
+    :type row_missing_dist: pd.Series
+    :param req_missing_per_column: Number of missing values for each required field, defaults to None
+    :type req_missing_per_column: pd.Series
+    :param available_headers: Required fields available in metadata. 
+        Dictionary with the required field names as keys and the matched dataset field names as values
+    :type available_headers: Dictionary
+    :param visualize: Flag to plot the record level completeness information in barcharts
+    :type visualize: bool
+    :param savefig: Flag to save the figures as pngs
+    :type savefig: bool
+
+    :return: Dictionary with row and column completeness information
+    :rtype: Dictionary
+
+    """
+
     columns_with_missing_values = missing_per_column[missing_per_column>0]
 
     missing_per_column_perc = 100* missing_per_column/ total_records
@@ -142,18 +273,8 @@ def record_level_completeness_check(dataset_df, required_fields, available_heade
         "Missing (%)" : missing_per_column_perc
     })
 
-    if available_headers is not None and len(available_headers)>0:
-
-        drop_columns = [col for col in dataset_df.columns if col not in available_headers.values()]
-        complete_dataset_df = dataset_df.drop(columns=drop_columns)
-        
-        for col in required_fields:
-            if col not in available_headers.keys():
-                complete_dataset_df[col] = np.nan
-        new_names_dict = {v:k for k,v in available_headers.items()}
-        complete_dataset_df = complete_dataset_df.rename(columns=new_names_dict)
-        req_missing_per_column = complete_dataset_df.isnull().sum()
-
+    req_column_completeness = None
+    if req_missing_per_column is not None:
         req_missing_per_column_perc = 100* req_missing_per_column/ total_records
         req_available_per_column_perc = 100 - req_missing_per_column_perc
 
@@ -161,24 +282,14 @@ def record_level_completeness_check(dataset_df, required_fields, available_heade
             "Available (%)": req_available_per_column_perc,
             "Missing (%)" : req_missing_per_column_perc
         }).sort_values(by="Available (%)", ascending=False)
-        
-    
-    if available_headers is not None and len(available_headers)>0:
-        missing_per_row = complete_dataset_df.isnull().sum(axis=1)
-    else:
-        missing_per_row = dataset_df.isnull().sum(axis=1)
 
-    rows_with_missing_values = missing_per_row[missing_per_row>0]
-    
-    row_missing_dist = missing_per_row.value_counts().sort_index()
-    
     missing_rows_df = pd.DataFrame({
         "Missing Values per Record": row_missing_dist.index,
         "Number of Records" : row_missing_dist.values
     })
 
-    complete_records = total_records - len(rows_with_missing_values)
-    complete_records_percentage = 100*complete_records / total_records
+    complete_records = int(row_missing_dist.get(0, 0))
+    complete_records_percentage = 100*complete_records / total_records if total_records else 0.0
 
     print('\n== Record Completeness Summary ==')
     print(f"Total number of records: {total_records}")
@@ -189,7 +300,7 @@ def record_level_completeness_check(dataset_df, required_fields, available_heade
         plot_completeness_barchart(column_completeness, available_list = None, plot_title='Completeness of fields present in Metadata', 
                                    plot_colors=['#55CC99','#DD3333'], add_text=True, savefig=savefig)
 
-        if available_headers is not None and len(available_headers)>0:
+        if req_column_completeness is not None:
             plot_completeness_barchart(req_column_completeness, available_list = list(available_headers.keys()), plot_title='Required Field Completeness Summary', 
                                    plot_colors=['#5577DD','#DD3333'], add_text=True, savefig=savefig)
 
@@ -202,4 +313,185 @@ def record_level_completeness_check(dataset_df, required_fields, available_heade
         'required_column_completeness': req_column_completeness,
     }
 
-    return record_completeness_report
\ No newline at end of file
+    return record_completeness_report
+
+
+def multi_level_completeness_check(dataset, flat_dictionary, levels, field_matching_methods, chunksize=None, visualize=False, savefig=False):
+
+    """
+    Perform the dataset-level and record-level completeness checks for several levels of a metadata reference dictionary at once.
+    The dataset header is matched once against the fields of all levels, and the metadata records are read
+    in a single pass which counts the missing values of every matched column and the missing values per record for each level.
+    
+    :param dataset: Dataframe containing dataset metadata, or path to the metadata file
+    :type dataset: pd.DataFrame or str
+    :param flat_dictionary: Flat metadata reference dictionary (see io_utils.load_flat_dictionary)
+    :type flat_dictionary: pd.DataFrame
+    :param levels: Levels at which completeness should be assessed. None uses all fields.
+    :type levels: List[str]
+    :param field_matching_methods: Dictionary with names of field matching methods to be used and parameters for each method
+    :type field_matching_methods: Dictionary
+    :param chunksize: Number of records read per chunk when a metadata file path is provided, defaults to None which loads the full file
+    :type chunksize: int
+    :param visualize: Flag to plot the record level completeness information of each level in barcharts
+    :type visualize: bool
+    :param savefig: Flag to save the figures as pngs
+    :type savefig: bool
+
+    :return: Dictionary with the matched header map of all fields, and the dataset-level and record-level
+        completeness reports for each level
+    :rtype: Dictionary
+
+    """
+
+    level_fields = {level: get_level_fields(flat_dictionary, level) for level in levels}
+    all_fields = [field for field in flat_dictionary.index if any(field in fields for fields in level_fields.values())]
+
+    if isinstance(dataset, pd.DataFrame):
+        dataset_headers = dataset.columns.tolist()
+    else:
+        dataset_headers = load_metadata_header(dataset)
+        assert dataset_headers is not None, "Failed to load metadata header."
+
+    # Single header matching pass for the fields of all levels
+    completeness_report = dataset_level_completeness_check(dataset_headers, all_fields, field_matching_methods)
+    available_header_map = completeness_report['available_header_map']
+
+    # Single pass over the records, restricted to the matched columns
+    matched_columns = [col for col in dataset_headers if col in available_header_map.values()]
+    if isinstance(dataset, pd.DataFrame):
+        chunks = [dataset[matched_columns]] if matched_columns else [dataset.iloc[:, :0]]
+    else:
+        # Without matched columns only the first column is read to count the records
+        chunks = load_metadata_file(dataset, chunksize=chunksize, usecols=matched_columns or dataset_headers[:1] or None)
+        assert chunks is not None, "Failed to load metadata file."
+        if chunksize is None:
+            chunks = [chunks]
+
+    level_headers = {}
+    for level, fields in level_fields.items():
+        level_map = {k:v for k,v in available_header_map.items() if k in fields}
+        level_columns = [col for col in matched_columns if col in level_map.values()]
+        n_unmatched = len([field for field in fields if field not in level_map])
+        level_headers[level] = (level_map, level_columns, n_unmatched)
+
+    total_records = 0
+    missing_per_column = pd.Series(0, index=matched_columns, dtype='int64')
+    row_missing_counts = {level: {} for level in levels}
+    for chunk in chunks:
+        chunk_missing = chunk[matched_columns].isnull()
+        missing_per_column += chunk_missing.sum()
+        total_records += len(chunk)
+        for level, (level_map, level_columns, n_unmatched) in level_headers.items():
+            missing_per_row = chunk_missing[level_columns].sum(axis=1).astype('int64') + n_unmatched
+            for n_missing, n_records in missing_per_row.value_counts().items():
+                row_missing_counts[level][n_missing] = row_missing_counts[level].get(n_missing, 0) + n_records
+
+    level_reports = {}
+    for level, fields in level_fields.items():
+        level_map, level_columns, n_unmatched = level_headers[level]
+        missing_headers = [field for field in fields if field not in level_map]
+
+        new_names_dict = {v:k for k,v in level_map.items()}
+        req_missing_per_column = pd.concat([
+            missing_per_column[level_columns].rename(index=new_names_dict),
+            pd.Series(total_records, index=missing_headers, dtype='int64')
+        ])
+        row_missing_dist = pd.Series(row_missing_counts[level], dtype='int64').sort_index()
+
+        print(f'\n== Level: {level if level is not None else "All Fields"} ==')
+        record_report = summarize_record_completeness(total_records, missing_per_column[level_columns], row_missing_dist,
+                                                      req_missing_per_column, available_headers=level_map,
+                                                      visualize=visualize, savefig=savefig)
+        level_reports[level] = {
+            'required_fields': fields,
+            'available_header_map': level_map,
+            'missing_headers': missing_headers,
+            'unexpected_headers': [col for col in dataset_headers if col not in level_map.values()],
+            'completeness_score': compute_completeness_score(missing_headers, fields),
+            'record_completeness': record_report,
+        }
+
+    return {
+        'available_header_map': available_header_map,
+        'levels': level_reports,
+    }
+
+
+def group_level_completeness_check(dataset_df, required_fields, available_headers, group_fields='Patient ID'):
+
+    """
+    Perform a completeness check at the patient, study or series level by aggregating the records (images)
+    of each group with a single groupby over the matched required fields.
+    The returned table is indexed by the group ID, so the completeness of many groups can be looked up
+    with hashed index lookups (see lookup_group_completeness) instead of scanning the dataset for each ID.
+    
+    :param dataset_df: Dataframe containing dataset metadata
+    :type dataset_df: pd.DataFrame
+    :param required_fields: List of all required metadata fields.
+    :type required_fields: List[str]
+    :param available_headers: Required fields available in metadata. 
+        Dictionary with the required field names as keys and the matched dataset field names as values
+    :type available_headers: Dictionary
+    :param group_fields: Required field, or list of required fields, identifying the groups (e.g. 'Patient ID' or ['Patient ID', 'Study ID'])
+    :type group_fields: str or List[str]
+
+    :return: Dataframe with one row per group, containing the number of records, the percentage of records with
+        a value for each required field, the number of required fields without any value, the number of incomplete records
+        and a flag for groups where every record is complete. Records with a missing group ID are kept in a group
+        with a NaN ID.
+    :rtype: pd.DataFrame
+
+    """
+
+    if isinstance(group_fields, str):
+        group_fields = [group_fields]
+    for field in group_fields:
+        assert field in available_headers, f"Group field '{field}' not found in dataset metadata."
+
+    group_keys = [dataset_df[available_headers[field]].rename(field) for field in group_fields]
+    n_missing_ids = int(pd.concat(group_keys, axis=1).isnull().any(axis=1).sum())
+    if n_missing_ids:
+        print(f"{n_missing_ids} records have a missing {' / '.join(group_fields)} and are reported in a group with a NaN ID.")
+    matched_fields = [field for field in required_fields if field in available_headers]
+    unmatched_fields = [field for field in required_fields if field not in available_headers]
+
+    available = dataset_df[[available_headers[field] for field in matched_fields]].notnull()
+    available.columns = matched_fields
+    grouped = available.groupby(group_keys, sort=False, dropna=False)
+
+    group_completeness = 100*grouped.mean()
+    for field in unmatched_fields:
+        group_completeness[field] = 0.0
+    group_completeness = group_completeness[required_fields]
+
+    if unmatched_fields:
+        incomplete_records = grouped.size()
+    else:
+        incomplete_records = (~available.all(axis=1)).groupby(group_keys, sort=False, dropna=False).sum()
+
+    group_completeness.insert(0, 'Number of Records', grouped.size())
+    group_completeness['Missing Fields'] = (group_completeness[required_fields] == 0).sum(axis=1)
+    group_completeness['Incomplete Records'] = incomplete_records
+    group_completeness['Complete'] = group_completeness['Incomplete Records'] == 0
+
+    return group_completeness
+
+
+def lookup_group_completeness(group_completeness, group_ids):
+
+    """
+    Look up the completeness of a list of groups (e.g. patients) in a group completeness table.
+    Group IDs not found in the dataset are returned as rows of missing values.
+    
+    :param group_completeness: Group completeness table (see group_level_completeness_check)
+    :type group_completeness: pd.DataFrame
+    :param group_ids: Group IDs to look up. Tuples of IDs for tables grouped by several fields.
+    :type group_ids: List
+
+    :return: Rows of the group completeness table for the requested groups
+    :rtype: pd.DataFrame
+
+    """
+
+    return group_completeness.reindex(group_ids)
@@ -0,0 +1,58 @@
+import glob
+import json
+
+import numpy as np
+import pytest
+
+from field_matching_utils import get_LM_matches, hashing_encoder, ranked_field_matching
+# Tests of the LM matching code path with the hashing encoder, which needs no model files
+
+DATASET_FIELDS = ['PatientSex', 'patient_id', 'Study Date', 'Manufacturer', 'BreastDensity']
+
+
+def test_hashing_encoder_normalized():
+    embeddings = hashing_encoder(['Patient ID', 'patient_id', ''])
+    assert embeddings.dtype == np.float32
+    assert np.linalg.norm(embeddings[:2], axis=1) == pytest.approx(1)
+    # Cleaned strings are identical, so are their embeddings
+    assert embeddings[0] == pytest.approx(embeddings[1])
+
+
+def test_get_LM_matches_names():
+    matches = get_LM_matches(DATASET_FIELDS, ['Patient ID', 'Study Date'], limit=3, encoder=hashing_encoder)
+    assert [len(m) for m in matches.values()] == [3, 3]
+    assert matches['Patient ID'][0] == ('patient_id', pytest.approx(100))
+    assert matches['Study Date'][0] == ('Study Date', pytest.approx(100))
+    scores = [score for _, score in matches['Patient ID']]
+    assert scores == sorted(scores, reverse=True)
+    assert get_LM_matches([], ['Patient ID'], encoder=hashing_encoder) == {'Patient ID': []}
+
+
+def test_get_LM_matches_reference_aliases(tmp_path):
+    reference = {'Core Fields': {
+        'Patient Sex': {'dtype': 'string', 'aliases': ['Sex', 'PatientSex']},
+        'Density': {'dtype': 'string', 'aliases': ['Breast Density']},
+    }}
+    reference_path = str(tmp_path/'reference.json')
+    with open(reference_path, 'w') as f:
+        json.dump(reference, f)
+    required = ['Patient Sex', 'Density', 'Manufacturer']
+    matches = get_LM_matches(DATASET_FIELDS, required, limit=2, encoder=hashing_encoder, reference_path=reference_path)
+    # Fields are scored by their most similar alias, fields missing from the dictionary by name
+    assert matches['Patient Sex'][0] == ('PatientSex', pytest.approx(100))
+    by_name = get_LM_matches(DATASET_FIELDS, ['Density'], limit=2, encoder=hashing_encoder)
+    assert matches['Density'][0][0] == by_name['Density'][0][0] == 'BreastDensity'
+    assert matches['Density'][0][1] > by_name['Density'][0][1]
+    assert matches['Manufacturer'][0] == ('Manufacturer', pytest.approx(100))
+    # Reference embeddings are stored once and reused
+    assert len(glob.glob(str(tmp_path/'reference_embeddings_*.npz'))) == 1
+    assert get_LM_matches(DATASET_FIELDS, required, limit=2, encoder=hashing_encoder,
+                          reference_path=reference_path) == matches
+
+
+def test_ranked_field_matching_encoder(monkeypatch):
+    monkeypatch.setattr('builtins.input', lambda prompt='': '1')
+    monkeypatch.setattr('os.system', lambda command: 0)
+    mappings = ranked_field_matching(DATASET_FIELDS, ['Patient ID', 'Study Date'], ranking_method='LM', limit=3,
+                                     encoder=hashing_encoder)
+    assert mappings == {'Patient ID': 'patient_id', 'Study Date': 'Study Date'}
@@ -0,0 +1,550 @@
+import inspect
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+from scipy.spatial.distance import (
+    cosine as sk_cosine_distance,
+    cityblock as sk_cityblock,
+    mahalanobis as sk_mahalanobis,
+    jensenshannon
+)
+from scipy.stats import pearsonr, entropy, wasserstein_distance
+from scipy.linalg import sqrtm, eigh
+
+from stats_utils import COV_EPS, compute_dataset_stats, regularized_logdet
+# Congruence metrics between datasets (custom vs. library implementations) and the pairwise metrics engine
+
+# Metrics computed from the dataset statistics, in output order
+METRICS = ['Cosine', 'Pearson', 'Manhattan', 'Mahalanobis', 'JSD', 'EMD', 'FID', 'Bhattacharyya']
+# Default number and size of the random subsets of the KID, and number of rows of the kernel blocks
+KID_SUBSETS = 100
+KID_SUBSET_SIZE = 1000
+KID_BLOCK_SIZE = 1024
+
+
+# --- Manual implementations ---
+def cos_manual(a, b):
+    num = np.dot(a, b)
+    den = np.linalg.norm(a) * np.linalg.norm(b)
+    return float(num/den) if den else 0.0
+
+def pearson_manual(a, b):
+    am, bm = a.mean(), b.mean()
+    cov = np.mean((a-am)*(b-bm))
+    den = a.std() * b.std()
+    return float(cov/den) if den else 0.0
+
+def manhattan_manual(a, b):
+    return float(np.sum(np.abs(a-b)))
+
+def mahalanobis_manual(a, b, inv_cov):
+    d = a - b
+    return float(np.sqrt(d.T.dot(inv_cov).dot(d)))
+
+def jsd_manual(p, q, base=2.0):
+    p = np.array(p, float)
+    q = np.array(q, float)
+    if p.sum()==0 or q.sum()==0:
+        return 0.0
+    pn = p/p.sum()
+    qn = q/q.sum()
+    m = 0.5*(pn+qn)
+    return float(0.5*(entropy(pn, m, base=base) + entropy(qn, m, base=base)))
+
+def emd_manual(a, b):
+    return float(wasserstein_distance(np.sort(a), np.sort(b)))
+
+# --- Library wrappers ---
+def cos_scipy(a, b):       return float(1 - sk_cosine_distance(a, b))
+
+def pearson_scipy(a, b):  return float(pearsonr(a, b)[0])
+
+def manhattan_scipy(a, b):return float(sk_cityblock(a, b))
+
+def mahalanobis_scipy(a,b,inv_cov): return float(sk_mahalanobis(a,b,inv_cov))
+
+def jsd_scipy(p, q):
+    pn = p/p.sum() if p.sum() else p
+    qn = q/q.sum() if q.sum() else q
+    return float(jensenshannon(pn, qn, base=2.0)**2)
+
+def emd_scipy(a, b):    return float(wasserstein_distance(a,b))
+
+def fid_sqrtm(a, b):
+    mu1, mu2 = a.mean(0), b.mean(0)
+    s1 = np.cov(a, rowvar=False)
+    s2 = np.cov(b, rowvar=False)
+    diff = mu1 - mu2
+    covmean = sqrtm(s1.dot(s2))
+    covmean = covmean.real if np.iscomplexobj(covmean) else covmean
+    return float(diff.dot(diff) + np.trace(s1 + s2 - 2*covmean))
+
+
+# --- Metrics from dataset statistics ---
+def fid_from_stats(stats_a: Dict[str, np.ndarray], stats_b: Dict[str, np.ndarray], dtype=np.float64) -> float:
+    """
+    Fréchet distance between two datasets from their statistics (see stats_utils.compute_dataset_stats).
+    With covariance factors cov_a = F_a.F_a^T and cov_b = F_b.F_b^T, the eigenvalues of cov_a.cov_b are the squared
+    singular values of C = F_a^T.F_b, so the trace of the square root of cov_a.cov_b is the sum of the square roots of
+    the eigenvalues of the small symmetric matrix C.C^T (or C^T.C). No general matrix square root is needed, the result
+    is always real, and with fewer samples than features the matrices are only as large as the number of samples.
+
+    :param stats_a: Statistics of the first dataset
+    :type stats_a: Dictionary
+    :param stats_b: Statistics of the second dataset
+    :type stats_b: Dictionary
+    :param dtype: Precision of the pairwise products and eigenvalues, np.float64 or np.float32 (~1.8x faster, ~1e-7 relative precision)
+    :type dtype: np.dtype
+    :return: Fréchet distance
+    :rtype: float
+    """
+    diff = stats_a['mean'] - stats_b['mean']
+    c = stats_a['factor'].astype(dtype, copy=False).T @ stats_b['factor'].astype(dtype, copy=False)
+    g = c @ c.T if c.shape[0] <= c.shape[1] else c.T @ c
+    eigvals = eigh(g, eigvals_only=True, check_finite=False) if g.size else np.zeros(0)
+    tr_covmean = np.sqrt(np.clip(eigvals, 0, None)).astype(np.float64).sum()
+    return float(diff.dot(diff) + np.trace(stats_a['cov']) + np.trace(stats_b['cov']) - 2*tr_covmean)
+
+
+def bhattacharyya_from_stats(stats_a: Dict[str, np.ndarray], stats_b: Dict[str, np.ndarray]) -> float:
+    """
+    Bhattacharyya distance between the Gaussian approximations of two datasets from their statistics:
+    1/8 (mu_a - mu_b)^T S^-1 (mu_a - mu_b) + 1/2 log(det S / sqrt(det S_a det S_b)) with S = (S_a + S_b) / 2.
+    Covariances are regularized with the COV_EPS ridge, as for the Mahalanobis distance.
+
+    :param stats_a: Statistics of the first dataset
+    :type stats_a: Dictionary
+    :param stats_b: Statistics of the second dataset
+    :type stats_b: Dictionary
+    :return: Bhattacharyya distance
+    :rtype: float
+    """
+    diff = stats_a['mean'] - stats_b['mean']
+    cov = (stats_a['cov'] + stats_b['cov']) / 2
+    quad = diff.dot(np.linalg.solve(cov + COV_EPS*np.eye(len(cov)), diff))
+    logdet = regularized_logdet(cov)
+    return float(quad/8 + (logdet - (stats_a['logdet'] + stats_b['logdet'])/2)/2)
+
+
+def fid(a, b, dtype=np.float64):
+    """
+    Fréchet distance between two feature arrays (see fid_from_stats).
+    """
+    return fid_from_stats(compute_dataset_stats(a, inverse=False), compute_dataset_stats(b, inverse=False), dtype)
+
+
+def benchmark_fid(a: np.ndarray, b: np.ndarray) -> pd.DataFrame:
+    """
+    Compare the FID of fid_from_stats in float64 and float32 with the general matrix square root version (fid_sqrtm)
+    on two feature arrays. Times of the eigendecomposition versions are per pair, with the dataset statistics
+    computed beforehand as in the pairwise metrics engine.
+
+    :param a: Features of the first dataset
+    :type a: np.ndarray
+    :param b: Features of the second dataset
+    :type b: np.ndarray
+    :return: Dataframe with the FID, relative difference to fid_sqrtm, time and speedup of each version
+    :rtype: pd.DataFrame
+    """
+    start = time.perf_counter()
+    ref = fid_sqrtm(a, b)
+    rows = [{'method': 'sqrtm', 'fid': ref, 'seconds': time.perf_counter() - start}]
+    start = time.perf_counter()
+    stats_a, stats_b = compute_dataset_stats(a, inverse=False), compute_dataset_stats(b, inverse=False)
+    print(f"Dataset statistics: {time.perf_counter() - start:.2f}s")
+    for dtype in (np.float64, np.float32):
+        start = time.perf_counter()
+        value = fid_from_stats(stats_a, stats_b, dtype)
+        rows.append({'method': f"eigh_{np.dtype(dtype).name}", 'fid': value, 'seconds': time.perf_counter() - start})
+    df = pd.DataFrame(rows)
+    df['rel_diff'] = (df['fid'] - ref).abs() / abs(ref)
+    df['speedup'] = df['seconds'].iloc[0] / df['seconds']
+    return df
+
+
+def metrics_from_stats(stats_a: Dict[str, np.ndarray], stats_b: Dict[str, np.ndarray], validate: bool = False,
+                       fid_dtype=np.float64) -> Dict[str, float]:
+    """
+    Compute the congruence metrics of a pair of datasets from their statistics. Vector metrics compare the dataset means,
+    the Mahalanobis distance uses the covariance of the first dataset, the FID and Bhattacharyya distance the
+    covariances of both.
+    In validation mode the library implementations of every metric are computed as well ('<metric>_scipy' and
+    'FID_sqrtm', the FID with a general matrix square root) to cross-check the manual implementations.
+
+    :param stats_a: Statistics of the first dataset
+    :type stats_a: Dictionary
+    :param stats_b: Statistics of the second dataset
+    :type stats_b: Dictionary
+    :param validate: Also compute the library implementations
+    :type validate: bool
+    :param fid_dtype: Precision of the FID computation, np.float64 or np.float32
+    :type fid_dtype: np.dtype
+    :return: Dictionary with metric names as keys and metric values as values
+    :rtype: Dictionary
+    """
+    mu_a, mu_b = stats_a['mean'], stats_b['mean']
+    m = {
+        'Cosine': cos_manual(mu_a, mu_b),
+        'Pearson': pearson_manual(mu_a, mu_b),
+        'Manhattan': manhattan_manual(mu_a, mu_b),
+        'Mahalanobis': mahalanobis_manual(mu_a, mu_b, stats_a['inv_cov']),
+        'JSD': jsd_manual(mu_a, mu_b),
+        'EMD': emd_manual(mu_a, mu_b),
+        'FID': fid_from_stats(stats_a, stats_b, fid_dtype),
+        'Bhattacharyya': bhattacharyya_from_stats(stats_a, stats_b),
+    }
+    if validate:
+        covmean = sqrtm(stats_a['cov'].dot(stats_b['cov']))
+        covmean = covmean.real if np.iscomplexobj(covmean) else covmean
+        diff = mu_a - mu_b
+        m.update({
+            'Cosine_scipy': cos_scipy(mu_a, mu_b),
+            'Pearson_scipy': pearson_scipy(mu_a, mu_b),
+            'Manhattan_scipy': manhattan_scipy(mu_a, mu_b),
+            'Mahalanobis_scipy': mahalanobis_scipy(mu_a, mu_b, stats_a['inv_cov']),
+            'JSD_scipy': jsd_scipy(mu_a, mu_b),
+            'EMD_scipy': emd_scipy(mu_a, mu_b),
+            'FID_sqrtm': float(diff.dot(diff) + np.trace(stats_a['cov'] + stats_b['cov'] - 2*covmean)),
+        })
+    return m
+
+
+def validation_report(summary: pd.DataFrame, rtol: float = 1e-6) -> pd.DataFrame:
+    """
+    Compare the manual and library implementations of the metrics computed in validation mode.
+
+    :param summary: Metrics of dataset pairs computed with validate=True
+    :type summary: pd.DataFrame
+    :param rtol: Relative tolerance
+    :type rtol: float
+    :return: Dataframe with the largest absolute and relative difference of each metric, and whether it is within rtol
+    :rtype: pd.DataFrame
+    """
+    rows = []
+    for metric in METRICS:
+        ref = f"{metric}_sqrtm" if metric == 'FID' else f"{metric}_scipy"
+        if ref not in summary:
+            continue
+        diff = (summary[metric] - summary[ref]).abs()
+        rel = diff / summary[ref].abs().clip(lower=1e-12)
+        rows.append({'metric': metric, 'max_abs_diff': diff.max(), 'max_rel_diff': rel.max(),
+                     'ok': bool(((diff <= rtol) | (rel <= rtol)).all())})
+    return pd.DataFrame(rows)
+
+
+# --- Kernel Inception Distance ---
+def polynomial_kernel_sum(x: np.ndarray, y: np.ndarray, block_size: int = KID_BLOCK_SIZE) -> float:
+    """
+    Sum of the cubic polynomial kernel k(x_i, y_j) = (x_i.y_j / d + 1)^3 over all pairs of rows, computed in blocks of
+    block_size x block_size so the kernel matrix is never held in memory. If y is x, only the blocks on and above the
+    diagonal are computed.
+
+    :param x: First samples (n x d)
+    :type x: np.ndarray
+    :param y: Second samples (m x d)
+    :type y: np.ndarray
+    :param block_size: Number of rows of the kernel blocks
+    :type block_size: int
+    :return: Sum of the kernel matrix
+    :rtype: float
+    """
+    symmetric = y is x
+    d = x.shape[1]
+    total = 0.0
+    for i in range(0, x.shape[0], block_size):
+        for j in range(i if symmetric else 0, y.shape[0], block_size):
+            k = (x[i:i+block_size] @ y[j:j+block_size].T / d + 1) ** 3
+            total += k.sum() * (2 if symmetric and j != i else 1)
+    return float(total)
+
+
+def mmd2_unbiased(x: np.ndarray, y: np.ndarray, block_size: int = KID_BLOCK_SIZE) -> float:
+    """
+    Unbiased estimate of the squared maximum mean discrepancy between two samples with the cubic polynomial kernel
+    (see polynomial_kernel_sum). The diagonal terms k(x_i, x_i) and k(y_i, y_i) are excluded from the within-sample
+    averages, so both samples need at least two rows.
+
+    :param x: First samples (n x d)
+    :type x: np.ndarray
+    :param y: Second samples (m x d)
+    :type y: np.ndarray
+    :param block_size: Number of rows of the kernel blocks
+    :type block_size: int
+    :return: Squared MMD
+    :rtype: float
+    """
+    n, m, d = x.shape[0], y.shape[0], x.shape[1]
+    if min(n, m) < 2:
+        raise ValueError(f"The unbiased MMD needs at least 2 samples per dataset, got {n} and {m}")
+    k_xx = polynomial_kernel_sum(x, x, block_size) - (((x * x).sum(1) / d + 1) ** 3).sum()
+    k_yy = polynomial_kernel_sum(y, y, block_size) - (((y * y).sum(1) / d + 1) ** 3).sum()
+    k_xy = polynomial_kernel_sum(x, y, block_size)
+    return float(k_xx / (n*(n-1)) + k_yy / (m*(m-1)) - 2*k_xy / (n*m))
+
+
+def kid(a: np.ndarray, b: np.ndarray, n_subsets: int = KID_SUBSETS, subset_size: Optional[int] = KID_SUBSET_SIZE,
+        block_size: int = KID_BLOCK_SIZE, seed=None) -> Dict[str, float]:
+    """
+    Kernel Inception Distance: unbiased squared MMD with the cubic polynomial kernel (see mmd2_unbiased), averaged over
+    n_subsets random subsets of subset_size samples of each dataset, drawn without replacement.
+    Peak memory is the two subsets (2 x subset_size x d floats) plus one kernel block (block_size^2 floats),
+    independent of the size of the datasets.
+
+    :param a: Features of the first dataset
+    :type a: np.ndarray
+    :param b: Features of the second dataset
+    :type b: np.ndarray
+    :param n_subsets: Number of subsets
+    :type n_subsets: int
+    :param subset_size: Number of samples of each subset, clipped to the size of the smaller dataset.
+        None uses all the samples of both datasets once.
+    :type subset_size: int
+    :param block_size: Number of rows of the kernel blocks
+    :type block_size: int
+    :param seed: Seed of the subset draws, defaults to None
+    :type seed: int
+    :return: Dictionary with the mean ('KID') and standard deviation ('KID_std') over the subsets, NaN when a dataset
+        has less than 2 samples
+    :rtype: Dictionary
+    """
+    if min(a.shape[0], b.shape[0]) < 2:
+        print(f"KID needs at least 2 samples per dataset, got {a.shape[0]} and {b.shape[0]}")
+        return {'KID': np.nan, 'KID_std': np.nan}
+    if subset_size is None:
+        values = [mmd2_unbiased(np.asarray(a, np.float64), np.asarray(b, np.float64), block_size)]
+    else:
+        rng = np.random.default_rng(seed)
+        m = min(subset_size, a.shape[0], b.shape[0])
+        values = []
+        for _ in range(n_subsets):
+            x = np.asarray(a[np.sort(rng.choice(a.shape[0], m, replace=False))], np.float64)
+            y = np.asarray(b[np.sort(rng.choice(b.shape[0], m, replace=False))], np.float64)
+            values.append(mmd2_unbiased(x, y, block_size))
+    return {'KID': float(np.mean(values)), 'KID_std': float(np.std(values))}
+
+
+# --- Compute metrics strategies ---
+def compute_metrics_nosample(a, b, validate=False):
+    """
+    Use full arrays without subsampling.
+    """
+    return metrics_from_stats(compute_dataset_stats(a), compute_dataset_stats(b), validate)
+
+def compute_metrics_subsample(a, b, validate=False, seed=None):
+    """
+    Subsample both arrays to the same size once.
+    """
+    rng = np.random.default_rng(seed)
+    n = min(a.shape[0], b.shape[0])
+    if a.shape[0] != b.shape[0]:
+        idx_a = rng.choice(a.shape[0], n, replace=False)
+        idx_b = rng.choice(b.shape[0], n, replace=False)
+        a, b = a[idx_a], b[idx_b]
+    return compute_metrics_nosample(a, b, validate)
+
+
+def bootstrap_rep(a, b, seed=None, sample_size=None, validate=False):
+    """
+    One bootstrap replicate: resample both arrays with replacement (to their own size, or to sample_size) and
+    compute the metrics of the resampled arrays.
+    """
+    rng = np.random.default_rng(seed)
+    idx_a = rng.integers(0, a.shape[0], sample_size or a.shape[0])
+    idx_b = rng.integers(0, b.shape[0], sample_size or b.shape[0])
+    return compute_metrics_nosample(a[idx_a], b[idx_b], validate)
+
+
+def compute_metrics_bootstrap(a, b, reps=5, validate=False, seed=None):
+    """
+    Repeat subsampling 'reps' times and average metrics.
+    Each repetition subsamples both arrays to the same size without replacement. For resampling with replacement and
+    confidence intervals, see bootstrap_pairs.
+    """
+    rng = np.random.default_rng(seed)
+    n = min(a.shape[0], b.shape[0])
+    metrics_list = []
+    for _ in range(reps):
+        idx_a = rng.choice(a.shape[0], n, replace=False)
+        idx_b = rng.choice(b.shape[0], n, replace=False)
+        metrics_list.append(compute_metrics_nosample(a[idx_a], b[idx_b], validate))
+    # average across reps
+    return {k: np.mean([m[k] for m in metrics_list]) for k in metrics_list[0]}
+
+
+# --- Pairwise metrics engine ---
+def comparison_pairs(patients: Sequence[str], synthetics: Sequence[str], do_pvss: bool = True,
+                     do_wp: bool = False, do_ws: bool = False) -> List[Tuple[str, str]]:
+    """
+    Dataset pairs of the selected comparisons: every patient vs. synthetic pair, then the pairs of distinct
+    patient datasets and of distinct synthetic datasets.
+
+    :param patients: Patient dataset names
+    :type patients: List[str]
+    :param synthetics: Synthetic dataset names
+    :type synthetics: List[str]
+    :param do_pvss: Compare patient vs. synthetic datasets
+    :type do_pvss: bool
+    :param do_wp: Compare patient datasets with each other
+    :type do_wp: bool
+    :param do_ws: Compare synthetic datasets with each other
+    :type do_ws: bool
+    :return: Pairs of dataset names
+    :rtype: List[Tuple[str]]
+    """
+    pairs = [(p, s) for p in patients for s in synthetics] if do_pvss else []
+    for names, selected in ((list(patients), do_wp), (list(synthetics), do_ws)):
+        if selected:
+            pairs += [(a, b) for i, a in enumerate(names) for b in names[i+1:]]
+    return pairs
+
+
+_grid_items: Dict = {}
+_grid_fn: Optional[Callable] = None
+
+
+def _init_grid_worker(items, fn):
+    global _grid_items, _grid_fn
+    _grid_items, _grid_fn = items, fn
+
+
+def _grid_task(a: str, b: str, kwargs: Dict) -> Dict[str, float]:
+    return _grid_fn(_grid_items[a], _grid_items[b], **kwargs)
+
+
+def pair_grid(items: Dict, pairs: Sequence[Tuple[str, str]], fn: Callable = metrics_from_stats,
+              n_workers: Optional[int] = None, seed: Optional[int] = None, **kwargs) -> pd.DataFrame:
+    """
+    Compute the metrics of many dataset pairs on a process pool. The per-dataset items (statistics or features)
+    are sent to each worker once, and each task only refers to the names of its pair.
+
+    :param items: Dictionary with dataset names as keys and the inputs of fn (statistics or features) as values
+    :type items: Dictionary
+    :param pairs: Pairs of dataset names
+    :type pairs: List[Tuple[str]]
+    :param fn: Function computing the metrics of a pair of items (a dictionary, or a dataframe of several rows),
+        defaults to metrics_from_stats
+    :type fn: Callable
+    :param n_workers: Number of worker processes, defaults to None which uses the number of CPUs. 1 runs in this process.
+    :type n_workers: int
+    :param seed: Seed of randomized functions (subsampling), each pair gets its own stream, defaults to None.
+        It is only passed to functions that have a seed parameter.
+    :type seed: int
+    :param kwargs: Keyword arguments passed to fn
+    :return: Dataframe with the metrics of each pair (one row, or the rows returned by fn) and the dataset names in
+        columns 'A' and 'B'
+    :rtype: pd.DataFrame
+    """
+    takes_seed = 'seed' in inspect.signature(fn).parameters
+    task_kwargs = [dict(kwargs, seed=[seed, i]) if seed is not None and takes_seed else kwargs
+                   for i in range(len(pairs))]
+    n_workers = min(n_workers or os.cpu_count() or 1, max(len(pairs), 1))
+    if n_workers == 1:
+        rows = [fn(items[a], items[b], **kw) for (a, b), kw in zip(pairs, task_kwargs)]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_grid_worker, initargs=(items, fn)) as executor:
+            rows = list(executor.map(_grid_task, [a for a, _ in pairs], [b for _, b in pairs], task_kwargs))
+    if rows and isinstance(rows[0], pd.DataFrame):
+        return pd.concat([r.assign(A=a, B=b) for r, (a, b) in zip(rows, pairs)], ignore_index=True)
+    df = pd.DataFrame(rows)
+    df['A'], df['B'] = [a for a, _ in pairs], [b for _, b in pairs]
+    return df
+
+
+# --- Bootstrap confidence intervals ---
+def percentile_ci(values: np.ndarray, confidence: float = 0.95) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Percentile bootstrap confidence interval of each column of the replicate values.
+
+    :param values: Metric values of the replicates (replicates x metrics)
+    :type values: np.ndarray
+    :param confidence: Confidence level
+    :type confidence: float
+    :return: Lower and upper bounds of each metric
+    :rtype: Tuple[np.ndarray]
+    """
+    alpha = (1 - confidence) / 2
+    return tuple(np.percentile(values, [100*alpha, 100*(1 - alpha)], axis=0))
+
+
+def bootstrap_pairs(items: Dict, pairs: Sequence[Tuple[str, str]], n_reps: int = 1000, batch_reps: int = 100,
+                    confidence: float = 0.95, rtol: Optional[float] = None, n_workers: Optional[int] = None,
+                    seed: Optional[int] = None, **kwargs) -> pd.DataFrame:
+    """
+    Bootstrap the metrics of many dataset pairs on a process pool (see bootstrap_rep). The features of each dataset are
+    sent to each worker once and the replicates of all pairs are distributed over the workers.
+    Every replicate has its own random stream spawned from seed (np.random.SeedSequence), so results do not depend on
+    the number of workers. Replicates are run in rounds of batch_reps per pair; with rtol, a pair stops early after
+    the first round in which the confidence interval width of all its metrics is at most rtol times the absolute
+    mean (metrics with non-finite replicates are left out of this check), otherwise it runs n_reps replicates.
+
+    :param items: Dictionary with dataset names as keys and features as values
+    :type items: Dictionary
+    :param pairs: Pairs of dataset names
+    :type pairs: List[Tuple[str]]
+    :param n_reps: Maximum number of replicates per pair
+    :type n_reps: int
+    :param batch_reps: Number of replicates per pair and round
+    :type batch_reps: int
+    :param confidence: Confidence level of the percentile intervals
+    :type confidence: float
+    :param rtol: Target confidence interval width relative to the absolute mean, defaults to None which disables
+        early stopping
+    :type rtol: float
+    :param n_workers: Number of worker processes, defaults to None which uses the number of CPUs. 1 runs in this process.
+    :type n_workers: int
+    :param seed: Seed of the replicates, defaults to None
+    :type seed: int
+    :param kwargs: Keyword arguments passed to bootstrap_rep (sample_size, validate)
+    :return: Dataframe with one row per pair and metric: 'A', 'B', 'metric', 'mean', 'std', 'ci_low', 'ci_high'
+        and the number of replicates 'n_reps'
+    :rtype: pd.DataFrame
+    """
+    rep_seeds = [s.spawn(n_reps) for s in np.random.SeedSequence(seed).spawn(len(pairs))]
+    results: List[List[Dict[str, float]]] = [[] for _ in pairs]
+    active = list(range(len(pairs)))
+    n_workers = n_workers or os.cpu_count() or 1
+    executor = None
+    if n_workers > 1:
+        executor = ProcessPoolExecutor(max_workers=n_workers, initializer=_init_grid_worker, initargs=(items, bootstrap_rep))
+    try:
+        while active:
+            tasks = [(i, r) for i in active for r in range(len(results[i]), min(len(results[i]) + batch_reps, n_reps))]
+            names_a = [pairs[i][0] for i, _ in tasks]
+            names_b = [pairs[i][1] for i, _ in tasks]
+            task_kwargs = [dict(kwargs, seed=rep_seeds[i][r]) for i, r in tasks]
+            if executor is None:
+                rows = [bootstrap_rep(items[a], items[b], **kw) for a, b, kw in zip(names_a, names_b, task_kwargs)]
+            else:
+                chunksize = max(1, len(tasks) // (4*n_workers))
+                rows = executor.map(_grid_task, names_a, names_b, task_kwargs, chunksize=chunksize)
+            for (i, _), row in zip(tasks, rows):
+                results[i].append(row)
+
+            still_active = []
+            for i in active:
+                if len(results[i]) >= n_reps:
+                    continue
+                if rtol is not None:
+                    values = pd.DataFrame(results[i]).values
+                    low, high = percentile_ci(values, confidence)
+                    # Metrics with non-finite replicates never get a finite interval and do not hold the pair back
+                    finite = np.isfinite(values).all(0)
+                    if np.all((high - low <= rtol * np.abs(values.mean(0))) | ~finite):
+                        continue
+                still_active.append(i)
+            active = still_active
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    rows = []
+    for (a, b), reps in zip(pairs, results):
+        df = pd.DataFrame(reps)
+        low, high = percentile_ci(df.values, confidence)
+        for k, metric in enumerate(df.columns):
+            rows.append({'A': a, 'B': b, 'metric': metric, 'mean': df[metric].mean(), 'std': df[metric].std(),
+                         'ci_low': low[k], 'ci_high': high[k], 'n_reps': len(df)})
+    return pd.DataFrame(rows)
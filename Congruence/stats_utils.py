@@ -0,0 +1,458 @@
+import os
+import hashlib
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Sequence
+import numpy as np
+import pandas as pd
+# Per-dataset summary statistics for the congruence metrics, computed in memory or streamed chunk by chunk
+
+# Version of the cached statistics. Increment when compute_dataset_stats or StreamingStats change.
+STATS_VERSION = '4'
+# Ridge added to the covariance before inversion
+COV_EPS = 1e-6
+# Number of rows read at once by the streaming statistics
+STREAM_CHUNK_ROWS = 10000
+# Number of bins of the per-feature histogram sketches
+HIST_BINS = 256
+
+
+def file_hash(path) -> str:
+    """
+    Compute the SHA-1 digest of the content of a file.
+
+    :param path: Path to file
+    :type path: str or Path
+    :return: Hex digest
+    :rtype: str
+    """
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_features(path) -> np.ndarray:
+    """
+    Load a feature CSV file (samples x features).
+    Feature files may contain 'filename' and 'hash' columns, only the numeric feature columns are used.
+
+    :param path: Path to feature CSV file
+    :type path: str or Path
+    :return: Feature array
+    :rtype: np.ndarray
+    """
+    return pd.read_csv(path).select_dtypes('number').values
+
+
+def covariance_factor(x: Optional[np.ndarray], cov: np.ndarray) -> np.ndarray:
+    """
+    Factor F of a covariance matrix with cov = F.F^T and as few columns as its rank allows.
+    With fewer samples than features (n <= d) the centered samples are used directly (d x n, no decomposition),
+    otherwise, or without samples, the factor is computed from the symmetric eigendecomposition of the covariance
+    (d x rank, eigenvalues at rounding error level are dropped).
+
+    :param x: Features with one row per sample, or None
+    :type x: np.ndarray
+    :param cov: Covariance of x
+    :type cov: np.ndarray
+    :return: Covariance factor
+    :rtype: np.ndarray
+    """
+    if x is not None and x.shape[0] <= x.shape[1]:
+        return ((x - x.mean(0)) / np.sqrt(max(x.shape[0] - 1, 1))).T
+    eigvals, eigvecs = np.linalg.eigh(cov)
+    keep = eigvals > max(eigvals.max(), 0) * len(eigvals) * np.finfo(np.float64).eps
+    return eigvecs[:, keep] * np.sqrt(eigvals[keep])
+
+
+def regularized_logdet(cov: np.ndarray) -> float:
+    """
+    Log-determinant of the covariance with the COV_EPS ridge, from its eigenvalues.
+
+    :param cov: Covariance
+    :type cov: np.ndarray
+    :return: log det(cov + COV_EPS.I)
+    :rtype: float
+    """
+    return float(np.log(np.clip(np.linalg.eigvalsh(cov), 0, None) + COV_EPS).sum())
+
+
+def compute_dataset_stats(features: np.ndarray, inverse: bool = True) -> Dict[str, np.ndarray]:
+    """
+    Compute the summary statistics of a dataset used by the congruence metrics: number of samples, mean,
+    covariance, inverse of the regularized covariance (for the Mahalanobis distance) and covariance factor
+    (for the FID, see covariance_factor).
+
+    :param features: Features with one row per sample
+    :type features: np.ndarray
+    :param inverse: Compute the inverse covariance
+    :type inverse: bool
+    :return: Dictionary with keys 'n', 'mean', 'cov', 'factor' and, if inverse, 'inv_cov' and 'logdet'
+    :rtype: Dictionary
+    """
+    x = np.asarray(features, dtype=np.float64).reshape(len(features), -1)
+    return stats_from_moments(x.shape[0], x.mean(0), np.atleast_2d(np.cov(x, rowvar=False)), inverse, x)
+
+
+def stats_from_moments(n: int, mean: np.ndarray, cov: np.ndarray, inverse: bool = True,
+                       x: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+    """
+    Summary statistics of a dataset (see compute_dataset_stats) from its number of samples, mean and covariance.
+
+    :param n: Number of samples
+    :type n: int
+    :param mean: Mean
+    :type mean: np.ndarray
+    :param cov: Covariance
+    :type cov: np.ndarray
+    :param inverse: Compute the inverse covariance and its log-determinant
+    :type inverse: bool
+    :param x: Samples, if available, for the low-rank covariance factor (see covariance_factor)
+    :type x: np.ndarray
+    :return: Dictionary with keys 'n', 'mean', 'cov', 'factor' and, if inverse, 'inv_cov' and 'logdet'
+    :rtype: Dictionary
+    """
+    stats = {
+        'n': np.array(n),
+        'mean': mean,
+        'cov': cov,
+        'factor': covariance_factor(x, cov),
+    }
+    if inverse:
+        stats['inv_cov'] = np.linalg.pinv(cov + COV_EPS*np.eye(cov.shape[0]))
+        stats['logdet'] = np.array(regularized_logdet(cov))
+    return stats
+
+
+def _hist_grid(lo: np.ndarray, hi: np.ndarray, width: np.ndarray, bins: int):
+    # Smallest power-of-two multiples of the bin widths whose grids, aligned on multiples of the width, cover [lo, hi]
+    width = width.copy()
+    while True:
+        offset = np.floor(lo / width)
+        too_small = np.floor(hi / width) - offset >= bins
+        if not too_small.any():
+            return width, offset.astype(np.int64)
+        width[too_small] *= 2
+
+
+def _rebin(counts: np.ndarray, width: np.ndarray, offset: np.ndarray, new_width: np.ndarray, new_offset: np.ndarray):
+    # Histogram counts on a grid with power-of-two multiples of the bin widths. Merged bins are exact.
+    # Non-empty bins always fall within the new grid, the clip only moves empty bins.
+    d, bins = counts.shape
+    factor = np.round(new_width / width).astype(np.int64)
+    index = np.clip((offset[:, None] + np.arange(bins)) // factor[:, None] - new_offset[:, None], 0, bins - 1)
+    flat = (np.arange(d)[:, None]*bins + index).ravel()
+    return np.bincount(flat, weights=counts.ravel(), minlength=d*bins).reshape(d, bins).astype(np.int64)
+
+
+def histogram_quantiles(hist_counts: np.ndarray, hist_width: np.ndarray, hist_offset: np.ndarray, vmin: np.ndarray,
+                        vmax: np.ndarray, q) -> np.ndarray:
+    """
+    Approximate per-feature quantiles from histogram sketches (see StreamingStats), linear within bins and within
+    [vmin, vmax]. The error is at most one bin width of the feature.
+
+    :param hist_counts: Counts (features x bins)
+    :type hist_counts: np.ndarray
+    :param hist_width: Bin width of each feature
+    :type hist_width: np.ndarray
+    :param hist_offset: Index of the first bin of each feature, in bin widths
+    :type hist_offset: np.ndarray
+    :param vmin: Minimum of each feature
+    :type vmin: np.ndarray
+    :param vmax: Maximum of each feature
+    :type vmax: np.ndarray
+    :param q: Quantiles in [0, 1]
+    :type q: float or List[float]
+    :return: Quantiles (features x len(q))
+    :rtype: np.ndarray
+    """
+    bins = hist_counts.shape[1]
+    edges = (hist_offset[:, None] + np.arange(bins + 1)) * hist_width[:, None]
+    cdf = np.concatenate([np.zeros((len(hist_counts), 1)), np.cumsum(hist_counts, axis=1)], axis=1)
+    cdf /= cdf[:, -1:]
+    q = np.atleast_1d(q)
+    values = np.array([np.interp(q, c, e) for c, e in zip(cdf, edges)])
+    return np.clip(values, vmin[:, None], vmax[:, None])
+
+
+class StreamingStats:
+    """
+    Mergeable streaming statistics of a dataset: number of samples, mean and co-moment matrix (Welford/Chan updates),
+    per-feature minimum and maximum, and per-feature histogram sketches.
+    Chunks of samples are added with update and the statistics of shards are combined with merge, with the same result
+    as computing them on all the samples at once, up to rounding.
+    Histogram bins of a feature have a power-of-two width and are aligned on multiples of it. When new values fall outside
+    the bins, the width is doubled (pairs of bins are merged) until they are covered, so histograms of different chunks
+    or shards can always be merged exactly.
+    Samples with a non-finite (NaN or infinite) feature are left out of all the statistics, so the covariance is computed
+    from complete samples. Their number is kept in n_dropped, and the number of non-finite values of each feature in nonfinite.
+    """
+
+    def __init__(self, bins: int = HIST_BINS):
+        self.bins = bins
+        self.n = 0
+        self.n_dropped = 0
+        self.nonfinite = None
+        self.mean = self.m2 = self.min = self.max = None
+        self.hist_counts = self.hist_width = self.hist_offset = None
+
+    def update(self, chunk: np.ndarray) -> 'StreamingStats':
+        """
+        Add a chunk of samples. Samples with a non-finite feature are only counted (see n_dropped and nonfinite).
+
+        :param chunk: Features with one row per sample
+        :type chunk: np.ndarray
+        :return: self
+        :rtype: StreamingStats
+        """
+        x = np.asarray(chunk, dtype=np.float64).reshape(len(chunk), -1)
+        finite = np.isfinite(x)
+        complete = finite.all(axis=1)
+        if not complete.all():
+            self._count_nonfinite(int(len(x) - complete.sum()), len(x) - finite.sum(0))
+            x = x[complete]
+        if not len(x):
+            return self
+        lo, hi = x.min(0), x.max(0)
+        if self.n == 0:
+            width = 2.0 ** np.ceil(np.log2(np.maximum((hi - lo) / self.bins, np.maximum(np.abs(lo), np.abs(hi)) * 2.0**-40 + 2.0**-60)))
+            self.hist_width, self.hist_offset = _hist_grid(lo, hi, width, self.bins)
+            self.hist_counts = np.zeros((x.shape[1], self.bins), dtype=np.int64)
+        else:
+            self._fit_hist(np.minimum(lo, self.min), np.maximum(hi, self.max), self.hist_width)
+        index = np.clip(np.floor(x / self.hist_width) - self.hist_offset, 0, self.bins - 1).astype(np.int64)
+        flat = (np.arange(x.shape[1])*self.bins + index).ravel()
+        self.hist_counts += np.bincount(flat, minlength=self.hist_counts.size).reshape(self.hist_counts.shape)
+
+        chunk_stats = StreamingStats(self.bins)
+        chunk_stats.n, chunk_stats.mean = len(x), x.mean(0)
+        centered = x - chunk_stats.mean
+        chunk_stats.m2, chunk_stats.min, chunk_stats.max = centered.T @ centered, lo, hi
+        self._merge_moments(chunk_stats)
+        return self
+
+    def merge(self, other: 'StreamingStats') -> 'StreamingStats':
+        """
+        Add the statistics of another set of samples, e.g. another shard of the dataset.
+
+        :param other: Statistics of the other samples
+        :type other: StreamingStats
+        :return: self
+        :rtype: StreamingStats
+        """
+        self._count_nonfinite(other.n_dropped, other.nonfinite)
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            counts = self.n_dropped, self.nonfinite
+            self.__dict__.update({k: (v.copy() if isinstance(v, np.ndarray) else v) for k, v in other.__dict__.items()})
+            self.n_dropped, self.nonfinite = counts
+            return self
+        assert self.bins == other.bins, f"Cannot merge histograms of {self.bins} and {other.bins} bins"
+        lo, hi = np.minimum(self.min, other.min), np.maximum(self.max, other.max)
+        self._fit_hist(lo, hi, np.maximum(self.hist_width, other.hist_width))
+        self.hist_counts += _rebin(other.hist_counts, other.hist_width, other.hist_offset, self.hist_width, self.hist_offset)
+        self._merge_moments(other)
+        return self
+
+    def _count_nonfinite(self, n_dropped: int, nonfinite: Optional[np.ndarray]):
+        self.n_dropped += n_dropped
+        if nonfinite is not None:
+            self.nonfinite = nonfinite.astype(np.int64) if self.nonfinite is None else self.nonfinite + nonfinite
+
+    def _fit_hist(self, lo: np.ndarray, hi: np.ndarray, width: np.ndarray):
+        width, offset = _hist_grid(lo, hi, width, self.bins)
+        if np.any(width != self.hist_width) or np.any(offset != self.hist_offset):
+            self.hist_counts = _rebin(self.hist_counts, self.hist_width, self.hist_offset, width, offset)
+            self.hist_width, self.hist_offset = width, offset
+
+    def _merge_moments(self, other: 'StreamingStats'):
+        if self.n == 0:
+            self.n, self.mean, self.m2, self.min, self.max = other.n, other.mean, other.m2, other.min, other.max
+            return
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.n / n)
+        self.m2 = self.m2 + other.m2 + np.outer(delta, delta) * (self.n * other.n / n)
+        self.min, self.max = np.minimum(self.min, other.min), np.maximum(self.max, other.max)
+        self.n = n
+
+    def cov(self) -> np.ndarray:
+        """
+        Sample covariance (normalized by n - 1).
+        """
+        return self.m2 / max(self.n - 1, 1)
+
+    def histogram(self):
+        """
+        Per-feature histogram sketches.
+
+        :return: Counts (features x bins) and bin edges (features x bins + 1)
+        :rtype: Tuple[np.ndarray]
+        """
+        edges = (self.hist_offset[:, None] + np.arange(self.bins + 1)) * self.hist_width[:, None]
+        return self.hist_counts, edges
+
+    def quantiles(self, q) -> np.ndarray:
+        """
+        Approximate per-feature quantiles from the histogram sketches (see histogram_quantiles).
+
+        :param q: Quantiles in [0, 1]
+        :type q: float or List[float]
+        :return: Quantiles (features x len(q))
+        :rtype: np.ndarray
+        """
+        return histogram_quantiles(self.hist_counts, self.hist_width, self.hist_offset, self.min, self.max, q)
+
+    def stats(self, inverse: bool = True) -> Dict[str, np.ndarray]:
+        """
+        Summary statistics for the congruence metrics (see compute_dataset_stats), with the per-feature minimum and
+        maximum ('min', 'max'), histogram sketches ('hist_counts', 'hist_width', 'hist_offset') and the number of
+        samples left out for non-finite features ('n_dropped').
+
+        :param inverse: Compute the inverse covariance and its log-determinant
+        :type inverse: bool
+        :return: Dictionary of statistics
+        :rtype: Dictionary
+        """
+        stats = stats_from_moments(self.n, self.mean, self.cov(), inverse)
+        stats.update({'min': self.min, 'max': self.max, 'hist_counts': self.hist_counts,
+                      'hist_width': self.hist_width, 'hist_offset': self.hist_offset, 'n_dropped': np.array(self.n_dropped)})
+        return stats
+
+    def to_dict(self) -> Dict[str, np.ndarray]:
+        """
+        State of the accumulator as arrays, e.g. to save it with np.savez.
+        """
+        state = {'n': np.array(self.n), 'bins': np.array(self.bins), 'n_dropped': np.array(self.n_dropped)}
+        if self.nonfinite is not None:
+            state['nonfinite'] = self.nonfinite
+        if self.n:
+            state.update({'mean': self.mean, 'm2': self.m2, 'min': self.min, 'max': self.max,
+                          'hist_counts': self.hist_counts, 'hist_width': self.hist_width, 'hist_offset': self.hist_offset})
+        return state
+
+    @classmethod
+    def from_dict(cls, state: Dict[str, np.ndarray]) -> 'StreamingStats':
+        """
+        Accumulator from a state returned by to_dict.
+        """
+        acc = cls(int(state['bins']))
+        acc.n = int(state['n'])
+        acc.n_dropped = int(state.get('n_dropped', 0))
+        acc.nonfinite = state.get('nonfinite')
+        if acc.n:
+            acc.mean, acc.m2, acc.min, acc.max = state['mean'], state['m2'], state['min'], state['max']
+            acc.hist_counts, acc.hist_width, acc.hist_offset = state['hist_counts'], state['hist_width'], state['hist_offset']
+        return acc
+
+    def save(self, path):
+        """
+        Save the state of the accumulator to an NPZ file, e.g. the statistics of one shard.
+        """
+        np.savez(path, **self.to_dict())
+
+    @classmethod
+    def load(cls, path) -> 'StreamingStats':
+        """
+        Load an accumulator saved with save.
+        """
+        with np.load(path, allow_pickle=False) as data:
+            return cls.from_dict({k: data[k] for k in data.files})
+
+
+def iter_feature_chunks(path, chunk_rows: int = STREAM_CHUNK_ROWS, label: Optional[str] = None) -> Iterator[np.ndarray]:
+    """
+    Read the features of a dataset chunk by chunk, without loading the whole file.
+    Supported sources are feature CSV files (numeric columns only), NPY arrays (memory-mapped) and feature store
+    directories written by the feature extraction pipeline (memory-mapped chunk files, rows of the given label).
+
+    :param path: Path to feature CSV or NPY file, or feature store directory
+    :type path: str or Path
+    :param chunk_rows: Maximum number of rows per chunk
+    :type chunk_rows: int
+    :param label: Dataset label of the rows to read from a feature store, defaults to None which reads all rows
+    :type label: str
+    :return: Iterator over feature chunks
+    :rtype: Iterator[np.ndarray]
+    """
+    path = Path(path)
+    if path.is_dir():
+        index = pd.read_csv(path/'index.csv', usecols=['label', 'chunk', 'row'])
+        if label is not None:
+            index = index[index['label'] == label]
+        for chunk, rows in index.groupby('chunk', sort=True)['row']:
+            data = np.load(path/f"chunk_{chunk:06d}.npy", mmap_mode='r')
+            rows = np.sort(rows.values)
+            for i in range(0, len(rows), chunk_rows):
+                yield np.asarray(data[rows[i:i+chunk_rows]])
+    elif path.suffix == '.npy':
+        data = np.load(path, mmap_mode='r')
+        for i in range(0, len(data), chunk_rows):
+            yield np.asarray(data[i:i+chunk_rows])
+    else:
+        columns = None
+        for chunk in pd.read_csv(path, chunksize=chunk_rows):
+            if columns is None:
+                columns = chunk.select_dtypes('number').columns
+            yield chunk[columns].to_numpy(np.float64)
+
+
+def stream_dataset_stats(paths: Sequence, chunk_rows: int = STREAM_CHUNK_ROWS, bins: int = HIST_BINS,
+                         label: Optional[str] = None) -> StreamingStats:
+    """
+    Accumulate the streaming statistics of a dataset whose features are stored in one or more files (e.g. shards),
+    reading chunk_rows rows at a time (see iter_feature_chunks).
+
+    :param paths: Feature files or feature store directories of the dataset
+    :type paths: List[str or Path]
+    :param chunk_rows: Maximum number of rows read at once
+    :type chunk_rows: int
+    :param bins: Number of bins of the histogram sketches
+    :type bins: int
+    :param label: Dataset label of the rows to read from feature stores
+    :type label: str
+    :return: Streaming statistics
+    :rtype: StreamingStats
+    """
+    acc = StreamingStats(bins)
+    for path in paths:
+        for chunk in iter_feature_chunks(path, chunk_rows, label):
+            acc.update(chunk)
+    if acc.n_dropped:
+        print(f"{acc.n_dropped} samples with non-finite features left out of the statistics of {', '.join(map(str, paths))}")
+    return acc
+
+
+def load_dataset_stats(path, cache_dir=None) -> Dict[str, np.ndarray]:
+    """
+    Compute the summary statistics of a dataset from its feature file, streamed chunk by chunk so the file is never
+    loaded whole (see stream_dataset_stats and StreamingStats.stats).
+    If a cache directory is given, the statistics are cached keyed by the content hash of the feature file,
+    so they are only recomputed when the file changes.
+
+    :param path: Path to feature CSV file
+    :type path: str or Path
+    :param cache_dir: Statistics cache directory, defaults to None which disables the cache
+    :type cache_dir: str or Path
+    :return: Dictionary of statistics (see StreamingStats.stats)
+    :rtype: Dictionary
+    """
+    cache_path: Optional[Path] = None
+    if cache_dir is not None:
+        cache_path = Path(cache_dir)/f"{file_hash(path)}-v{STATS_VERSION}.npz"
+        if cache_path.exists():
+            try:
+                with np.load(cache_path, allow_pickle=False) as data:
+                    return {k: data[k] for k in data.files}
+            except (OSError, ValueError) as e:
+                print(f"Error loading cached statistics {cache_path}, recomputing: {e}")
+
+    stats = stream_dataset_stats([path]).stats()
+    if cache_path is not None:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_name(cache_path.stem + '.tmp.npz')
+        np.savez(tmp_path, **stats)
+        os.replace(tmp_path, cache_path)
+    return stats
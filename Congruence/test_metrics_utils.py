@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from stats_utils import compute_dataset_stats, stats_from_moments
+from metrics_utils import (
+    bootstrap_pairs, compute_metrics_bootstrap, compute_metrics_nosample, compute_metrics_subsample, fid_from_stats,
+    fid_sqrtm, kid, mmd2_unbiased, pair_grid
+)
+# Tests of the eigendecomposition FID against the general matrix square root version, of the blocked KID, of the
+# pair grid and of the sampling strategies
+
+
+def correlated_features(n, d, seed):
+    rng = np.random.default_rng(seed)
+    return rng.normal(size=(n, d)) @ rng.normal(size=(d, d)) / np.sqrt(d) + rng.normal(size=d)
+
+
+@pytest.mark.parametrize('n_a, n_b, d', [
+    (500, 400, 32),   # full rank, covariance factors from eigendecompositions
+    (20, 30, 64),     # low rank, covariance factors are the centered samples
+    (100, 20, 64),    # one full rank and one low rank dataset
+])
+@pytest.mark.parametrize('dtype, rtol', [(np.float64, 1e-8), (np.float32, 1e-4)])
+def test_fid_from_stats_matches_sqrtm(n_a, n_b, d, dtype, rtol):
+    a, b = correlated_features(n_a, d, 0), correlated_features(n_b, d, 1)
+    ref = fid_sqrtm(a, b)
+    value = fid_from_stats(compute_dataset_stats(a, inverse=False), compute_dataset_stats(b, inverse=False), dtype)
+    assert value == pytest.approx(ref, rel=rtol)
+
+
+@pytest.mark.parametrize('dtype, rtol', [(np.float64, 1e-8), (np.float32, 1e-4)])
+def test_fid_from_streamed_moments_matches_sqrtm(dtype, rtol):
+    # Streamed statistics have no samples, so the factors always come from eigendecompositions
+    a, b = correlated_features(500, 32, 0), correlated_features(400, 32, 1)
+    stats_a, stats_b = [stats_from_moments(len(x), x.mean(0), np.cov(x, rowvar=False), inverse=False) for x in (a, b)]
+    assert fid_from_stats(stats_a, stats_b, dtype) == pytest.approx(fid_sqrtm(a, b), rel=rtol)
+
+
+def test_fid_identical_datasets():
+    a = correlated_features(200, 16, 0)
+    stats = compute_dataset_stats(a, inverse=False)
+    assert fid_from_stats(stats, stats) == pytest.approx(0, abs=1e-8)
+
+
+def seeded_mean_gap(a, b, seed=None):
+    rng = np.random.default_rng(seed)
+    return {'gap': abs(rng.choice(a).mean() - rng.choice(b).mean())}
+
+
+def test_pair_grid_seed():
+    features = {name: correlated_features(50, 8, i) for i, name in enumerate('abc')}
+    stats = {name: compute_dataset_stats(x) for name, x in features.items()}
+    pairs = [('a', 'b'), ('a', 'c'), ('b', 'c')]
+    # metrics_from_stats is deterministic and has no seed parameter, the seed is not passed to it
+    seeded = pair_grid(stats, pairs, n_workers=1, seed=0)
+    pd.testing.assert_frame_equal(seeded, pair_grid(stats, pairs, n_workers=1))
+    # Randomized functions get one stream per pair
+    first = pair_grid(features, pairs, seeded_mean_gap, n_workers=1, seed=0)
+    pd.testing.assert_frame_equal(first, pair_grid(features, pairs, seeded_mean_gap, n_workers=1, seed=0))
+    assert first['gap'].nunique() == len(pairs)
+
+
+def mmd2_full(x, y):
+    # Unbiased squared MMD from the full kernel matrices
+    n, m, d = len(x), len(y), x.shape[1]
+    k_xx, k_yy, k_xy = [(u @ v.T / d + 1) ** 3 for u, v in ((x, x), (y, y), (x, y))]
+    return ((k_xx.sum() - np.trace(k_xx)) / (n*(n-1)) + (k_yy.sum() - np.trace(k_yy)) / (m*(m-1))
+            - 2*k_xy.mean())
+
+
+@pytest.mark.parametrize('block_size', range(1, 30))
+def test_mmd2_blocks_match_full_matrix(block_size):
+    x, y = correlated_features(23, 6, 0), correlated_features(17, 6, 1)
+    assert mmd2_unbiased(x, y, block_size) == pytest.approx(mmd2_full(x, y), rel=1e-10)
+
+
+def test_kid_single_sample():
+    a, b = correlated_features(1, 6, 0), correlated_features(10, 6, 1)
+    for subset_size in (1000, None):
+        assert np.isnan(kid(a, b, subset_size=subset_size)['KID'])
+    with pytest.raises(ValueError):
+        mmd2_unbiased(a, b)
+
+
+def test_compute_metrics_bootstrap_averages_subsamples():
+    a, b = correlated_features(60, 4, 0), correlated_features(40, 4, 1)
+    # One repetition draws the same equal-size subsamples without replacement as subsampling once
+    assert compute_metrics_bootstrap(a, b, reps=1, seed=3) == pytest.approx(compute_metrics_subsample(a, b, seed=3))
+    # With equal sizes every subsample is a permutation of the full dataset
+    assert compute_metrics_bootstrap(a[:40], b, reps=3, seed=3) == pytest.approx(compute_metrics_nosample(a[:40], b))
+
+
+def test_bootstrap_pairs_workers_and_early_stopping():
+    features = {name: correlated_features(40, 4, i) for i, name in enumerate('abc')}
+    pairs = [('a', 'b'), ('a', 'c'), ('b', 'c')]
+    kwargs = dict(n_reps=40, batch_reps=10, seed=0)
+    single = bootstrap_pairs(features, pairs, n_workers=1, **kwargs)
+    pd.testing.assert_frame_equal(single, bootstrap_pairs(features, pairs, n_workers=2, **kwargs))
+    assert (single['n_reps'] == 40).all()
+    # Every interval is narrower than 100 times the mean after the first round
+    stopped = bootstrap_pairs(features, pairs, n_workers=1, rtol=100, **kwargs)
+    assert (stopped['n_reps'] == 10).all()
+    pd.testing.assert_frame_equal(stopped, bootstrap_pairs(features, pairs, n_workers=2, rtol=100, **kwargs))
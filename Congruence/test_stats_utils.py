@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from stats_utils import StreamingStats, compute_dataset_stats
+# Tests of the streaming statistics with non-finite features
+
+
+def features_with_nonfinite(seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.normal(size=(500, 6))
+    x[3, 1] = np.nan
+    x[10, 4] = np.inf
+    x[11, 0] = -np.inf
+    x[11, 5] = np.nan
+    return x
+
+
+def test_nonfinite_samples_left_out():
+    x = features_with_nonfinite()
+    complete = np.isfinite(x).all(axis=1)
+    acc = StreamingStats()
+    for i in range(0, len(x), 64):
+        acc.update(x[i:i+64])
+    ref = compute_dataset_stats(x[complete], inverse=False)
+
+    assert acc.n == complete.sum() and acc.n_dropped == 3
+    assert acc.nonfinite.tolist() == [1, 1, 0, 0, 1, 1]
+    assert np.allclose(acc.mean, ref['mean']) and np.allclose(acc.cov(), ref['cov'])
+    assert np.array_equal(acc.min, x[complete].min(0)) and np.array_equal(acc.max, x[complete].max(0))
+    assert (acc.hist_counts.sum(axis=1) == complete.sum()).all()
+    assert np.isfinite(acc.quantiles([0.1, 0.5, 0.9])).all()
+
+
+def test_nonfinite_counts_merge_and_save(tmp_path):
+    x = features_with_nonfinite()
+    whole = StreamingStats().update(x)
+    # The first shard only has a non-finite sample
+    shards = [StreamingStats().update(x[3:4]), StreamingStats().update(x[:3]), StreamingStats().update(x[4:])]
+    shards[0].save(tmp_path/'shard.npz')
+    merged = StreamingStats.load(tmp_path/'shard.npz')
+    for shard in shards[1:]:
+        merged.merge(shard)
+
+    assert merged.n == whole.n and merged.n_dropped == whole.n_dropped
+    assert np.array_equal(merged.nonfinite, whole.nonfinite)
+    assert np.allclose(merged.mean, whole.mean) and np.allclose(merged.m2, whole.m2)
+    assert np.array_equal(merged.hist_counts.sum(axis=1), whole.hist_counts.sum(axis=1))
+    assert int(merged.stats(inverse=False)['n_dropped']) == 3
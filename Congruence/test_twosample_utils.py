@@ -0,0 +1,60 @@
+import warnings
+import numpy as np
+import pytest
+from scipy.stats import anderson_ksamp, cramervonmises_2samp, ks_2samp
+
+from stats_utils import StreamingStats
+from twosample_utils import sketch_from_stats, sorted_sample, two_sample_tests
+# Tests of the two-sample test engine against scipy
+
+
+def scipy_tests(a, b):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        ad = anderson_ksamp([a, b], midrank=True).statistic if len(np.unique(np.concatenate([a, b]))) > 1 else np.nan
+    return ks_2samp(a, b).statistic, cramervonmises_2samp(a, b).statistic, ad
+
+
+def datasets():
+    rng = np.random.default_rng(0)
+    a, b = rng.normal(size=(300, 5)), rng.normal(0.2, 1.1, size=(200, 5))
+    a[:, 1], b[:, 1] = rng.integers(0, 5, 300), rng.integers(1, 6, 200)   # ties
+    a[:, 2], b[:, 2] = 3., 3.                                              # constant
+    a[:, 3], b[:, 3] = 1., rng.integers(0, 3, 200)                         # constant in one dataset
+    a[::7, 4], b[::5, 0] = np.nan, np.inf                                  # non-finite values
+    return a, b
+
+
+def test_two_sample_tests_match_scipy():
+    a, b = datasets()
+    df = two_sample_tests(sorted_sample(a), sorted_sample(b))
+    for j in range(a.shape[1]):
+        col_a, col_b = a[:, j][np.isfinite(a[:, j])], b[:, j][np.isfinite(b[:, j])]
+        ks, cvm, ad = scipy_tests(col_a, col_b)
+        assert df['KS'][j] == pytest.approx(ks, abs=1e-12)
+        assert df['CvM'][j] == pytest.approx(cvm, rel=1e-9)
+        assert df['AD'][j] == pytest.approx(ad, rel=1e-9, nan_ok=True)
+
+
+def test_feature_without_finite_values():
+    a, b = datasets()
+    a[:, 0] = np.nan
+    df = two_sample_tests(sorted_sample(a), sorted_sample(b))
+    assert df.loc[0, ['KS', 'CvM', 'AD']].isnull().all()
+    assert df.loc[1, ['KS', 'CvM', 'AD']].notnull().all()
+
+
+def test_sketches_close_to_exact():
+    rng = np.random.default_rng(1)
+    a, b = rng.normal(size=(20000, 3)), rng.normal(0.1, 1., size=(15000, 3))
+    a[::10, 0] = np.nan
+    exact = two_sample_tests(sorted_sample(a), sorted_sample(b))
+    sketched = two_sample_tests(sorted_sample(a, 1024), sorted_sample(b, 1024))
+    assert np.allclose(sketched['KS'], exact['KS'], atol=2e-3)
+
+    # Streamed statistics leave out the samples with a non-finite feature, as sorted_sample does for that feature
+    complete = np.isfinite(a).all(axis=1)
+    from_stats = sketch_from_stats(StreamingStats().update(a).stats(inverse=False), 1024)
+    assert (from_stats['n'] == complete.sum()).all()
+    streamed = two_sample_tests(from_stats, sorted_sample(b, 1024))
+    assert np.allclose(streamed['KS'], two_sample_tests(sorted_sample(a[complete]), sorted_sample(b))['KS'], atol=5e-3)
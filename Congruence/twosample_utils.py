@@ -0,0 +1,157 @@
+import math
+from functools import lru_cache
+from typing import Dict, Optional
+import numpy as np
+import pandas as pd
+
+from stats_utils import histogram_quantiles
+# Per-feature two-sample tests (Kolmogorov-Smirnov, Cramér-von Mises, Anderson-Darling) between datasets
+#
+# Each dataset is prepared once (sorted feature columns, or a fixed-size quantile sketch) and reused for all its pairs.
+# The statistics of a pair are computed from a linear merge of the two sorted columns of each feature, with the tie
+# handling (midranks) of scipy.stats.ks_2samp, cramervonmises_2samp and anderson_ksamp.
+# Non-finite values (e.g. the features of images without foreground tiles) are left out of their feature, so every
+# feature has its own number of samples, as the streamed statistics leave them out too.
+
+# Two-sample test statistics, in output order
+TWO_SAMPLE_TESTS = ['KS', 'CvM', 'AD']
+# Default number of quantiles per feature of the sketches
+SKETCH_SIZE = 1024
+
+
+def sorted_sample(features: np.ndarray, sketch_size: Optional[int] = None) -> Dict[str, np.ndarray]:
+    """
+    Prepare a dataset for the two-sample tests: each feature column is sorted once. With sketch_size, only
+    sketch_size quantiles of each feature (at probabilities (i + 0.5) / sketch_size) are kept, each standing for
+    n / sketch_size samples, which bounds the cost of the tests on very large datasets.
+    Non-finite values are left out of their feature: they are stored as NaN after the sorted values, and the number
+    of samples is counted per feature.
+
+    :param features: Features with one row per sample
+    :type features: np.ndarray
+    :param sketch_size: Number of quantiles per feature, defaults to None which keeps all samples
+    :type sketch_size: int
+    :return: Dictionary with the sorted values or quantiles of each feature ('values', features x rows), and the number
+        of samples ('n') and of samples per row ('weight') of each feature
+    :rtype: Dictionary
+    """
+    x = np.array(features, dtype=np.float64).reshape(len(features), -1).T
+    x[~np.isfinite(x)] = np.nan
+    n = np.count_nonzero(~np.isnan(x), axis=1)
+    if sketch_size is None or sketch_size >= x.shape[1]:
+        return {'values': np.sort(x, axis=1), 'n': n, 'weight': np.ones(len(x))}
+    probs = (np.arange(sketch_size) + 0.5) / sketch_size
+    values = np.full((len(x), sketch_size), np.nan)
+    values[n > 0] = np.nanquantile(x[n > 0], probs, axis=1).T
+    return {'values': values, 'n': n, 'weight': n / sketch_size}
+
+
+def sketch_from_stats(stats: Dict[str, np.ndarray], sketch_size: int = SKETCH_SIZE) -> Dict[str, np.ndarray]:
+    """
+    Quantile sketch of a dataset (see sorted_sample) from the histogram sketches of its streamed statistics
+    (see stats_utils.load_dataset_stats), without reading the features again.
+
+    :param stats: Dataset statistics with histogram sketches
+    :type stats: Dictionary
+    :param sketch_size: Number of quantiles per feature
+    :type sketch_size: int
+    :return: Prepared dataset
+    :rtype: Dictionary
+    """
+    probs = (np.arange(sketch_size) + 0.5) / sketch_size
+    values = histogram_quantiles(stats['hist_counts'], stats['hist_width'], stats['hist_offset'],
+                                 stats['min'], stats['max'], probs)
+    n = np.full(len(values), int(stats['n']))
+    return {'values': values, 'n': n, 'weight': n / sketch_size}
+
+
+@lru_cache(maxsize=256)
+def _ad_sigma(n_a: float, n_b: float) -> float:
+    # Standard deviation of the 2-sample Anderson-Darling statistic under the null hypothesis (Scholz and Stephens 1987)
+    k, n_total = 2, n_a + n_b
+    big_h = 1/n_a + 1/n_b
+    hs_cs = np.cumsum(1. / np.arange(n_total - 1, 1, -1))
+    h = hs_cs[-1] + 1
+    g = (hs_cs / np.arange(2, n_total)).sum()
+    a = (4*g - 6)*(k - 1) + (10 - 6*g)*big_h
+    b = (2*g - 4)*k**2 + 8*h*k + (2*g - 14*h - 4)*big_h - 8*h + 4*g - 6
+    c = (6*h + 2*g - 2)*k**2 + (4*h - 4*g + 6)*k + (2*h - 6)*big_h + 4*h
+    d = (2*h + 6)*k**2 - 4*h*k
+    return math.sqrt((a*n_total**3 + b*n_total**2 + c*n_total + d) / ((n_total - 1.)*(n_total - 2.)*(n_total - 3.)))
+
+
+def _merged_groups(a: np.ndarray, b: np.ndarray, w_a: float, w_b: float):
+    # Merge of two sorted columns (a stable sort of two sorted runs is a single linear merge), then, for each distinct
+    # pooled value, the numbers of samples of each dataset up to and including it, and before it
+    pooled = np.concatenate([a, b])
+    order = np.argsort(pooled, kind='stable')
+    values = pooled[order]
+    count_a = np.cumsum(order < len(a))
+    ends = np.flatnonzero(np.append(values[1:] != values[:-1], True))
+    cum_a = count_a[ends] * w_a
+    cum_b = (ends + 1 - count_a[ends]) * w_b
+    left_a = np.concatenate([[0.], cum_a[:-1]])
+    left_b = np.concatenate([[0.], cum_b[:-1]])
+    return cum_a, cum_b, left_a, left_b
+
+
+def two_sample_tests(sample_a: Dict[str, np.ndarray], sample_b: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """
+    Two-sample Kolmogorov-Smirnov, Cramér-von Mises and (standardized) Anderson-Darling statistics of every feature
+    between two prepared datasets (see sorted_sample). The sorted columns of both datasets are merged in linear time
+    and the ECDFs are evaluated at every distinct pooled value from running counts, so all three statistics come from
+    a single merge per feature.
+    With full samples the statistics are those of scipy.stats.ks_2samp, cramervonmises_2samp and anderson_ksamp
+    (ties use midranks) on the finite values of each feature. With quantile sketches every row counts for its number
+    of samples and the statistics are approximate. Features without finite values in one of the datasets have NaN
+    statistics, and so does the Anderson-Darling statistic of features with a single distinct value (which
+    anderson_ksamp rejects).
+
+    :param sample_a: First prepared dataset
+    :type sample_a: Dictionary
+    :param sample_b: Second prepared dataset
+    :type sample_b: Dictionary
+    :return: Dataframe with one row per feature: 'feature' index and the statistics
+    :rtype: pd.DataFrame
+    """
+    va, vb = sample_a['values'], sample_b['values']
+    d = len(va)
+    # Number of samples and of samples per row of each feature (scalars in samples prepared by earlier versions)
+    ns_a, ns_b = np.broadcast_to(sample_a['n'], d).astype(float), np.broadcast_to(sample_b['n'], d).astype(float)
+    ws_a, ws_b = np.broadcast_to(sample_a['weight'], d).astype(float), np.broadcast_to(sample_b['weight'], d).astype(float)
+    # Finite values are sorted before the NaNs
+    rows_a, rows_b = np.count_nonzero(~np.isnan(va), axis=1), np.count_nonzero(~np.isnan(vb), axis=1)
+    ks, cvm, ad = [np.full(d, np.nan) for _ in range(3)]
+    for j in range(d):
+        n_a, n_b, w_a, w_b = ns_a[j], ns_b[j], ws_a[j], ws_b[j]
+        if not (rows_a[j] and rows_b[j]):
+            continue
+        n_total = n_a + n_b
+        cum_a, cum_b, left_a, left_b = _merged_groups(va[j, :rows_a[j]], vb[j, :rows_b[j]], w_a, w_b)
+        f_a, f_b = cum_a - left_a, cum_b - left_b
+        left, group = left_a + left_b, f_a + f_b
+
+        # Kolmogorov-Smirnov: largest ECDF difference
+        ks[j] = np.abs(cum_a/n_a - cum_b/n_b).max()
+
+        # Cramér-von Mises: U = n_a sum (r_i - i)^2 + n_b sum (s_i - i)^2 with midranks r_i, s_i
+        rank = left + (group + 1) / 2
+        u = 0.
+        for n_i, f, left_i in ((n_a, f_a, left_a), (n_b, f_b, left_b)):
+            dist = rank - left_i
+            u += n_i * (f*dist**2 - dist*f*(f + 1) + f*(f + 1)*(2*f + 1)/6).sum()
+        cvm[j] = u / (n_a*n_b*n_total) - (4*n_a*n_b - 1) / (6*n_total)
+
+        # Anderson-Darling, midrank version
+        if len(group) < 2 or n_total < 4:
+            continue
+        b_j = left + group / 2
+        den = b_j*(n_total - b_j) - n_total*group/4
+        valid = den > 0
+        a2 = 0.
+        for n_i, f, left_i in ((n_a, f_a, left_a), (n_b, f_b, left_b)):
+            m_ij = left_i + f / 2
+            a2 += (group[valid] / n_total * (n_total*m_ij[valid] - b_j[valid]*n_i)**2 / den[valid]).sum() / n_i
+        ad[j] = (a2 * (n_total - 1) / n_total - 1) / _ad_sigma(n_a, n_b)
+
+    return pd.DataFrame({'feature': np.arange(len(va)), 'KS': ks, 'CvM': cvm, 'AD': ad})
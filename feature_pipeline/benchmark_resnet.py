@@ -0,0 +1,40 @@
+import argparse
+from itertools import product
+
+from extraction_utils import list_images
+from deep_utils import RESNET_PRECISIONS, benchmark_resnet, check_resnet_drift
+# ResNet50 CPU throughput benchmark
+#
+#   python benchmark_resnet.py --image_dir <dataset directory> --n_threads 8 16 --num_workers 2 4
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the ResNet50 feature extraction throughput (images/sec) of several inference configurations.')
+    parser.add_argument('--image_dir', type=str, required=True, help='Directory of benchmark images')
+    parser.add_argument('--n_images', type=int, default=256, help='Number of images per configuration')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[32], help='Numbers of images per batch')
+    parser.add_argument('--precisions', type=str, nargs='+', default=RESNET_PRECISIONS, choices=RESNET_PRECISIONS, help='Precisions')
+    parser.add_argument('--n_threads', type=int, nargs='+', default=[None], help='Numbers of intra-op threads, defaults to the CPUs not taken by the workers')
+    parser.add_argument('--num_workers', type=int, nargs='+', default=[2], help='Numbers of DataLoader worker processes')
+    parser.add_argument('--output', type=str, default='resnet_benchmark.csv', help='CSV file in which the results are saved')
+    args = parser.parse_args()
+
+    paths = list_images(args.image_dir)
+    assert paths, f"No images found in {args.image_dir}"
+
+    # Baseline: the previous eager float32 channels-first extraction, then every combination of the options
+    configs = [{'precision': 'fp32', 'channels_last': False, 'num_workers': 2, 'batch_size': 32}]
+    for precision, batch_size, n_threads, num_workers in product(args.precisions, args.batch_sizes, args.n_threads, args.num_workers):
+        configs.append({'precision': precision, 'channels_last': True, 'n_threads': n_threads,
+                        'num_workers': num_workers, 'batch_size': batch_size})
+    results = benchmark_resnet(paths, configs, n_images=args.n_images)
+    results.to_csv(args.output, index=False)
+    print(results.to_string(index=False))
+
+    for precision in args.precisions:
+        if precision != 'fp32':
+            print(f"{precision} drift from float32: {check_resnet_drift(paths, precision)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import os
+import json
+import hashlib
+import warnings
+from pathlib import Path
+from typing import List, Optional, Sequence
+import numpy as np
+# Content-addressed per-image feature cache
+
+HASH_INDEX_NAME = 'hash_index.json'
+
+
+def file_hash(path) -> str:
+    """
+    Compute the SHA-1 digest of the content of a file.
+
+    :param path: Path to file
+    :type path: str or Path
+    :return: Hex digest
+    :rtype: str
+    """
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def hash_files(paths: Sequence, cache_dir=None) -> List[str]:
+    """
+    Compute the content hashes of a list of files.
+    If a cache directory is given, the hashes are memoized in a sidecar index keyed by file path,
+    modification time and size, so only new or changed files are read.
+
+    :param paths: File paths
+    :type paths: List[Path]
+    :param cache_dir: Feature cache directory, defaults to None
+    :type cache_dir: str or Path
+    :return: Hex digests in the order of paths
+    :rtype: List[str]
+    """
+    index, index_path = {}, None
+    if cache_dir is not None:
+        index_path = Path(cache_dir)/HASH_INDEX_NAME
+        if index_path.exists():
+            try:
+                with open(index_path, 'r') as f:
+                    index = json.load(f)
+            except Exception as e:
+                print(f"Error loading hash index, re-hashing all files: {e}")
+
+    hashes, n_updated = [], 0
+    for p in paths:
+        key = str(Path(p).resolve())
+        st = os.stat(p)
+        entry = index.get(key)
+        if entry is None or entry[:2] != [st.st_mtime_ns, st.st_size]:
+            entry = [st.st_mtime_ns, st.st_size, file_hash(p)]
+            index[key] = entry
+            n_updated += 1
+        hashes.append(entry[2])
+
+    if index_path is not None and n_updated:
+        try:
+            index_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(str(index_path) + '.tmp', 'w') as f:
+                json.dump(index, f)
+            os.replace(str(index_path) + '.tmp', index_path)
+        except OSError as e:
+            warnings.warn(f"Could not write hash index to {index_path}: {e}")
+    return hashes
+
+
+def cache_entry_path(cache_dir, extractor: str, version: str, digest: str) -> Path:
+    """
+    Path of the cached features of one image. Entries are grouped by extractor name and version,
+    so changing the version of an extractor invalidates its cache.
+
+    :param cache_dir: Feature cache directory
+    :type cache_dir: str or Path
+    :param extractor: Extractor name
+    :type extractor: str
+    :param version: Extractor version
+    :type version: str
+    :param digest: Content hash of the image
+    :type digest: str
+    :return: Path to the .npy file of the entry
+    :rtype: Path
+    """
+    return Path(cache_dir)/f"{extractor}-{version}"/digest[:2]/f"{digest}.npy"
+
+
+def load_cached_features(cache_dir, extractor: str, version: str, hashes: Sequence[str]) -> List[Optional[np.ndarray]]:
+    """
+    Load the cached features of a list of images.
+
+    :param cache_dir: Feature cache directory
+    :type cache_dir: str or Path
+    :param extractor: Extractor name
+    :type extractor: str
+    :param version: Extractor version
+    :type version: str
+    :param hashes: Content hashes of the images
+    :type hashes: List[str]
+    :return: Feature vector of each image, or None if it is not cached
+    :rtype: List[np.ndarray]
+    """
+    feats = []
+    for digest in hashes:
+        path = cache_entry_path(cache_dir, extractor, version, digest)
+        try:
+            feats.append(np.load(path))
+        except (OSError, ValueError):
+            feats.append(None)
+    return feats
+
+
+def save_cached_features(cache_dir, extractor: str, version: str, hashes: Sequence[str], feats: np.ndarray):
+    """
+    Store the features of a list of images in the cache.
+
+    :param cache_dir: Feature cache directory
+    :type cache_dir: str or Path
+    :param extractor: Extractor name
+    :type extractor: str
+    :param version: Extractor version
+    :type version: str
+    :param hashes: Content hashes of the images
+    :type hashes: List[str]
+    :param feats: Features with one row per image
+    :type feats: np.ndarray
+    """
+    for digest, feat in zip(hashes, feats):
+        path = cache_entry_path(cache_dir, extractor, version, digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.stem + '.tmp.npy')
+        np.save(tmp_path, feat)
+        os.replace(tmp_path, path)
@@ -0,0 +1,362 @@
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+from keras.applications import VGG16
+from keras.applications.vgg16 import preprocess_input
+import pandas as pd
+import torch
+import torch.nn as nn
+from torch.utils.data import Dataset, DataLoader
+from torchvision import models, transforms
+
+from image_utils import load_image
+from feature_store import FeatureStore, append_features, delete_label
+from pipeline_utils import iter_image_batches, register_extractor
+# Batched deep feature extraction
+
+IMG_SIZE_VGG = (512,512)
+IMG_SIZE_RES = (224,224)
+DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+RESNET_TRANSFORM = transforms.Compose([
+    transforms.Resize(IMG_SIZE_RES),transforms.ToTensor(),
+    transforms.Normalize([0.485,0.456,0.406],[0.229,0.224,0.225])
+])
+
+# ResNet50 precisions: float32, bfloat16 autocast, and int8 (post-training quantized model, CPU only)
+RESNET_PRECISIONS = ['fp32', 'bf16', 'int8']
+RESNET_DIM = 2048
+VGG_DIM = 512
+
+# Pretrained weights of the models, and torchvision weights of ResNet50 for each precision
+VGG_WEIGHTS = 'imagenet'
+RESNET_WEIGHTS = {'fp32': 'IMAGENET1K_V1', 'bf16': 'IMAGENET1K_V1', 'int8': 'IMAGENET1K_FBGEMM_V1'}
+# Version of the deep features in the feature cache. Increment when the input preparation changes.
+DEEP_VERSION = '1'
+
+_vgg_models = {}
+_res_models = {}
+
+
+def load_vgg16_model(pooling: Optional[str] = 'avg'):
+    """
+    Load the ImageNet VGG16 model without the dense layers. Models are loaded once per process.
+
+    :param pooling: Pooling of the last convolutional feature map, 'avg', 'max' or None for the full spatial map
+    :type pooling: str
+    :return: Keras model
+    """
+    if pooling not in _vgg_models:
+        _vgg_models[pooling] = VGG16(weights=VGG_WEIGHTS, include_top=False, pooling=pooling)
+    return _vgg_models[pooling]
+
+
+def prepare_vgg16(img: Image.Image, target_size: Tuple[int, int] = IMG_SIZE_VGG) -> np.ndarray:
+    """
+    Convert a decoded image to the VGG16 input, resized as keras.preprocessing.image.load_img does.
+
+    :param img: Decoded image
+    :type img: PIL.Image.Image
+    :param target_size: Image size (height, width)
+    :type target_size: Tuple[int]
+    :return: float32 array with shape (height, width, 3)
+    :rtype: np.ndarray
+    """
+    img = img.convert('RGB')
+    if img.size != (target_size[1], target_size[0]):
+        img = img.resize((target_size[1], target_size[0]), Image.NEAREST)
+    return np.asarray(img, dtype=np.float32)
+
+
+def run_vgg16(batch: List[np.ndarray], pooling: Optional[str] = 'avg') -> np.ndarray:
+    """
+    Compute the VGG16 features of a batch of prepared images.
+
+    :param batch: Images prepared by prepare_vgg16
+    :type batch: List[np.ndarray]
+    :param pooling: Pooling of the last convolutional feature map, 'avg', 'max' or None for the full spatial map
+    :type pooling: str
+    :return: float32 features with one row per image
+    :rtype: np.ndarray
+    """
+    out = load_vgg16_model(pooling).predict_on_batch(preprocess_input(np.stack(batch)))
+    return np.asarray(out, dtype=np.float32).reshape(len(batch), -1)
+
+
+def vgg16_version(pooling: Optional[str] = 'avg') -> str:
+    """
+    Version of the VGG16 features in the feature cache, which changes with the weights, input size and pooling.
+    """
+    return f"{DEEP_VERSION}-{VGG_WEIGHTS}-{IMG_SIZE_VGG[0]}x{IMG_SIZE_VGG[1]}-{pooling or 'none'}"
+
+
+def vgg16_dim(pooling: Optional[str] = 'avg') -> int:
+    """
+    Number of VGG16 features per image. Without pooling the feature map is 32 times smaller than the input.
+    """
+    return VGG_DIM if pooling else (IMG_SIZE_VGG[0]//32) * (IMG_SIZE_VGG[1]//32) * VGG_DIM
+
+
+def configure_torch_threads(n_threads: Optional[int] = None, num_workers: int = 0):
+    """
+    Set the number of intra-op threads used by PyTorch on CPU. By default one thread is used per CPU
+    which is not taken by a DataLoader worker process.
+
+    :param n_threads: Number of intra-op threads, defaults to None
+    :type n_threads: int
+    :param num_workers: Number of DataLoader worker processes running alongside the model
+    :type num_workers: int
+    """
+    torch.set_num_threads(n_threads or max(1, (os.cpu_count() or 1) - num_workers))
+
+
+def load_resnet_model(precision: str = 'fp32', channels_last: bool = True):
+    """
+    Load the ImageNet ResNet50 model without the final classifier. Models are loaded once per process.
+    The int8 model is the post-training quantized ResNet50 of torchvision, quantized from the same ImageNet weights,
+    as dynamic quantization does not apply to convolutions. It runs on CPU only.
+
+    :param precision: 'fp32', 'bf16' (float32 weights, run with bfloat16 autocast) or 'int8'
+    :type precision: str
+    :param channels_last: Store the weights in channels-last (NHWC) memory layout
+    :type channels_last: bool
+    :return: PyTorch model in evaluation mode
+    """
+    assert precision in RESNET_PRECISIONS, f"Unknown precision {precision}, expected one of {RESNET_PRECISIONS}"
+    key = ('fp32' if precision == 'bf16' else precision, channels_last)
+    if key not in _res_models:
+        if precision == 'int8':
+            from torchvision.models import quantization
+            model = quantization.resnet50(weights=quantization.ResNet50_QuantizedWeights[RESNET_WEIGHTS[precision]], quantize=True)
+            model.fc = nn.Identity()
+        else:
+            r = models.resnet50(weights=models.ResNet50_Weights[RESNET_WEIGHTS[precision]])
+            model = nn.Sequential(*list(r.children())[:-1]).to(DEVICE)
+        model.eval()
+        if channels_last and precision != 'int8':
+            model = model.to(memory_format=torch.channels_last)
+        _res_models[key] = model
+    return _res_models[key]
+
+
+def resnet_version(precision: str = 'fp32') -> str:
+    """
+    Version of the ResNet50 features in the feature cache, which changes with the weights, input size and precision.
+    """
+    return f"{DEEP_VERSION}-{RESNET_WEIGHTS[precision]}-{IMG_SIZE_RES[0]}x{IMG_SIZE_RES[1]}-{precision}"
+
+
+def prepare_resnet(img: Image.Image) -> torch.Tensor:
+    """
+    Convert a decoded image to the normalised ResNet50 input tensor.
+    """
+    return RESNET_TRANSFORM(img.convert('RGB'))
+
+
+def resnet_forward(x: torch.Tensor, precision: str = 'fp32', channels_last: bool = True) -> torch.Tensor:
+    """
+    Compute the pooled ResNet50 features of a batch tensor in inference mode.
+
+    :param x: Batch of prepared images with shape (batch, 3, height, width)
+    :type x: torch.Tensor
+    :param precision: 'fp32', 'bf16' or 'int8'
+    :type precision: str
+    :param channels_last: Run the model in channels-last (NHWC) memory layout
+    :type channels_last: bool
+    :return: float32 features on CPU with shape (batch, 2048)
+    :rtype: torch.Tensor
+    """
+    model = load_resnet_model(precision, channels_last)
+    device = torch.device('cpu') if precision == 'int8' else DEVICE
+    with torch.inference_mode(), torch.autocast(device.type, dtype=torch.bfloat16, enabled=precision == 'bf16'):
+        x = x.to(device)
+        if channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        return model(x).reshape(x.size(0), -1).float().cpu()
+
+
+def run_resnet(batch: List[torch.Tensor], precision: str = 'fp32', channels_last: bool = True) -> np.ndarray:
+    """
+    Compute the pooled ResNet50 features of a batch of prepared images.
+
+    :param batch: Tensors prepared by prepare_resnet
+    :type batch: List[torch.Tensor]
+    :param precision: 'fp32', 'bf16' or 'int8'
+    :type precision: str
+    :param channels_last: Run the model in channels-last (NHWC) memory layout
+    :type channels_last: bool
+    :return: float32 features with one row per image
+    :rtype: np.ndarray
+    """
+    return resnet_forward(torch.stack(batch), precision, channels_last).numpy()
+
+
+register_extractor('vgg16', prepare_vgg16, run_vgg16, vgg16_version('avg'), vgg16_dim('avg'))
+register_extractor('resnet', prepare_resnet, run_resnet, resnet_version('fp32'), RESNET_DIM)
+
+
+def extract_vgg16_batched(image_paths: Sequence[Path], store_path, label: str, batch_size: int = 16,
+                          pooling: Optional[str] = 'avg', n_threads: int = 4, prefetch: int = 2,
+                          target_size: Tuple[int, int] = IMG_SIZE_VGG, root=None) -> np.ndarray:
+    """
+    Extract VGG16 features for a list of images in batches, with images decoded ahead on a thread pool.
+    Features are kept in float32 and appended to a feature store (see feature_store.py) after every batch,
+    replacing any features previously stored under the same label.
+
+    :param image_paths: Image paths
+    :type image_paths: List[Path]
+    :param store_path: Feature store directory
+    :type store_path: str or Path
+    :param label: Dataset label of the features in the store
+    :type label: str
+    :param batch_size: Number of images per batch
+    :type batch_size: int
+    :param pooling: Pooling of the last convolutional feature map, 'avg' (512 features), 'max' (512 features)
+        or None for the flattened spatial map (16x16x512 features for 512x512 images)
+    :type pooling: str
+    :param n_threads: Number of decoding threads
+    :type n_threads: int
+    :param prefetch: Number of batches decoded ahead
+    :type prefetch: int
+    :param target_size: Image size (height, width)
+    :type target_size: Tuple[int]
+    :param root: Dataset directory to which the stored filenames are relative, defaults to None which keeps the paths as given
+    :type root: str or Path
+    :return: Memory-mapped features of the dataset
+    :rtype: np.ndarray
+    """
+    paths = [str(p) for p in image_paths]
+    delete_label(store_path, label)
+    if not paths:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    load_fn = lambda p: prepare_vgg16(load_image(p), target_size)
+    n_batches = (len(paths) + batch_size - 1) // batch_size
+    for batch, batch_paths in tqdm(iter_image_batches(paths, load_fn, batch_size, n_threads, prefetch), total=n_batches):
+        out = run_vgg16(batch, pooling)
+        filenames = [os.path.relpath(p, root) for p in batch_paths] if root is not None else batch_paths
+        append_features(store_path, out, filenames, label)
+    return FeatureStore(store_path).dataset(label)
+
+
+class ResNetImageDataset(Dataset):
+    """
+    Dataset of images prepared for ResNet50, decoded in DataLoader worker processes.
+
+    :param paths: Image paths
+    :type paths: List[Path]
+    """
+
+    def __init__(self, paths: Sequence[Path]):
+        self.paths = [str(p) for p in paths]
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __getitem__(self, i: int) -> torch.Tensor:
+        return prepare_resnet(load_image(self.paths[i]))
+
+
+def extract_resnet(image_paths: Sequence[Path], batch_size: int = 32, num_workers: int = 2, precision: str = 'fp32',
+                   channels_last: bool = True, n_threads: Optional[int] = None) -> np.ndarray:
+    """
+    Extract ResNet50 features for a list of images. Images are decoded in DataLoader worker processes and
+    the features of each batch are written into a preallocated output array.
+
+    :param image_paths: Image paths
+    :type image_paths: List[Path]
+    :param batch_size: Number of images per batch
+    :type batch_size: int
+    :param num_workers: Number of DataLoader worker processes
+    :type num_workers: int
+    :param precision: 'fp32', 'bf16' or 'int8'
+    :type precision: str
+    :param channels_last: Run the model in channels-last (NHWC) memory layout
+    :type channels_last: bool
+    :param n_threads: Number of intra-op threads, defaults to None which uses the CPUs not taken by the workers
+    :type n_threads: int
+    :return: float32 features with one row per image
+    :rtype: np.ndarray
+    """
+    if DEVICE.type == 'cpu' or precision == 'int8':
+        configure_torch_threads(n_threads, num_workers)
+    out = np.empty((len(image_paths), RESNET_DIM), dtype=np.float32)
+    loader = DataLoader(ResNetImageDataset(image_paths), batch_size=batch_size, num_workers=num_workers)
+    i = 0
+    for x in tqdm(loader, total=len(loader)):
+        out[i:i+len(x)] = resnet_forward(x, precision, channels_last).numpy()
+        i += len(x)
+    return out
+
+
+def check_resnet_drift(image_paths: Sequence[Path], precision: str, n_images: int = 64, batch_size: int = 32,
+                       min_cosine: float = 0.99) -> Dict[str, float]:
+    """
+    Compare the ResNet50 features of a reduced precision with the float32 features on a sample of images.
+
+    :param image_paths: Image paths
+    :type image_paths: List[Path]
+    :param precision: 'bf16' or 'int8'
+    :type precision: str
+    :param n_images: Number of images, evenly spaced in image_paths
+    :type n_images: int
+    :param batch_size: Number of images per batch
+    :type batch_size: int
+    :param min_cosine: Smallest accepted cosine similarity between the features of an image
+    :type min_cosine: float
+    :return: Dictionary with the maximum absolute difference, mean relative error, mean and minimum cosine similarity
+    :rtype: Dictionary
+    """
+    paths = [image_paths[i] for i in np.linspace(0, len(image_paths) - 1, min(n_images, len(image_paths))).astype(int)]
+    ref = extract_resnet(paths, batch_size, num_workers=0, precision='fp32').astype(np.float64)
+    feats = extract_resnet(paths, batch_size, num_workers=0, precision=precision).astype(np.float64)
+    ref_norm, feats_norm = np.linalg.norm(ref, axis=1), np.linalg.norm(feats, axis=1)
+    cosine = (ref*feats).sum(axis=1) / np.maximum(ref_norm*feats_norm, 1e-12)
+    drift = {
+        'max_abs_diff': float(np.abs(ref - feats).max()),
+        'mean_rel_err': float((np.linalg.norm(ref - feats, axis=1) / np.maximum(ref_norm, 1e-12)).mean()),
+        'mean_cosine': float(cosine.mean()),
+        'min_cosine': float(cosine.min()),
+    }
+    if drift['min_cosine'] < min_cosine:
+        print(f"Warning: {precision} ResNet50 features drift from float32 (min cosine similarity {drift['min_cosine']:.4f} < {min_cosine})")
+    return drift
+
+
+def benchmark_resnet(image_paths: Sequence[Path], configs: Sequence[Dict], n_images: int = 256,
+                     batch_size: int = 32) -> pd.DataFrame:
+    """
+    Measure the ResNet50 extraction throughput of several configurations on the same images.
+    Each configuration is a dictionary of extract_resnet arguments (precision, channels_last, n_threads, num_workers,
+    batch_size). Each configuration is run once on one batch to load the model before timing, and its features are compared
+    with those of the float32 channels-first model.
+
+    :param image_paths: Image paths
+    :type image_paths: List[Path]
+    :param configs: Configurations
+    :type configs: List[Dictionary]
+    :param n_images: Number of images, the first n_images of image_paths
+    :type n_images: int
+    :param batch_size: Default number of images per batch
+    :type batch_size: int
+    :return: Dataframe with the configuration, images per second and cosine similarity to float32 of each configuration
+    :rtype: pd.DataFrame
+    """
+    paths = list(image_paths)[:n_images]
+    ref = extract_resnet(paths, batch_size, num_workers=0, precision='fp32', channels_last=False)
+    rows = []
+    for config in configs:
+        config = {'batch_size': batch_size, **config}
+        extract_resnet(paths[:config['batch_size']], **config)
+        start = time.perf_counter()
+        feats = extract_resnet(paths, **config)
+        elapsed = time.perf_counter() - start
+        cosine = (ref*feats).sum(axis=1) / np.maximum(np.linalg.norm(ref, axis=1)*np.linalg.norm(feats, axis=1), 1e-12)
+        rows.append({**config, 'n_threads': torch.get_num_threads(), 'images_per_sec': len(paths)/elapsed,
+                     'min_cosine': float(cosine.min())})
+        print(rows[-1])
+    return pd.DataFrame(rows)
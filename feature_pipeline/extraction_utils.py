@@ -0,0 +1,145 @@
+import os
+from pathlib import Path
+from typing import List, Optional, Sequence
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from handcrafted_utils import HANDCRAFTED_COLS, HANDCRAFTED_VERSION, compute_handcrafted_images, load_gray
+from cache_utils import hash_files, load_cached_features, save_cached_features
+# Parallel, checkpointed feature extraction over image datasets
+
+IMAGE_EXTS = {'.jpg','.jpeg','.png','.tif','.tiff','.dicom','.dcm'}
+
+
+def list_images(root, exts=IMAGE_EXTS) -> List[Path]:
+    """
+    Recursively list the image files in a dataset directory, sorted so that the order is reproducible.
+
+    :param root: Dataset directory
+    :type root: str or Path
+    :param exts: Image file extensions, defaults to IMAGE_EXTS
+    :type exts: Set[str]
+    :return: Sorted image paths
+    :rtype: List[Path]
+    """
+    return sorted(p for p in Path(root).rglob('*') if p.suffix.lower() in exts)
+
+
+def extract_handcrafted_chunk(paths: Sequence[str], checkpoint_path: Optional[str] = None) -> pd.DataFrame:
+    """
+    Compute the handcrafted features of a chunk of images with compute_handcrafted_images.
+    If a checkpoint path is given, the features are written to it together with the image filenames.
+
+    :param paths: Image paths
+    :type paths: List[str]
+    :param checkpoint_path: Path of the checkpoint CSV file, defaults to None
+    :type checkpoint_path: str
+    :return: Dataframe with a 'filename' column and the HANDCRAFTED_COLS features
+    :rtype: pd.DataFrame
+    """
+    feats = compute_handcrafted_images([load_gray(p) for p in paths])
+    df = pd.DataFrame(feats, columns=HANDCRAFTED_COLS)
+    df.insert(0, 'filename', [str(p) for p in paths])
+    if checkpoint_path is not None:
+        # Write then rename, so an interrupted write never leaves a partial checkpoint
+        df.to_csv(checkpoint_path + '.tmp', index=False)
+        os.replace(checkpoint_path + '.tmp', checkpoint_path)
+    return df
+
+
+def load_checkpoint(checkpoint_path: str, paths: Sequence[str]) -> Optional[pd.DataFrame]:
+    """
+    Load a chunk checkpoint if it exists and was computed for exactly the given images.
+
+    :param checkpoint_path: Path of the checkpoint CSV file
+    :type checkpoint_path: str
+    :param paths: Image paths of the chunk
+    :type paths: List[str]
+    :return: Checkpointed features, or None if the checkpoint is missing or stale
+    :rtype: pd.DataFrame
+    """
+    if not os.path.exists(checkpoint_path):
+        return None
+    try:
+        df = pd.read_csv(checkpoint_path, float_precision='round_trip')
+    except Exception as e:
+        print(f"Could not read checkpoint {checkpoint_path}: {e}")
+        return None
+    if df['filename'].astype(str).tolist() != [str(p) for p in paths]:
+        return None
+    return df
+
+
+def extract_handcrafted_parallel(image_paths: Sequence[Path], checkpoint_dir, chunk_size: int = 256,
+                                 n_workers: Optional[int] = None, cache_dir=None, root=None) -> pd.DataFrame:
+    """
+    Compute handcrafted features for a list of images on a process pool.
+    Images are split into chunks of chunk_size images, and each finished chunk is checkpointed in checkpoint_dir
+    with its filenames. Chunks with a valid checkpoint are loaded instead of recomputed, so an interrupted run
+    resumes from its checkpoints. Rows are returned in the order of image_paths regardless of the number of workers.
+    If a cache directory is given, features are also cached per image by content hash and extractor version
+    (see cache_utils.py), and only images which are not in the cache are processed.
+
+    :param image_paths: Image paths
+    :type image_paths: List[Path]
+    :param checkpoint_dir: Directory for chunk checkpoints
+    :type checkpoint_dir: str or Path
+    :param chunk_size: Number of images per work unit
+    :type chunk_size: int
+    :param n_workers: Number of worker processes, defaults to None which uses the number of CPUs
+    :type n_workers: int
+    :param cache_dir: Feature cache directory, defaults to None which disables the cache
+    :type cache_dir: str or Path
+    :param root: Dataset directory to which the output filenames are relative, defaults to None which keeps the paths as given
+    :type root: str or Path
+    :return: Dataframe with 'filename' and 'hash' columns and the HANDCRAFTED_COLS features
+    :rtype: pd.DataFrame
+    """
+    checkpoint_dir = Path(checkpoint_dir)
+    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+    paths = [str(p) for p in image_paths]
+    # The hash index is kept with the cache if there is one, so it is shared by all datasets
+    hashes = hash_files(paths, cache_dir if cache_dir is not None else checkpoint_dir)
+
+    feats = np.zeros((len(paths), len(HANDCRAFTED_COLS)), dtype=np.float32)
+    todo = list(range(len(paths)))
+    if cache_dir is not None:
+        cached = load_cached_features(cache_dir, 'handcrafted', HANDCRAFTED_VERSION, hashes)
+        todo = [i for i, f in enumerate(cached) if f is None]
+        for i, f in enumerate(cached):
+            if f is not None:
+                feats[i] = f
+        print(f"Loaded {len(paths)-len(todo)}/{len(paths)} images from the feature cache")
+
+    chunks = [todo[i:i+chunk_size] for i in range(0, len(todo), chunk_size)]
+    chunk_paths = [[paths[i] for i in chunk] for chunk in chunks]
+    checkpoint_paths = [str(checkpoint_dir/f"chunk_{i:06d}.csv") for i in range(len(chunks))]
+
+    def store(c, df):
+        feats[chunks[c]] = df[HANDCRAFTED_COLS].values
+        if cache_dir is not None:
+            save_cached_features(cache_dir, 'handcrafted', HANDCRAFTED_VERSION, [hashes[i] for i in chunks[c]], feats[chunks[c]])
+
+    pending = []
+    for c in range(len(chunks)):
+        df = load_checkpoint(checkpoint_paths[c], chunk_paths[c])
+        if df is None:
+            pending.append(c)
+        else:
+            store(c, df)
+    if len(pending) < len(chunks):
+        print(f"Resuming: {len(chunks)-len(pending)}/{len(chunks)} chunks loaded from checkpoints")
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = {executor.submit(extract_handcrafted_chunk, chunk_paths[c], checkpoint_paths[c]): c for c in pending}
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                store(futures[future], future.result())
+
+    df = pd.DataFrame(feats, columns=HANDCRAFTED_COLS)
+    filenames = [os.path.relpath(p, root) for p in paths] if root is not None else paths
+    df.insert(0, 'filename', filenames)
+    df.insert(1, 'hash', hashes)
+    return df
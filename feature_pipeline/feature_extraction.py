@@ -0,0 +1,301 @@
+import os
+import json
+import argparse
+from math import gcd
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+import pandas as pd
+
+from handcrafted_utils import HANDCRAFTED_COLS
+from extraction_utils import IMAGE_EXTS, list_images, extract_handcrafted_parallel
+from pipeline_utils import register_extractor, run_pipeline
+from cache_utils import hash_files
+from feature_store import FeatureStore, append_features, delete_label
+from tile_utils import MIN_FOREGROUND, SLIDE_EXTS, extract_tiled, tiled_feature_columns
+# Command-line feature extraction, shardable over several nodes
+#
+# Single node:
+#   python feature_extraction.py extract --manifest datasets.json --feature_types handcrafted vgg16
+# N nodes, then merge once all shards are done:
+#   python feature_extraction.py extract --manifest datasets.json --feature_types handcrafted vgg16 --shard i/N
+#   python feature_extraction.py merge --manifest datasets.json --feature_types handcrafted vgg16 --num_shards N
+
+FEATURE_TYPES = ['handcrafted', 'vgg16', 'resnet']
+
+
+def load_manifest(path) -> Dict[str, str]:
+    """
+    Load a dataset manifest, a JSON object mapping dataset names to image directories.
+    Relative directories are relative to the manifest file.
+
+    :param path: Path to manifest file
+    :type path: str or Path
+    :return: Dictionary with dataset names as keys and image directories as values
+    :rtype: Dictionary
+    """
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    return {name: str(Path(path).parent/d) for name, d in manifest.items()}
+
+
+def parse_shard(shard: str) -> Tuple[int, int]:
+    """
+    Parse a shard specification 'i/N' (shard i of N, counted from 0).
+    """
+    i, n = (int(x) for x in shard.split('/'))
+    if not 0 <= i < n:
+        raise argparse.ArgumentTypeError(f"Invalid shard {shard}, expected i/N with 0 <= i < N")
+    return i, n
+
+
+def shard_range(n_images: int, shard: int, n_shards: int, block_size: int) -> Tuple[int, int]:
+    """
+    Range of the images of a shard in the sorted image list of a dataset. Shards are contiguous and made of
+    whole blocks of block_size images, so every image is processed in the same chunk or batch as in a single-node run.
+
+    :param n_images: Number of images of the dataset
+    :type n_images: int
+    :param shard: Shard index
+    :type shard: int
+    :param n_shards: Number of shards
+    :type n_shards: int
+    :param block_size: Number of images per block
+    :type block_size: int
+    :return: Start and stop index of the shard
+    :rtype: Tuple[int]
+    """
+    n_blocks = (n_images + block_size - 1) // block_size
+    start = min(n_images, block_size * (n_blocks * shard // n_shards))
+    stop = min(n_images, block_size * (n_blocks * (shard + 1) // n_shards))
+    return start, stop
+
+
+def shard_dir(out_dir, shard: int, n_shards: int) -> Path:
+    """
+    Output directory of a shard. The single-node run (one shard) writes to out_dir directly.
+    """
+    if n_shards == 1:
+        return Path(out_dir)
+    return Path(out_dir)/'shards'/f"{shard:03d}-of-{n_shards:03d}"
+
+
+def handcrafted_path(out_dir, name: str) -> Path:
+    return Path(out_dir)/'handcrafted'/f"{name}_handcrafted.csv"
+
+
+def read_handcrafted(path) -> pd.DataFrame:
+    return pd.read_csv(path, dtype={'filename': str, 'hash': str}, float_precision='round_trip')
+
+
+def extract_dataset(name: str, root: str, feature_types: Sequence[str], out_dir, shard: int = 0, n_shards: int = 1,
+                    chunk_size: int = 256, batch_size: int = 32, n_workers=None, n_threads: int = 8,
+                    cache_dir=None, load_existing: bool = False, tile_size: Optional[int] = None,
+                    tile_stride: Optional[int] = None, tile_aggregations: Sequence[str] = ('mean',),
+                    min_foreground: float = MIN_FOREGROUND, keep_tiles: bool = False):
+    """
+    Extract the features of one dataset, or of one shard of it. Handcrafted features are saved as a CSV file
+    and deep features in one feature store per model, with the dataset name as label.
+    When only handcrafted features are requested they are computed on a process pool with checkpoints,
+    otherwise all feature types are computed in a single pass over the images (see pipeline_utils.run_pipeline).
+    If a tile size is given, images are read and processed tile by tile and the tile features are aggregated
+    to image-level features (see tile_utils.extract_tiled).
+
+    :param name: Dataset name
+    :type name: str
+    :param root: Dataset image directory
+    :type root: str
+    :param feature_types: Feature types to extract
+    :type feature_types: List[str]
+    :param out_dir: Output directory
+    :type out_dir: str or Path
+    :param shard: Shard index
+    :type shard: int
+    :param n_shards: Number of shards
+    :type n_shards: int
+    :param chunk_size: Number of images per checkpointed chunk of the handcrafted extraction
+    :type chunk_size: int
+    :param batch_size: Number of images per batch of the single-pass pipeline
+    :type batch_size: int
+    :param n_workers: Number of worker processes of the handcrafted extraction, defaults to None which uses the number of CPUs
+    :type n_workers: int
+    :param n_threads: Number of decoding threads of the single-pass pipeline
+    :type n_threads: int
+    :param cache_dir: Feature cache directory, defaults to None which disables the cache
+    :type cache_dir: str or Path
+    :param load_existing: Skip the feature types which are already extracted
+    :type load_existing: bool
+    :param tile_size: Tile width and height of the tiled extraction, defaults to None which processes whole images
+    :type tile_size: int
+    :param tile_stride: Distance between tiles, defaults to None which uses tile_size
+    :type tile_stride: int
+    :param tile_aggregations: Aggregations of the tile features, among 'mean', 'std', 'min' and 'max'
+    :type tile_aggregations: List[str]
+    :param min_foreground: Smallest fraction of non-zero pixels of a tile, tiles with less foreground are skipped.
+        Defaults to MIN_FOREGROUND, 0 keeps all tiles
+    :type min_foreground: float
+    :param keep_tiles: Keep the tile-level features in feature stores under out_dir/tiles
+    :type keep_tiles: bool
+    """
+    out = shard_dir(out_dir, shard, n_shards)
+    imgs = list_images(root, IMAGE_EXTS | SLIDE_EXTS if tile_size else IMAGE_EXTS)
+    n_images = len(imgs)
+    block_size = chunk_size * batch_size // gcd(chunk_size, batch_size)
+    start, stop = shard_range(n_images, shard, n_shards, block_size)
+    print(f"\n=== Dataset: {name} (images {start}-{stop} of {n_images}) ===")
+    imgs = imgs[start:stop]
+
+    todo = []
+    for ft in feature_types:
+        if ft == 'handcrafted':
+            done = handcrafted_path(out, name).exists()
+        else:
+            done = (out/ft/'index.csv').exists() and name in FeatureStore(out/ft).labels
+        if load_existing and done:
+            print(f"Skipping existing {ft} features of {name}")
+        else:
+            todo.append(ft)
+    if not todo:
+        return
+
+    if todo == ['handcrafted'] and not tile_size:
+        df = extract_handcrafted_parallel(imgs, out/'checkpoints'/f"{name}_handcrafted", chunk_size=chunk_size,
+                                          n_workers=n_workers, cache_dir=cache_dir, root=root)
+    else:
+        filenames = [os.path.relpath(p, root) for p in imgs]
+        if tile_size:
+            cols = tiled_feature_columns(HANDCRAFTED_COLS, tile_aggregations)
+            feats = extract_tiled(imgs, todo, tile_size, tile_stride, tile_aggregations, batch_size=batch_size,
+                                  n_threads=n_threads, n_workers=n_workers or 1, min_foreground=min_foreground,
+                                  tile_dirs={ft: out/'tiles'/ft for ft in todo} if keep_tiles else None, label=name, root=root,
+                                  cache_dir=cache_dir)
+            for ft in todo:
+                if ft != 'handcrafted':
+                    delete_label(out/ft, name)
+                    if filenames:
+                        append_features(out/ft, feats[ft], filenames, name)
+        else:
+            cols = HANDCRAFTED_COLS
+            feats = run_pipeline(imgs, todo, batch_size=batch_size, n_threads=n_threads,
+                                 store_dirs={ft: out/ft for ft in todo if ft != 'handcrafted'}, label=name, root=root,
+                                 cache_dir=cache_dir)
+        if 'handcrafted' in todo:
+            df = pd.DataFrame(feats['handcrafted'].reshape(len(imgs), len(cols)), columns=cols)
+            df.insert(0, 'filename', filenames)
+            df.insert(1, 'hash', hash_files(imgs, cache_dir if cache_dir is not None else out/'checkpoints'))
+    if 'handcrafted' in todo:
+        handcrafted_path(out, name).parent.mkdir(parents=True, exist_ok=True)
+        df.to_csv(handcrafted_path(out, name), index=False)
+
+    if n_shards > 1:
+        out.mkdir(parents=True, exist_ok=True)
+        with open(out/f"{name}_shard.json", 'w') as f:
+            json.dump({'shard': shard, 'n_shards': n_shards, 'start': start, 'stop': stop, 'n_images': n_images}, f)
+
+
+def merge_dataset(name: str, feature_types: Sequence[str], out_dir, n_shards: int) -> bool:
+    """
+    Combine the shard outputs of one dataset into its final feature files in out_dir.
+    Rows are concatenated in shard order, which is the order of a single-node run.
+
+    :param name: Dataset name
+    :type name: str
+    :param feature_types: Feature types to merge
+    :type feature_types: List[str]
+    :param out_dir: Output directory of the shards
+    :type out_dir: str or Path
+    :param n_shards: Number of shards
+    :type n_shards: int
+    :return: True if the dataset was merged, False if shard outputs are missing or inconsistent
+    :rtype: bool
+    """
+    dirs = [shard_dir(out_dir, i, n_shards) for i in range(n_shards)]
+    ranges = []
+    for d in dirs:
+        try:
+            with open(d/f"{name}_shard.json", 'r') as f:
+                ranges.append(json.load(f))
+        except OSError:
+            print(f"Missing shard output {d} for {name}, skipping")
+            return False
+    if (ranges[0]['start'] != 0 or ranges[-1]['stop'] != ranges[-1]['n_images']
+            or any(a['stop'] != b['start'] or a['n_images'] != b['n_images'] for a, b in zip(ranges, ranges[1:]))):
+        print(f"Shard ranges of {name} do not cover its images, skipping")
+        return False
+
+    for ft in feature_types:
+        if ft == 'handcrafted':
+            dfs = [read_handcrafted(handcrafted_path(d, name)) for d in dirs]
+            df = pd.concat(dfs, ignore_index=True)
+            handcrafted_path(out_dir, name).parent.mkdir(parents=True, exist_ok=True)
+            df.to_csv(handcrafted_path(out_dir, name), index=False)
+        else:
+            delete_label(Path(out_dir)/ft, name)
+            for d in dirs:
+                if not (d/ft/'index.csv').exists():
+                    continue
+                store = FeatureStore(d/ft)
+                if len(store.rows(name)):
+                    append_features(Path(out_dir)/ft, store.dataset(name), store.filenames(name), name)
+    print(f"Merged {n_shards} shards of {name} ({ranges[-1]['stop']} images)")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract image features for the datasets of a manifest, optionally as one shard of a multi-node run.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    extract_parser = subparsers.add_parser('extract', help='Extract features (of one shard)')
+    merge_parser = subparsers.add_parser('merge', help='Combine shard outputs into the final feature files')
+    for p in (extract_parser, merge_parser):
+        p.add_argument('--manifest', type=str, default='datasets.json', help='JSON file mapping dataset names to image directories')
+        p.add_argument('--datasets', type=str, nargs='*', default=None, help='Datasets of the manifest to process, defaults to all')
+        p.add_argument('--feature_types', type=str, nargs='+', default=['handcrafted'], choices=FEATURE_TYPES, help='Feature types')
+        p.add_argument('--output_dir', type=str, default='features_output', help='Directory in which the features are saved')
+    extract_parser.add_argument('--shard', type=parse_shard, default=(0, 1), help='Shard i/N of the images of each dataset, counted from 0')
+    extract_parser.add_argument('--load_existing', action='store_true', help='Skip the features which are already extracted')
+    extract_parser.add_argument('--cache_dir', type=str, default=None, help='Per-image feature cache directory')
+    extract_parser.add_argument('--n_workers', type=int, default=None, help='Number of worker processes of the handcrafted extraction')
+    extract_parser.add_argument('--chunk_size', type=int, default=256, help='Number of images per checkpointed chunk of the handcrafted extraction')
+    extract_parser.add_argument('--batch_size', type=int, default=32, help='Number of images per batch of the single-pass pipeline')
+    extract_parser.add_argument('--n_threads', type=int, default=8, help='Number of decoding threads of the single-pass pipeline')
+    extract_parser.add_argument('--vgg_pooling', type=str, default='avg', choices=['avg', 'max', 'none'], help='Pooling of the VGG16 feature map')
+    extract_parser.add_argument('--resnet_precision', type=str, default='fp32', choices=['fp32', 'bf16', 'int8'], help='Precision of the ResNet50 model')
+    extract_parser.add_argument('--tile_size', type=int, default=None, help='Tile width and height for tiled extraction of large images, defaults to whole images')
+    extract_parser.add_argument('--tile_stride', type=int, default=None, help='Distance between tiles, defaults to the tile size')
+    extract_parser.add_argument('--tile_aggregations', type=str, nargs='+', default=['mean'], choices=['mean', 'std', 'min', 'max'], help='Aggregations of the tile features')
+    extract_parser.add_argument('--min_foreground', type=float, default=MIN_FOREGROUND, help='Smallest fraction of non-zero pixels of a kept tile, 0 keeps all tiles')
+    extract_parser.add_argument('--keep_tiles', action='store_true', help='Keep the tile-level features')
+    extract_parser.add_argument('--torch_threads', type=int, default=None, help='Number of PyTorch intra-op threads, defaults to the number of CPUs')
+    merge_parser.add_argument('--num_shards', type=int, required=True, help='Number of shards of the run')
+    args = parser.parse_args()
+
+    manifest = load_manifest(args.manifest)
+    names: List[str] = args.datasets if args.datasets else list(manifest)
+    missing = [n for n in names if n not in manifest]
+    assert not missing, f"Datasets not in manifest: {missing}"
+
+    if args.command == 'extract':
+        if any(ft != 'handcrafted' for ft in args.feature_types):
+            # Deep models are only imported when used, so handcrafted runs do not need keras or torch
+            from deep_utils import (RESNET_DIM, prepare_vgg16, run_vgg16, vgg16_dim, vgg16_version, prepare_resnet,
+                                    run_resnet, resnet_version, configure_torch_threads)
+            pooling = None if args.vgg_pooling == 'none' else args.vgg_pooling
+            # The cache versions include the pooling and precision, so changing them does not reuse cached features
+            register_extractor('vgg16', prepare_vgg16, lambda batch: run_vgg16(batch, pooling),
+                               vgg16_version(pooling), vgg16_dim(pooling))
+            register_extractor('resnet', prepare_resnet, lambda batch: run_resnet(batch, args.resnet_precision),
+                               resnet_version(args.resnet_precision), RESNET_DIM)
+            configure_torch_threads(args.torch_threads)
+        shard, n_shards = args.shard
+        for name in names:
+            extract_dataset(name, manifest[name], args.feature_types, args.output_dir, shard, n_shards,
+                            chunk_size=args.chunk_size, batch_size=args.batch_size, n_workers=args.n_workers,
+                            n_threads=args.n_threads, cache_dir=args.cache_dir, load_existing=args.load_existing,
+                            tile_size=args.tile_size, tile_stride=args.tile_stride, tile_aggregations=args.tile_aggregations,
+                            min_foreground=args.min_foreground, keep_tiles=args.keep_tiles)
+    else:
+        for name in names:
+            merge_dataset(name, args.feature_types, args.output_dir, args.num_shards)
+
+
+if __name__ == "__main__":
+    main()
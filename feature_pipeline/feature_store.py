@@ -0,0 +1,226 @@
+import os
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+import pandas as pd
+# Memory-mapped, chunked feature store
+#
+# A store is a directory with:
+#   meta.json             feature dimension and number of rows per chunk
+#   chunk_XXXXXX.npy      float32 arrays of chunk_rows x dim rows, filled in order
+#   index.csv             one line per stored row: filename, label, chunk and row within the chunk
+# Rows are appended to the free rows of the last chunk and new chunks are created as needed.
+# The index is written after the features, so rows of an interrupted append are never indexed.
+# A store has a single writer at a time.
+
+META_NAME = 'meta.json'
+INDEX_NAME = 'index.csv'
+INDEX_COLS = ['filename', 'label', 'chunk', 'row']
+
+
+def _chunk_path(path, chunk: int) -> Path:
+    return Path(path)/f"chunk_{chunk:06d}.npy"
+
+
+def _last_indexed_row(path):
+    # Read only the end of the index, so appending batch by batch does not re-read the whole index.
+    # The block read grows until it holds the whole last line, which is decoded from its first byte, so a block
+    # boundary inside a multi-byte character of a filename is never decoded.
+    with open(Path(path)/INDEX_NAME, 'rb') as f:
+        size = f.seek(0, os.SEEK_END)
+        block = 4096
+        while True:
+            start = max(0, size - block)
+            f.seek(start)
+            tail = f.read().rstrip(b'\r\n')
+            if b'\n' in tail or start == 0:
+                break
+            block *= 2
+    last_line = tail.rsplit(b'\n', 1)[-1].decode().rstrip('\r')
+    if last_line == ','.join(INDEX_COLS):
+        return 0, -1
+    chunk, row = last_line.rsplit(',', 2)[1:]
+    return int(chunk), int(row)
+
+
+def create_feature_store(path, dim: int, chunk_rows: int = 65536):
+    """
+    Create an empty feature store.
+
+    :param path: Store directory
+    :type path: str or Path
+    :param dim: Number of features per row
+    :type dim: int
+    :param chunk_rows: Number of rows per chunk file
+    :type chunk_rows: int
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    with open(path/META_NAME, 'w') as f:
+        json.dump({'dim': int(dim), 'chunk_rows': int(chunk_rows), 'dtype': 'float32'}, f)
+    pd.DataFrame(columns=INDEX_COLS).to_csv(path/INDEX_NAME, index=False)
+
+
+def append_features(path, features: np.ndarray, filenames: Sequence[str], label: str, chunk_rows: int = 65536):
+    """
+    Append rows to a feature store. The store is created if it does not exist.
+
+    :param path: Store directory
+    :type path: str or Path
+    :param features: Features with one row per image
+    :type features: np.ndarray
+    :param filenames: Image filename of each row
+    :type filenames: List[str]
+    :param label: Dataset label of the rows
+    :type label: str
+    :param chunk_rows: Number of rows per chunk file, used when the store is created
+    :type chunk_rows: int
+    """
+    path = Path(path)
+    features = np.asarray(features, dtype=np.float32).reshape(len(filenames), -1)
+    if not (path/META_NAME).exists():
+        create_feature_store(path, features.shape[1], chunk_rows)
+    with open(path/META_NAME, 'r') as f:
+        meta = json.load(f)
+    assert features.shape[1] == meta['dim'], f"Expected {meta['dim']} features per row, got {features.shape[1]}"
+
+    # New rows follow the last indexed row. Rows after it only belong to deleted labels and are overwritten.
+    chunk, row = _last_indexed_row(path)
+    row += 1
+
+    rows, start = [], 0
+    while start < len(features):
+        if row == meta['chunk_rows']:
+            chunk, row = chunk + 1, 0
+        chunk_path = _chunk_path(path, chunk)
+        if chunk_path.exists():
+            arr = np.load(chunk_path, mmap_mode='r+')
+        else:
+            arr = np.lib.format.open_memmap(chunk_path, mode='w+', dtype=np.float32, shape=(meta['chunk_rows'], meta['dim']))
+        n = min(meta['chunk_rows'] - row, len(features) - start)
+        arr[row:row+n] = features[start:start+n]
+        arr.flush()
+        rows += [(filenames[start+i], label, chunk, row+i) for i in range(n)]
+        start, row = start + n, row + n
+
+    pd.DataFrame(rows, columns=INDEX_COLS).to_csv(path/INDEX_NAME, mode='a', header=False, index=False)
+
+
+def delete_label(path, label: str):
+    """
+    Remove the rows of a dataset label from the index of a feature store.
+    The feature rows stay in the chunk files but are no longer part of the store.
+
+    :param path: Store directory
+    :type path: str or Path
+    :param label: Dataset label
+    :type label: str
+    """
+    path = Path(path)
+    if not (path/INDEX_NAME).exists():
+        return
+    index = pd.read_csv(path/INDEX_NAME, dtype={'filename': str, 'label': str})
+    index[index['label'] != label].to_csv(str(path/INDEX_NAME) + '.tmp', index=False)
+    os.replace(str(path/INDEX_NAME) + '.tmp', path/INDEX_NAME)
+
+
+def import_npz(npz_path, path, label: str):
+    """
+    Add the features of a .npz file saved by earlier versions of the pipeline ('features' and optional 'filenames' arrays)
+    to a feature store. The file is read without allowing pickled objects.
+
+    :param npz_path: Path to .npz file
+    :type npz_path: str or Path
+    :param path: Store directory
+    :type path: str or Path
+    :param label: Dataset label of the features
+    :type label: str
+    """
+    with np.load(npz_path, allow_pickle=False) as data:
+        features = data['features'].reshape(len(data['features']), -1)
+        filenames = data['filenames'].astype(str).tolist() if 'filenames' in data else [str(i) for i in range(len(features))]
+    delete_label(path, label)
+    append_features(path, features, filenames, label)
+
+
+class FeatureStore:
+    """
+    Read-only view of a feature store. Chunk files are memory-mapped when first accessed,
+    so only the rows which are used are read from disk. Rows of a dataset which are contiguous
+    in one chunk are returned as a view of the memory map without copying.
+
+    :param path: Store directory
+    :type path: str or Path
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path/META_NAME, 'r') as f:
+            self.meta = json.load(f)
+        self.index = pd.read_csv(self.path/INDEX_NAME, dtype={'filename': str, 'label': str})
+        self._chunks: Dict[int, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @property
+    def dim(self) -> int:
+        return self.meta['dim']
+
+    @property
+    def labels(self) -> List[str]:
+        return self.index['label'].unique().tolist()
+
+    def _chunk(self, chunk: int) -> np.ndarray:
+        if chunk not in self._chunks:
+            self._chunks[chunk] = np.load(_chunk_path(self.path, chunk), mmap_mode='r')
+        return self._chunks[chunk]
+
+    def rows(self, label: Optional[str] = None) -> np.ndarray:
+        """
+        Positions in the index of the rows of a dataset label, or of all rows if label is None.
+        """
+        if label is None:
+            return np.arange(len(self.index))
+        return np.flatnonzero(self.index['label'].values == label)
+
+    def filenames(self, label: Optional[str] = None) -> List[str]:
+        """
+        Filenames of the rows of a dataset label, or of all rows if label is None.
+        """
+        return self.index['filename'].values[self.rows(label)].tolist()
+
+    def get(self, positions: Sequence[int]) -> np.ndarray:
+        """
+        Features of rows given by their positions in the index.
+
+        :param positions: Row positions
+        :type positions: List[int]
+        :return: Feature array with one row per position
+        :rtype: np.ndarray
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        chunks = self.index['chunk'].values[positions]
+        rows = self.index['row'].values[positions]
+        if len(positions) and (chunks == chunks[0]).all() and (np.diff(rows) == 1).all():
+            return self._chunk(int(chunks[0]))[rows[0]:rows[-1]+1]
+        out = np.empty((len(positions), self.dim), dtype=np.float32)
+        for chunk in np.unique(chunks):
+            mask = chunks == chunk
+            out[mask] = self._chunk(int(chunk))[rows[mask]]
+        return out
+
+    def dataset(self, label: str) -> np.ndarray:
+        """
+        Features of all the rows of a dataset label.
+        """
+        return self.get(self.rows(label))
+
+    def sample(self, label: str, n: int, seed: Optional[int] = None) -> np.ndarray:
+        """
+        Features of a random subset of n rows of a dataset label, without replacement.
+        """
+        positions = self.rows(label)
+        rng = np.random.default_rng(seed)
+        return self.get(np.sort(rng.choice(positions, size=min(n, len(positions)), replace=False)))
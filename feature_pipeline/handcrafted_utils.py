@@ -0,0 +1,252 @@
+from typing import Sequence, Tuple
+import numpy as np
+import pandas as pd
+import scipy.stats as stats
+import scipy.fft
+from skimage import feature
+from skimage.measure import label
+from skimage.morphology import local_maxima, local_minima
+try:
+    from gudhi import CubicalComplex
+except ImportError:
+    CubicalComplex = None
+
+from image_utils import load_image
+# Handcrafted statistical, edge, frequency and topological image features
+
+HANDCRAFTED_COLS = ['mean','std','skew','kurt','median',
+                    'edge_density','avg_edge_intensity',
+                    'low_freq_energy','high_freq_energy',
+                    'betti_0','betti_1']
+# Version of the handcrafted features in the feature cache. Increment when the feature computation changes.
+HANDCRAFTED_VERSION = '2'
+
+
+def load_gray(path) -> np.ndarray:
+    """
+    Load an image as a grayscale array.
+
+    :param path: Path to image file
+    :type path: str or Path
+    :return: 2D uint8 array
+    :rtype: np.ndarray
+    """
+    return np.array(load_image(path).convert('L'))
+
+
+def downsample_image(arr: np.ndarray, factor: int) -> np.ndarray:
+    """
+    Downsample an image by averaging non-overlapping factor x factor blocks.
+    Rows and columns which do not fill a whole block are cropped.
+
+    :param arr: 2D image
+    :type arr: np.ndarray
+    :param factor: Downsample factor
+    :type factor: int
+    :return: Downsampled image
+    :rtype: np.ndarray
+    """
+    if factor <= 1:
+        return arr
+    h, w = arr.shape[0]//factor, arr.shape[1]//factor
+    return arr[:h*factor, :w*factor].reshape(h, factor, w, factor).mean(axis=(1, 3))
+
+
+def betti_numbers_gudhi(arr: np.ndarray) -> Tuple[int, int]:
+    """
+    Count the dimension 0 and dimension 1 persistence pairs of the sublevel set filtration of an image
+    with a gudhi cubical complex.
+
+    :param arr: 2D image
+    :type arr: np.ndarray
+    :return: Betti-0 and Betti-1 counts
+    :rtype: Tuple[int]
+    """
+    if CubicalComplex is None:
+        raise ImportError("gudhi is required for the 'gudhi' Betti backend")
+    # gudhi expects the cells with the first dimension varying fastest
+    cc = CubicalComplex(dimensions=arr.shape, top_dimensional_cells=arr.flatten(order='F'))
+    pers = cc.persistence()
+    return sum(d==0 for d,_ in pers), sum(d==1 for d,_ in pers)
+
+
+def betti_numbers_fast(arr: np.ndarray) -> Tuple[int, int]:
+    """
+    Count the dimension 0 and dimension 1 persistence pairs of the sublevel set filtration of an image,
+    as computed by betti_numbers_gudhi, without computing the persistence diagram.
+
+    A connected component with non-zero persistence is born at every regional minimum of the image
+    (pixels connected through edges or corners), so Betti-0 is the number of regional minima.
+    A hole is a component of the complement of a sublevel set (pixels connected through edges only) which does not
+    touch the image border. It is born when the component is enclosed and filled at the regional maximum
+    of the component, so Betti-1 is the number of regional maxima which do not touch the border.
+    Regional extrema are found by flood fill and counted by connected component labelling.
+    A constant image (including single pixel images) has a single component, which skimage does not report as a minimum.
+
+    :param arr: 2D image
+    :type arr: np.ndarray
+    :return: Betti-0 and Betti-1 counts
+    :rtype: Tuple[int]
+    """
+    if arr.min() == arr.max():
+        return 1, 0
+    b0 = label(local_minima(arr, connectivity=2, allow_borders=True), connectivity=2).max()
+    maxima = label(local_maxima(arr, connectivity=1, allow_borders=True), connectivity=1)
+    border = np.concatenate([maxima[0], maxima[-1], maxima[:,0], maxima[:,-1]])
+    b1 = maxima.max() - np.count_nonzero(np.unique(border))
+    return int(b0), int(b1)
+
+
+BETTI_BACKENDS = {
+    'fast': betti_numbers_fast,
+    'gudhi': betti_numbers_gudhi,
+}
+
+
+def betti_numbers(arr: np.ndarray, backend: str = 'fast', downsample: int = 1) -> Tuple[int, int]:
+    """
+    Count the Betti-0 and Betti-1 persistence pairs of an image.
+
+    :param arr: 2D image
+    :type arr: np.ndarray
+    :param backend: 'fast' or 'gudhi'
+    :type backend: str
+    :param downsample: Factor by which the image is downsampled before counting, defaults to 1 (full resolution)
+    :type downsample: int
+    :return: Betti-0 and Betti-1 counts
+    :rtype: Tuple[int]
+    """
+    return BETTI_BACKENDS[backend](downsample_image(arr, downsample))
+
+
+def check_betti_backends(image_paths: Sequence, downsample: int = 1) -> pd.DataFrame:
+    """
+    Compare the Betti counts of the fast and gudhi backends on a set of images.
+
+    :param image_paths: Image paths
+    :type image_paths: List[Path]
+    :param downsample: Downsample factor
+    :type downsample: int
+    :return: Dataframe with the counts of both backends and a 'match' column for each image
+    :rtype: pd.DataFrame
+    """
+    rows = []
+    for p in image_paths:
+        arr = load_gray(p)
+        fast = betti_numbers(arr, 'fast', downsample)
+        ref = betti_numbers(arr, 'gudhi', downsample)
+        rows.append({'filename': str(p), 'betti_0': fast[0], 'betti_1': fast[1],
+                     'gudhi_betti_0': ref[0], 'gudhi_betti_1': ref[1], 'match': fast == ref})
+    return pd.DataFrame(rows)
+
+
+def compute_handcrafted(arr: np.ndarray, betti_backend: str = 'fast', betti_downsample: int = 1) -> np.ndarray:
+    """
+    Compute the handcrafted features of a grayscale image, in the order of HANDCRAFTED_COLS.
+
+    :param arr: 2D grayscale image
+    :type arr: np.ndarray
+    :param betti_backend: Backend for the Betti counts, 'fast' or 'gudhi'
+    :type betti_backend: str
+    :param betti_downsample: Downsample factor for the Betti counts, defaults to 1 (full resolution)
+    :type betti_downsample: int
+    :return: Feature vector
+    :rtype: np.ndarray
+    """
+    flat = arr.flatten(); m, s = flat.mean(), flat.std()
+    sk = stats.skew(flat); kt = stats.kurtosis(flat); md = np.median(flat)
+    edges = feature.canny(arr); ed_den = edges.mean()
+    ed_int = arr[edges].mean() if edges.any() else 0.0
+    fshift = np.fft.fftshift(np.fft.fft2(arr)); mag = np.abs(fshift)
+    lf, hf = mag[:10,:10].sum(), mag[-10:,-10:].sum()
+    b0, b1 = betti_numbers(arr, betti_backend, betti_downsample)
+    return np.array([m,s,sk,kt,md, ed_den,ed_int, lf,hf, b0,b1])
+
+
+def _spectrum_corner_index(n: int, corner: str) -> np.ndarray:
+    """
+    Frequency indices of the first ('low') or last ('high') 10 rows of an fftshift-ed spectrum of length n.
+    """
+    shifted = np.arange(min(10, n)) if corner == 'low' else np.arange(max(n - 10, 0), n)
+    return (shifted - n//2) % n
+
+
+def _corner_energy(spectrum: np.ndarray, height: int, width: int, corner: str) -> np.ndarray:
+    """
+    Sum of the magnitudes of a corner of the fftshift-ed 2D spectrum of each image, read from its rfft2 half spectrum.
+    """
+    rows = _spectrum_corner_index(height, corner)[:, None]
+    cols = _spectrum_corner_index(width, corner)[None, :]
+    # Columns beyond width//2 are the complex conjugates of the mirrored frequencies
+    mirrored = cols > width//2
+    rows = np.where(mirrored, -rows % height, rows)
+    cols = np.where(mirrored, -cols % width, cols)
+    return np.abs(spectrum[:, rows, cols]).sum(axis=(1, 2))
+
+
+def compute_handcrafted_batch(stack: np.ndarray, betti_backend: str = 'fast', betti_downsample: int = 1) -> np.ndarray:
+    """
+    Compute the handcrafted features of a stack of same-sized grayscale images, in the order of HANDCRAFTED_COLS.
+    Statistics and spectra are computed for the whole stack at once in float32, and the frequency energies are read
+    from a batched real FFT without shifting the spectrum. Canny edges and Betti counts are computed per image.
+
+    :param stack: 3D array of N grayscale images with shape (N, H, W)
+    :type stack: np.ndarray
+    :param betti_backend: Backend for the Betti counts, 'fast' or 'gudhi'
+    :type betti_backend: str
+    :param betti_downsample: Downsample factor for the Betti counts, defaults to 1 (full resolution)
+    :type betti_downsample: int
+    :return: Feature matrix with shape (N, len(HANDCRAFTED_COLS))
+    :rtype: np.ndarray
+    """
+    n, height, width = stack.shape
+    x = stack.reshape(n, -1).astype(np.float32)
+
+    m = x.mean(axis=1)
+    d = x - m[:, None]
+    d2 = d*d
+    m2 = d2.mean(axis=1); m3 = (d2*d).mean(axis=1); m4 = (d2*d2).mean(axis=1)
+    s = np.sqrt(m2)
+    # Biased skewness and excess kurtosis as returned by scipy.stats with default arguments
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sk = m3 / m2**1.5
+        kt = m4 / m2**2 - 3
+    md = np.median(stack.reshape(n, -1), axis=1).astype(np.float32)
+
+    # canny thresholds are relative to the maximum of the image dtype, so integer images are rescaled to [0, 1]
+    scale = 1/np.iinfo(stack.dtype).max if np.issubdtype(stack.dtype, np.integer) else 1
+    edges = np.stack([feature.canny(img) for img in x.reshape(stack.shape)*np.float32(scale)])
+    n_edges = edges.sum(axis=(1, 2))
+    ed_den = (n_edges / (height*width)).astype(np.float32)
+    ed_int = np.divide((x.reshape(stack.shape)*edges).sum(axis=(1, 2)), n_edges,
+                       out=np.zeros(n, dtype=np.float32), where=n_edges > 0)
+    betti = np.array([betti_numbers(img, betti_backend, betti_downsample) for img in stack], dtype=np.float32).reshape(n, 2)
+
+    spectrum = scipy.fft.rfft2(x.reshape(n, height, width))
+    lf = _corner_energy(spectrum, height, width, 'low')
+    hf = _corner_energy(spectrum, height, width, 'high')
+
+    return np.column_stack([m, s, sk, kt, md, ed_den, ed_int, lf, hf, betti[:, 0], betti[:, 1]])
+
+
+def compute_handcrafted_images(arrs: Sequence[np.ndarray], betti_backend: str = 'fast', betti_downsample: int = 1) -> np.ndarray:
+    """
+    Compute the handcrafted features of a list of grayscale images of any sizes.
+    Images of the same size are stacked and processed together by compute_handcrafted_batch.
+
+    :param arrs: 2D grayscale images
+    :type arrs: List[np.ndarray]
+    :param betti_backend: Backend for the Betti counts, 'fast' or 'gudhi'
+    :type betti_backend: str
+    :param betti_downsample: Downsample factor for the Betti counts, defaults to 1 (full resolution)
+    :type betti_downsample: int
+    :return: Feature matrix with shape (len(arrs), len(HANDCRAFTED_COLS))
+    :rtype: np.ndarray
+    """
+    feats = np.zeros((len(arrs), len(HANDCRAFTED_COLS)), dtype=np.float32)
+    shapes = {}
+    for i, arr in enumerate(arrs):
+        shapes.setdefault(arr.shape, []).append(i)
+    for idx in shapes.values():
+        feats[idx] = compute_handcrafted_batch(np.stack([arrs[i] for i in idx]), betti_backend, betti_downsample)
+    return feats
@@ -0,0 +1,74 @@
+from pathlib import Path
+import numpy as np
+from PIL import Image
+try:
+    import pydicom
+    from pydicom.pixels import apply_modality_lut, apply_voi_lut
+except ImportError:
+    pydicom = None
+# Image decoding for all supported formats
+
+DICOM_EXTS = {'.dicom','.dcm'}
+
+
+def scale_to_uint8(arr: np.ndarray, lo=None, hi=None) -> np.ndarray:
+    """
+    Scale pixel values linearly to 8 bits, lo to 0 and hi to 255. Values outside [lo, hi] are clipped.
+
+    :param arr: Pixel values
+    :type arr: np.ndarray
+    :param lo: Value mapped to 0, defaults to None which uses the minimum of arr
+    :type lo: float
+    :param hi: Value mapped to 255, defaults to None which uses the maximum of arr
+    :type hi: float
+    :return: 8-bit pixel values
+    :rtype: np.ndarray
+    """
+    arr = arr.astype(np.float32)
+    lo = arr.min() if lo is None else lo
+    hi = arr.max() if hi is None else hi
+    arr = (arr - lo) * (255/(hi - lo)) if hi > lo else np.zeros_like(arr)
+    return np.round(np.clip(arr, 0, 255)).astype(np.uint8)
+
+
+def read_dicom_image(path) -> Image.Image:
+    """
+    Decode the pixel data of a DICOM file. The modality and VOI LUTs (rescale and window) stored in the file are applied,
+    MONOCHROME1 images are inverted so that higher values are brighter, and the result is scaled to 8 bits.
+    Multi-frame files use the first frame.
+
+    :param path: Path to DICOM file
+    :type path: str or Path
+    :return: 8-bit grayscale ('L') or RGB image
+    :rtype: PIL.Image.Image
+    """
+    if pydicom is None:
+        raise ImportError("pydicom is required to read DICOM images")
+    ds = pydicom.dcmread(str(path))
+    arr = ds.pixel_array
+    n_samples = int(ds.get('SamplesPerPixel', 1))
+    if arr.ndim == (3 if n_samples == 1 else 4):
+        arr = arr[0]
+    if n_samples == 3:
+        return Image.fromarray(arr.astype(np.uint8), 'RGB')
+
+    arr = apply_voi_lut(apply_modality_lut(arr, ds), ds).astype(np.float32)
+    if ds.get('PhotometricInterpretation', '') == 'MONOCHROME1':
+        arr = arr.max() - arr
+    return Image.fromarray(scale_to_uint8(arr), 'L')
+
+
+def load_image(path) -> Image.Image:
+    """
+    Decode an image file. DICOM files are decoded with pydicom, other formats with PIL.
+
+    :param path: Path to image file
+    :type path: str or Path
+    :return: Decoded image
+    :rtype: PIL.Image.Image
+    """
+    if Path(path).suffix.lower() in DICOM_EXTS:
+        return read_dicom_image(path)
+    with Image.open(path) as img:
+        img.load()
+        return img
@@ -0,0 +1,177 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+
+from image_utils import load_image
+from handcrafted_utils import HANDCRAFTED_COLS, HANDCRAFTED_VERSION, compute_handcrafted_images
+from cache_utils import hash_files, load_cached_features, save_cached_features
+from feature_store import FeatureStore, append_features, delete_label
+# Single-pass image pipeline feeding several feature extractors
+
+# Registered extractors. Each extractor has a 'prepare' function which converts a decoded PIL image to its
+# input (resize, normalisation), run in the decoding threads, and a 'run' function which computes the features
+# of a list of prepared inputs and returns them as an array with one row per input. Extractors with a 'version'
+# have their features cached per image (see cache_utils.py). The 'dim' of an extractor, if known, is its number of
+# features, used for the rows of images without any features (e.g. tiled images without foreground).
+EXTRACTORS: Dict[str, Dict[str, Callable]] = {}
+
+
+def register_extractor(name: str, prepare: Callable, run: Callable, version: Optional[str] = None,
+                       dim: Optional[int] = None):
+    """
+    Register a feature extractor for run_pipeline. An extractor registered under an existing name replaces it.
+
+    :param name: Extractor name
+    :type name: str
+    :param prepare: Function which converts a decoded PIL image to the input of the extractor
+    :type prepare: Callable
+    :param run: Function which computes the features of a list of inputs, returned as an array with one row per input
+    :type run: Callable
+    :param version: Version of the features in the feature cache, defaults to None which disables caching.
+        Increment when the feature computation changes.
+    :type version: str
+    :param dim: Number of features per image, defaults to None (unknown)
+    :type dim: int
+    """
+    EXTRACTORS[name] = {'prepare': prepare, 'run': run, 'version': version, 'dim': dim}
+
+
+def iter_image_batches(paths: Sequence, load_fn: Callable, batch_size: int = 16, n_threads: int = 4,
+                       prefetch: int = 2) -> Iterator[Tuple[List, List]]:
+    """
+    Decode images on a thread pool and yield them in batches, in the order of paths.
+    Up to prefetch batches are decoded ahead of the batch being consumed.
+
+    :param paths: Image paths
+    :type paths: List[Path]
+    :param load_fn: Function which loads one image
+    :type load_fn: Callable
+    :param batch_size: Number of images per batch
+    :type batch_size: int
+    :param n_threads: Number of decoding threads
+    :type n_threads: int
+    :param prefetch: Number of batches decoded ahead
+    :type prefetch: int
+    :return: Iterator over (loaded images, paths of the batch)
+    :rtype: Iterator[Tuple[List, List]]
+    """
+    batches = iter([paths[i:i+batch_size] for i in range(0, len(paths), batch_size)])
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        queue = deque()
+
+        def submit_next():
+            batch = next(batches, None)
+            if batch is not None:
+                queue.append((batch, [executor.submit(load_fn, p) for p in batch]))
+
+        for _ in range(prefetch + 1):
+            submit_next()
+        while queue:
+            batch, futures = queue.popleft()
+            submit_next()
+            yield [f.result() for f in futures], batch
+
+
+def run_pipeline(image_paths: Sequence[Path], extractors: Sequence[str], batch_size: int = 32, n_threads: int = 8,
+                 prefetch: int = 2, store_dirs: Optional[Dict[str, str]] = None, label: Optional[str] = None,
+                 root=None, cache_dir=None) -> Dict[str, np.ndarray]:
+    """
+    Compute the features of several extractors in one pass over a list of images.
+    Each image is read and decoded once on a thread pool, together with the input preparation of every extractor,
+    and each batch of decoded images is passed to all the extractors.
+    If a cache directory is given, the features of versioned extractors are cached per image by content hash
+    (see cache_utils.py), and images are only decoded for the extractors whose features are not in the cache.
+
+    :param image_paths: Image paths
+    :type image_paths: List[Path]
+    :param extractors: Names of registered extractors
+    :type extractors: List[str]
+    :param batch_size: Number of images per batch
+    :type batch_size: int
+    :param n_threads: Number of decoding threads
+    :type n_threads: int
+    :param prefetch: Number of batches decoded ahead
+    :type prefetch: int
+    :param store_dirs: Feature store directory for each extractor whose features are appended to a store after every batch,
+        replacing the features previously stored under label, defaults to None which keeps all features in memory
+    :type store_dirs: Dictionary
+    :param label: Dataset label of the features in the feature stores
+    :type label: str
+    :param root: Dataset directory to which the stored filenames are relative, defaults to None which keeps the paths as given
+    :type root: str or Path
+    :param cache_dir: Feature cache directory, defaults to None which disables the cache
+    :type cache_dir: str or Path
+    :return: Dictionary with extractor names as keys and feature arrays with one row per image as values
+    :rtype: Dictionary
+    """
+    store_dirs = store_dirs or {}
+    paths = [str(p) for p in image_paths]
+    for name in extractors:
+        if name in store_dirs:
+            delete_label(store_dirs[name], label)
+
+    # Cached feature vectors of each versioned extractor, None for the images which are not in the cache
+    cached = {}
+    if cache_dir is not None:
+        hashes = hash_files(paths, cache_dir)
+        for name in extractors:
+            if EXTRACTORS[name]['version'] is not None:
+                cached[name] = load_cached_features(cache_dir, name, EXTRACTORS[name]['version'], hashes)
+                print(f"Loaded {sum(f is not None for f in cached[name])}/{len(paths)} {name} features from the feature cache")
+
+    def load_fn(i):
+        names = [name for name in extractors if name not in cached or cached[name][i] is None]
+        if not names:
+            return {}
+        img = load_image(paths[i])
+        return {name: EXTRACTORS[name]['prepare'](img) for name in names}
+
+    # In-memory features are written into arrays allocated when the feature dimension is known
+    feats = {name: None for name in extractors if name not in store_dirs}
+    n_batches = (len(paths) + batch_size - 1) // batch_size
+    start = 0
+    for inputs, batch in tqdm(iter_image_batches(list(range(len(paths))), load_fn, batch_size, n_threads, prefetch), total=n_batches):
+        stop = start + len(inputs)
+        batch_paths = [paths[i] for i in batch]
+        filenames = [os.path.relpath(p, root) for p in batch_paths] if root is not None else batch_paths
+        for name in extractors:
+            todo = [k for k, x in enumerate(inputs) if name in x]
+            if todo:
+                computed = np.asarray(EXTRACTORS[name]['run']([inputs[k][name] for k in todo]), dtype=np.float32).reshape(len(todo), -1)
+                if name in cached:
+                    save_cached_features(cache_dir, name, EXTRACTORS[name]['version'], [hashes[batch[k]] for k in todo], computed)
+            if len(todo) == len(inputs):
+                out = computed
+            else:
+                # Cached rows of the batch, completed with the computed rows
+                out = np.stack([np.asarray(cached[name][i], dtype=np.float32).ravel() if cached[name][i] is not None
+                                else np.zeros(computed.shape[1], dtype=np.float32) for i in batch])
+                if todo:
+                    out[todo] = computed
+            if name in store_dirs:
+                append_features(store_dirs[name], out, filenames, label)
+            else:
+                if feats[name] is None:
+                    feats[name] = np.empty((len(paths), out.shape[1]), dtype=np.float32)
+                feats[name][start:stop] = out
+        start = stop
+
+    results = {}
+    for name in extractors:
+        if name in store_dirs:
+            results[name] = FeatureStore(store_dirs[name]).dataset(label) if paths else np.zeros((0, 0), dtype=np.float32)
+        else:
+            results[name] = feats[name] if feats[name] is not None else np.zeros((0, 0), dtype=np.float32)
+    return results
+
+
+def prepare_handcrafted(img: Image.Image) -> np.ndarray:
+    return np.array(img.convert('L'))
+
+
+register_extractor('handcrafted', prepare_handcrafted, compute_handcrafted_images, HANDCRAFTED_VERSION, len(HANDCRAFTED_COLS))
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from handcrafted_utils import CubicalComplex, betti_numbers_fast, betti_numbers_gudhi
+# Tests of the fast Betti number backend against gudhi
+
+pytestmark = pytest.mark.skipif(CubicalComplex is None, reason="gudhi is not installed")
+
+
+@pytest.mark.parametrize('arr', [
+    np.zeros((5, 5)),
+    np.zeros((1, 1)),
+    np.ones((1, 7)),
+    np.zeros((64, 64), dtype=np.uint8),
+    np.full((3, 1), 255, dtype=np.uint8),
+    np.array([[0, 1, 2, 3]]),
+    np.array([[1, 0, 1, 0, 1]]),
+    np.array([[3], [1], [2]]),
+])
+def test_betti_fast_degenerate(arr):
+    assert betti_numbers_fast(arr) == betti_numbers_gudhi(arr)
+
+
+def test_betti_fast_random():
+    rng = np.random.default_rng(0)
+    for _ in range(300):
+        h, w = rng.integers(1, 16, 2)
+        arr = rng.integers(0, rng.integers(2, 8), (h, w)).astype(np.uint8)
+        assert betti_numbers_fast(arr) == betti_numbers_gudhi(arr)
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from handcrafted_utils import HANDCRAFTED_COLS, compute_handcrafted_images
+from tile_utils import (AGGREGATIONS, _TileAccumulator, extract_tiled, extract_tiled_image, tifffile, tile_grid,
+                        tiled_feature_columns)
+from feature_extraction import extract_dataset, handcrafted_path, read_handcrafted
+# Tests of the tiled extraction on images with blank regions
+
+
+@pytest.fixture
+def blank_region_tiff(tmp_path):
+    # 700 x 900 image whose 300 rightmost columns are blank
+    rng = np.random.default_rng(0)
+    arr = rng.integers(1, 256, (700, 900)).astype(np.uint8)
+    arr[:, 600:] = 0
+    path = tmp_path/'blank_region.tif'
+    tifffile.imwrite(path, arr, tile=(128, 128))
+    return path, arr
+
+
+def test_accumulator_skips_non_finite():
+    acc = _TileAccumulator()
+    acc.update(np.array([[1., np.nan], [3., np.inf]]), np.array([1., 1.]))
+    acc.update(np.array([[5., 2.]]), np.array([2.]))
+    mean, std, min_, max_ = acc.result(AGGREGATIONS, 2).reshape(4, 2)
+    assert np.allclose(mean, [3.5, 2.])
+    assert np.allclose(std, [np.sqrt(2.75), 0.])
+    assert np.allclose(min_, [1., 2.]) and np.allclose(max_, [5., 2.])
+
+    acc = _TileAccumulator()
+    acc.update(np.array([[1., np.nan]]), np.array([1.]))
+    assert np.isnan(acc.result(['mean', 'min'], 2)[[1, 3]]).all()
+
+
+@pytest.mark.skipif(tifffile is None, reason="tifffile and zarr are not installed")
+def test_blank_region_keeps_aggregates_finite(blank_region_tiff):
+    path, _ = blank_region_tiff
+    feats = extract_tiled_image(path, ['handcrafted'], tile_size=128, aggregations=AGGREGATIONS,
+                                n_threads=1, min_foreground=0.0)['features']['handcrafted']
+    assert feats.shape == (len(AGGREGATIONS) * len(HANDCRAFTED_COLS),)
+    assert np.isfinite(feats).all()
+
+
+@pytest.mark.skipif(tifffile is None, reason="tifffile and zarr are not installed")
+def test_blank_tiles_skipped_by_default(blank_region_tiff):
+    path, arr = blank_region_tiff
+    tiles = [t for t in tile_grid(900, 700, 128) if t[0] < 600]
+    tile_feats = compute_handcrafted_images([arr[y:y+h, x:x+w] for x, y, w, h in tiles]).astype(np.float32)
+    weights = np.array([w * h for _, _, w, h in tiles], dtype=np.float64)
+
+    result = extract_tiled_image(path, ['handcrafted'], tile_size=128, aggregations=['mean', 'min'], n_threads=1)
+    mean, min_ = result['features']['handcrafted'].reshape(2, -1)
+    assert np.allclose(mean, weights @ tile_feats / weights.sum(), rtol=1e-5)
+    assert np.allclose(min_, tile_feats.min(axis=0))
+
+
+@pytest.mark.skipif(tifffile is None, reason="tifffile and zarr are not installed")
+def test_16bit_tiles_scaled_to_8bit(tmp_path):
+    rng = np.random.default_rng(0)
+    arr = rng.integers(0, 4096, (300, 400)).astype(np.uint16)
+    tifffile.imwrite(tmp_path/'image16.tif', arr, tile=(64, 64))
+    tifffile.imwrite(tmp_path/'image8.tif', np.round(arr * (255/4095)).astype(np.uint8), tile=(64, 64))
+
+    feats16 = extract_tiled_image(tmp_path/'image16.tif', ['handcrafted'], tile_size=64, n_threads=1)['features']['handcrafted']
+    feats8 = extract_tiled_image(tmp_path/'image8.tif', ['handcrafted'], tile_size=64, n_threads=1)['features']['handcrafted']
+    assert np.allclose(feats16, feats8)
+
+
+@pytest.mark.skipif(tifffile is None, reason="tifffile and zarr are not installed")
+def test_tiles_sent_batch_by_batch(blank_region_tiff):
+    path, _ = blank_region_tiff
+    batches = []
+    result = extract_tiled_image(path, ['handcrafted'], tile_size=128, batch_size=4, n_threads=1,
+                                 tile_sink=lambda p, tiles, feats: batches.append((tiles, feats['handcrafted'])))
+    assert all(len(tiles) <= 4 and feats.shape == (len(tiles), len(HANDCRAFTED_COLS)) for tiles, feats in batches)
+    assert sum(len(tiles) for tiles, _ in batches) == len([t for t in tile_grid(900, 700, 128) if t[0] < 600])
+    expected = extract_tiled_image(path, ['handcrafted'], tile_size=128, batch_size=4, n_threads=1)
+    assert np.array_equal(result['features']['handcrafted'], expected['features']['handcrafted'])
+
+
+@pytest.mark.skipif(tifffile is None, reason="tifffile and zarr are not installed")
+def test_all_blank_images(tmp_path):
+    for i in range(2):
+        tifffile.imwrite(tmp_path/f'blank{i}.tif', np.zeros((300, 200), dtype=np.uint8), tile=(64, 64))
+    paths = sorted(tmp_path.glob('*.tif'))
+    aggregations = ['mean', 'std']
+
+    feats = extract_tiled(paths, ['handcrafted'], tile_size=64, aggregations=aggregations, n_threads=1,
+                          cache_dir=tmp_path/'cache')['handcrafted']
+    assert feats.shape == (2, len(aggregations) * len(HANDCRAFTED_COLS))
+    assert np.isnan(feats).all()
+    # Cached rows of images without foreground tiles have the full width
+    cached = [np.load(p) for p in (tmp_path/'cache').glob('handcrafted-*/*/*.npy')]
+    # Both blank images have the same content, so they share one cache entry
+    assert len(cached) == 1 and all(c.shape == (feats.shape[1],) for c in cached)
+
+    extract_dataset('blank', str(tmp_path), ['handcrafted'], tmp_path/'out', n_threads=1, tile_size=64,
+                    tile_aggregations=aggregations)
+    df = read_handcrafted(handcrafted_path(tmp_path/'out', 'blank'))
+    assert len(df) == 2 and df[tiled_feature_columns(HANDCRAFTED_COLS, aggregations)].isnull().all().all()
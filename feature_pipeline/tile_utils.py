@@ -0,0 +1,400 @@
+import os
+from collections import deque
+from functools import partial
+from itertools import islice
+from multiprocessing import Manager
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+try:
+    import openslide
+except ImportError:
+    openslide = None
+try:
+    import tifffile
+    import zarr
+except ImportError:
+    tifffile = None
+
+from image_utils import load_image, scale_to_uint8
+from pipeline_utils import EXTRACTORS, iter_image_batches
+from feature_store import append_features, delete_label
+from cache_utils import hash_files, load_cached_features, save_cached_features
+# Tiled feature extraction for images which do not fit in memory
+#
+# Images are read region by region (openslide for whole-slide formats, tifffile/zarr for tiled TIFF files),
+# tile-level features are computed batch by batch and reduced to image-level features with running accumulators,
+# so memory use depends on the tile size, batch size and prefetch depth, not on the image size.
+# Kept tile-level features are written to the feature stores batch by batch as well.
+# Other formats (PNG, JPEG, DICOM) cannot be read by region and are decoded whole before tiling.
+# Images with more than 8 bits per sample are scaled to 8 bits with the value range of the whole image, as DICOM images are.
+
+SLIDE_EXTS = {'.svs','.ndpi','.mrxs','.scn','.vms','.vmu','.bif','.svslide'}
+TIFF_EXTS = {'.tif','.tiff'}
+AGGREGATIONS = ['mean', 'std', 'min', 'max']
+# Default smallest fraction of non-zero pixels of a tile. Background tiles are constant, so their handcrafted
+# statistics (skew, kurtosis, Betti numbers) describe the background rather than the tissue.
+MIN_FOREGROUND = 0.05
+# Version of the tiled aggregation in the feature cache. Increment when the tiling or the aggregation changes.
+TILED_VERSION = '3'
+# Number of pixels per block read when computing the value range of an image
+RANGE_BLOCK_PIXELS = 1 << 24
+
+
+class RegionReader:
+    """
+    Reader of rectangular regions of the full-resolution level of an image. Regions of images with more than
+    8 bits per sample are scaled to 8 bits with the minimum and maximum of the whole image (see image_utils.scale_to_uint8).
+
+    :param path: Path to image file
+    :type path: str or Path
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        suffix = Path(path).suffix.lower()
+        self._slide, self._tiff, self._array = None, None, None
+        if openslide is not None and (suffix in SLIDE_EXTS or suffix in TIFF_EXTS) and openslide.OpenSlide.detect_format(self.path):
+            self._slide = openslide.OpenSlide(self.path)
+            self.size = self._slide.dimensions
+        elif tifffile is not None and suffix in TIFF_EXTS:
+            self._tiff = tifffile.TiffFile(self.path)
+            self._array = zarr.open(self._tiff.aszarr(level=0), mode='r')
+            self.size = (self._array.shape[1], self._array.shape[0])
+        else:
+            self._array = np.asarray(load_image(self.path))
+            self.size = (self._array.shape[1], self._array.shape[0])
+        self._range = None
+        if self._array is not None and self._array.dtype != np.uint8:
+            self._range = self._value_range()
+
+    def _value_range(self) -> Tuple[float, float]:
+        # Minimum and maximum of the image, read in blocks of rows so large images are not loaded whole
+        rows = max(1, RANGE_BLOCK_PIXELS // max(1, self._array[:1].size))
+        lo, hi = np.inf, -np.inf
+        for y in range(0, self._array.shape[0], rows):
+            block = np.asarray(self._array[y:y+rows])
+            lo, hi = min(lo, float(block.min())), max(hi, float(block.max()))
+        return lo, hi
+
+    def read(self, x: int, y: int, w: int, h: int) -> Image.Image:
+        """
+        Read a region of the image.
+
+        :param x: Left column of the region
+        :type x: int
+        :param y: Top row of the region
+        :type y: int
+        :param w: Width of the region
+        :type w: int
+        :param h: Height of the region
+        :type h: int
+        :return: Region image
+        :rtype: PIL.Image.Image
+        """
+        if self._slide is not None:
+            return self._slide.read_region((x, y), 0, (w, h)).convert('RGB')
+        region = np.asarray(self._array[y:y+h, x:x+w])
+        if self._range is not None:
+            region = scale_to_uint8(region, *self._range)
+        return Image.fromarray(np.ascontiguousarray(region))
+
+    def close(self):
+        if self._slide is not None:
+            self._slide.close()
+        if self._tiff is not None:
+            self._tiff.close()
+
+
+def tile_grid(width: int, height: int, tile_size: int, stride: Optional[int] = None) -> List[Tuple[int, int, int, int]]:
+    """
+    Tiles covering an image, in row-major order. Tiles at the right and bottom edges are clipped to the image.
+
+    :param width: Image width
+    :type width: int
+    :param height: Image height
+    :type height: int
+    :param tile_size: Tile width and height
+    :type tile_size: int
+    :param stride: Distance between tiles, defaults to None which uses tile_size (no overlap)
+    :type stride: int
+    :return: Tiles as (x, y, width, height)
+    :rtype: List[Tuple[int]]
+    """
+    stride = stride or tile_size
+    return [(x, y, min(tile_size, width - x), min(tile_size, height - y))
+            for y in range(0, height, stride) for x in range(0, width, stride)
+            if (x == 0 or x + tile_size - stride < width) and (y == 0 or y + tile_size - stride < height)]
+
+
+def tiled_feature_columns(cols: Sequence[str], aggregations: Sequence[str] = ('mean',)) -> List[str]:
+    """
+    Names of the image-level features aggregated from tile features. With the single aggregation 'mean'
+    the tile feature names are kept, otherwise the aggregation is appended to each name.
+    """
+    if list(aggregations) == ['mean']:
+        return list(cols)
+    return [f"{c}_{agg}" for agg in aggregations for c in cols]
+
+
+class _TileAccumulator:
+    # Running area-weighted sums, minimum and maximum of tile features, per feature over its finite tile values
+    # (e.g. the skewness of a constant tile is NaN). Features without any finite value aggregate to NaN.
+
+    def __init__(self):
+        self.weight, self.sum, self.sum_sq, self.min, self.max = None, None, None, None, None
+
+    def update(self, feats: np.ndarray, weights: np.ndarray):
+        feats = feats.astype(np.float64)
+        if self.sum is None:
+            self.weight, self.sum, self.sum_sq = np.zeros(feats.shape[1]), np.zeros(feats.shape[1]), np.zeros(feats.shape[1])
+            self.min, self.max = np.full(feats.shape[1], np.inf), np.full(feats.shape[1], -np.inf)
+        finite = np.isfinite(feats)
+        values = np.where(finite, feats, 0.)
+        self.weight += weights @ finite
+        self.sum += weights @ values
+        self.sum_sq += weights @ values**2
+        self.min = np.minimum(self.min, np.where(finite, feats, np.inf).min(axis=0))
+        self.max = np.maximum(self.max, np.where(finite, feats, -np.inf).max(axis=0))
+
+    def result(self, aggregations: Sequence[str], dim: int) -> np.ndarray:
+        if self.sum is None:
+            return np.full(len(aggregations) * dim, np.nan, dtype=np.float32)
+        valid = self.weight > 0
+        weight = np.where(valid, self.weight, 1.)
+        mean = self.sum / weight
+        values = {'mean': mean, 'std': np.sqrt(np.maximum(self.sum_sq / weight - mean**2, 0)),
+                  'min': self.min, 'max': self.max}
+        return np.concatenate([np.where(valid, values[agg], np.nan) for agg in aggregations]).astype(np.float32)
+
+
+def extract_tiled_image(path, extractors: Sequence[str], tile_size: int = 1024, stride: Optional[int] = None,
+                        aggregations: Sequence[str] = ('mean',), batch_size: int = 16, n_threads: int = 4,
+                        prefetch: int = 2, min_foreground: float = MIN_FOREGROUND, tile_sink: Optional[Callable] = None) -> Dict:
+    """
+    Compute tile-level features of one image with registered extractors (see pipeline_utils.register_extractor)
+    and aggregate them to image-level features. Regions are read and prepared for the extractors on a thread pool.
+    Aggregations are weighted by tile area, and non-finite tile features are left out of the aggregation of their feature.
+
+    :param path: Path to image file
+    :type path: str or Path
+    :param extractors: Names of registered extractors
+    :type extractors: List[str]
+    :param tile_size: Tile width and height
+    :type tile_size: int
+    :param stride: Distance between tiles, defaults to None which uses tile_size (no overlap)
+    :type stride: int
+    :param aggregations: Aggregations of the tile features, among 'mean', 'std', 'min' and 'max'
+    :type aggregations: List[str]
+    :param batch_size: Number of tiles per batch
+    :type batch_size: int
+    :param n_threads: Number of region reading threads
+    :type n_threads: int
+    :param prefetch: Number of batches read ahead
+    :type prefetch: int
+    :param min_foreground: Smallest fraction of non-zero pixels of a tile, tiles with less foreground are skipped.
+        Defaults to MIN_FOREGROUND, 0 keeps all tiles
+    :type min_foreground: float
+    :param tile_sink: Function called after every batch with the image path, the kept tiles of the batch and a dictionary
+        with their features for each extractor, defaults to None which does not keep tile-level features
+    :type tile_sink: Callable
+    :return: Dictionary with the image-level features of each extractor ('features')
+    :rtype: Dictionary
+    """
+    assert set(aggregations) <= set(AGGREGATIONS), f"Unknown aggregation, expected some of {AGGREGATIONS}"
+    if any(name not in EXTRACTORS for name in extractors):
+        import deep_utils  # registers the deep extractors in worker processes
+    reader = RegionReader(path)
+
+    def load_fn(tile):
+        region = reader.read(*tile)
+        if min_foreground > 0 and np.count_nonzero(np.asarray(region.convert('L'))) < min_foreground * tile[2] * tile[3]:
+            return None
+        return {name: EXTRACTORS[name]['prepare'](region) for name in extractors}
+
+    accumulators = {name: _TileAccumulator() for name in extractors}
+    dims = {}
+    try:
+        tiles = tile_grid(*reader.size, tile_size, stride)
+        for inputs, batch_tiles in iter_image_batches(tiles, load_fn, batch_size, n_threads, prefetch):
+            keep = [i for i, x in enumerate(inputs) if x is not None]
+            if not keep:
+                continue
+            weights = np.array([batch_tiles[i][2] * batch_tiles[i][3] for i in keep], dtype=np.float64)
+            batch_feats = {}
+            for name in extractors:
+                out = np.asarray(EXTRACTORS[name]['run']([inputs[i][name] for i in keep]), dtype=np.float32).reshape(len(keep), -1)
+                dims[name] = out.shape[1]
+                accumulators[name].update(out, weights)
+                batch_feats[name] = out
+            if tile_sink is not None:
+                tile_sink(str(path), [batch_tiles[i] for i in keep], batch_feats)
+    finally:
+        reader.close()
+
+    if len(dims) < len(extractors):
+        print(f"No foreground tiles in {path}")
+    return {'features': {name: accumulators[name].result(aggregations, dims.get(name, EXTRACTORS[name]['dim'] or 0))
+                         for name in extractors}}
+
+
+def extract_tiled(image_paths: Sequence[Path], extractors: Sequence[str], tile_size: int = 1024,
+                  stride: Optional[int] = None, aggregations: Sequence[str] = ('mean',), batch_size: int = 16,
+                  n_threads: int = 4, prefetch: int = 2, n_workers: int = 1, min_foreground: float = MIN_FOREGROUND,
+                  tile_dirs: Optional[Dict[str, str]] = None, label: Optional[str] = None, root=None,
+                  cache_dir=None) -> Dict[str, np.ndarray]:
+    """
+    Compute image-level features of a list of large images from tile-level features (see extract_tiled_image).
+    Images are processed on a pool of n_workers processes, each reading the regions of its image on n_threads threads.
+    Every process loads its own copy of the deep models, so deep extractors are best run with one worker.
+    Kept tile-level features are appended to their feature stores after every batch, by the workers through a bounded
+    queue to a single writer thread, so they are never held in memory for a whole image.
+    If a cache directory is given, the image-level features of versioned extractors are cached per image by content hash
+    and tiling parameters (see cache_utils.py). Tile-level features are not cached, so extractors in tile_dirs are always run.
+
+    :param image_paths: Image paths
+    :type image_paths: List[Path]
+    :param extractors: Names of registered extractors
+    :type extractors: List[str]
+    :param tile_size: Tile width and height
+    :type tile_size: int
+    :param stride: Distance between tiles, defaults to None which uses tile_size (no overlap)
+    :type stride: int
+    :param aggregations: Aggregations of the tile features, among 'mean', 'std', 'min' and 'max'
+    :type aggregations: List[str]
+    :param batch_size: Number of tiles per batch
+    :type batch_size: int
+    :param n_threads: Number of region reading threads per worker
+    :type n_threads: int
+    :param prefetch: Number of batches read ahead
+    :type prefetch: int
+    :param n_workers: Number of worker processes
+    :type n_workers: int
+    :param min_foreground: Smallest fraction of non-zero pixels of a tile, tiles with less foreground are skipped.
+        Defaults to MIN_FOREGROUND, 0 keeps all tiles
+    :type min_foreground: float
+    :param tile_dirs: Feature store directory for each extractor whose tile-level features are kept, replacing the features
+        previously stored under label. Tile rows are named '<filename>@<x>,<y>,<width>,<height>'. Defaults to None
+    :type tile_dirs: Dictionary
+    :param label: Dataset label of the tile features in the feature stores
+    :type label: str
+    :param root: Dataset directory to which the stored filenames are relative, defaults to None which keeps the paths as given
+    :type root: str or Path
+    :param cache_dir: Feature cache directory, defaults to None which disables the cache
+    :type cache_dir: str or Path
+    :return: Dictionary with extractor names as keys and image-level feature arrays with one row per image as values
+    :rtype: Dictionary
+    """
+    tile_dirs = tile_dirs or {}
+    paths = [str(p) for p in image_paths]
+    for name in tile_dirs:
+        delete_label(tile_dirs[name], label)
+
+    tile_sink, tile_queue, manager, writer = None, None, None, None
+    if tile_dirs:
+        tile_sink = partial(_store_tiles, tile_dirs, label, root)
+        if n_workers > 1:
+            # The feature stores have a single writer, which receives the tiles of the workers through a bounded queue
+            manager = Manager()
+            tile_queue = manager.Queue(maxsize=4 * n_workers)
+            writer = ThreadPoolExecutor(max_workers=1)
+            writer_future = writer.submit(_drain_tiles, tile_queue, tile_sink)
+            tile_sink = partial(_put_tiles, tile_queue)
+    kwargs = dict(tile_size=tile_size, stride=stride, aggregations=aggregations,
+                  batch_size=batch_size, n_threads=n_threads, prefetch=prefetch, min_foreground=min_foreground,
+                  tile_sink=tile_sink)
+
+    # Cached image-level features of each versioned extractor, None for the images which are not in the cache
+    cached, versions = {}, {}
+    if cache_dir is not None:
+        hashes = hash_files(paths, cache_dir)
+        tiling = f"tiled{TILED_VERSION}-{tile_size}-{stride or tile_size}-{min_foreground}-{'+'.join(aggregations)}"
+        for name in extractors:
+            if name not in tile_dirs and EXTRACTORS.get(name, {}).get('version') is not None:
+                versions[name] = f"{EXTRACTORS[name]['version']}-{tiling}"
+                cached[name] = load_cached_features(cache_dir, name, versions[name], hashes)
+                print(f"Loaded {sum(f is not None for f in cached[name])}/{len(paths)} {name} features from the feature cache")
+    # Extractors to run on each image
+    jobs = [(p, [name for name in extractors if name not in cached or cached[name][i] is None]) for i, p in enumerate(paths)]
+
+    feats = {name: [] for name in extractors}
+    executor = ProcessPoolExecutor(max_workers=n_workers) if n_workers > 1 else None
+    try:
+        # Results are consumed in image order, with at most 2*n_workers images in flight
+        if executor is None:
+            results = (extract_tiled_image(p, names, **kwargs) if names else None for p, names in jobs)
+        else:
+            results = _map_bounded(executor, jobs, kwargs, 2 * n_workers)
+        for i, ((path, names), result) in enumerate(tqdm(zip(jobs, results), total=len(jobs))):
+            for name in extractors:
+                if name not in names:
+                    feats[name].append(np.asarray(cached[name][i], dtype=np.float32))
+                    continue
+                feats[name].append(result['features'][name])
+                # Images without foreground of extractors with an unknown dimension have no features to cache
+                if name in cached and len(result['features'][name]):
+                    save_cached_features(cache_dir, name, versions[name], [hashes[i]], result['features'][name][None])
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if writer is not None:
+            tile_queue.put(None)
+            writer.shutdown()
+            manager.shutdown()
+    if writer is not None:
+        writer_future.result()
+
+    out = {}
+    for name in extractors:
+        known_dim = EXTRACTORS.get(name, {}).get('dim')
+        dim = known_dim * len(aggregations) if known_dim else max((len(f) for f in feats[name]), default=0)
+        out[name] = np.vstack([f if len(f) == dim else np.full(dim, np.nan, dtype=np.float32) for f in feats[name]]) \
+            if feats[name] else np.zeros((0, dim), dtype=np.float32)
+    return out
+
+
+def _store_tiles(tile_dirs, label, root, path, tiles, tile_feats):
+    # Append the features of a batch of kept tiles of an image to the tile feature stores
+    filename = os.path.relpath(path, root) if root is not None else path
+    tile_names = [f"{filename}@{x},{y},{w},{h}" for x, y, w, h in tiles]
+    for name, feats in tile_feats.items():
+        if name in tile_dirs:
+            append_features(tile_dirs[name], feats, tile_names, label)
+
+
+def _put_tiles(queue, path, tiles, tile_feats):
+    queue.put((path, tiles, tile_feats))
+
+
+def _drain_tiles(queue, store_tiles):
+    # Store the tiles received from the workers until the end marker. After an error the queue is still emptied,
+    # so workers blocked on the full queue can finish, and the error is raised at the end.
+    error = None
+    for item in iter(queue.get, None):
+        if error is None:
+            try:
+                store_tiles(*item)
+            except Exception as e:
+                error = e
+    if error is not None:
+        raise error
+
+
+def _map_bounded(executor, jobs, kwargs, max_pending):
+    # Submit images as results are consumed, so finished results do not pile up in memory.
+    # Images without extractors to run are not submitted and give None.
+    def submit(job):
+        path, names = job
+        return executor.submit(extract_tiled_image, path, names, **kwargs) if names else None
+
+    it = iter(jobs)
+    pending = deque(submit(job) for job in islice(it, max_pending))
+    while pending:
+        future = pending.popleft()
+        job = next(it, None)
+        if job is not None:
+            pending.append(submit(job))
+        yield future.result() if future is not None else None